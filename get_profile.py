@@ -1,7 +1,10 @@
 #!/usr/bin/python
 # -*- coding: latin-1 -*-
+import time
+STARTUP = [('start', time.time())] #(stage, time) for the startup timing report
+
 from utils.results import WorkspaceManager
-from utils import analysis, output, interface
+from utils import analysis, output, interface, calibration, camera, history, recording
 
 try:
     import ConfigParser
@@ -23,32 +26,29 @@ except ImportError:
 import cv2
 from PIL import Image, ImageTk
 import numpy as np
-import time
-import math
+import os
 
 from functools import partial
 from threading import Thread
 
-import matplotlib.pyplot as plt
+# matplotlib is imported when the first plot window opens
+
+def startup_mark(stage):
+    STARTUP.append((stage, time.time()))
 
 def clear_capture(capture):
     capture.release()
     cv2.destroyAllWindows()
 
-def count_cameras():
-    '''Counts up the total number of connected webcams'''
-    n = 0
-    for i in range(7):
-        try:
-            cap = cv2.VideoCapture(i)
-            ret, frame = cap.read()
-            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            clear_capture(cap)
-            n += 1
-        except:
-            clear_capture(cap)
-            break
-    return n
+def find_cameras():
+    '''Returns the connected webcams, from the cache if they have been looked for before.
+    The second value says whether the cached list still needs revalidating.'''
+    inventory = camera.load_inventory()
+    if inventory:
+        return inventory, True
+    inventory = camera.discover() #probes every index at once
+    camera.save_inventory(inventory)
+    return inventory, False
 
 def on_closing(controller):
     '''Closes the GUI.'''
@@ -84,9 +84,10 @@ class SplashScreen(Thread):
 
 class Application:
     def load_application(self):
-        self.camera_count = count_cameras()
+        self.inventory, self.revalidate = find_cameras()
 
     def load(self):
+        startup_mark('imports')
         root = tk.Tk()
 
         splash_screen = SplashScreen(root)
@@ -100,21 +101,30 @@ class Application:
         root.geometry("%dx%d+0+0" % (w, h))
         control = Controller(root)
         control.pack()
+        startup_mark('main window')
 
         root.bind('<space>', lambda e: control.profiler_active(option=True))
         root.protocol("WM_DELETE_WINDOW", partial(on_closing, control))
 
         loader_thread.join()
         print("Done loading stuff")
+        startup_mark('camera discovery')
 
-        if self.camera_count == 0:
+        if len(self.inventory) == 0:
             print('No webcam found!')
             raise SystemExit(0)
 
         control.init_camera() #initialise camera
+        startup_mark('camera')
+        control.start_cameras()
+        if control.disk_log_state.get() == 1:
+            control.toggle_disk_log(True)
         control.show_frame() #show video feed and update view with new information and refreshed plot etc
+        startup_mark('first frame')
 
-        control.load_camera_menu(self.camera_count)
+        control.load_camera_menu(self.inventory)
+        if self.revalidate: #started from the cached cameras, so check them while running
+            control.revalidate_cameras(self.inventory)
         control.load_workspace()
         w, h = control.parent.winfo_screenwidth(), control.parent.winfo_screenwidth()
         control.parent.minsize(w,int(h/16.1684))
@@ -125,6 +135,7 @@ class Application:
         print('Showing main window and starting application loop')
         root.deiconify()
         root.iconbitmap('images/mainsym.ico')
+        root.after(0, control.startup_report) #once the window is showing
         root.mainloop()
 
 class Controller(tk.Frame, WorkspaceManager):
@@ -156,30 +167,35 @@ class Controller(tk.Frame, WorkspaceManager):
         self.roi = 1
         self.exp = -1
         self.toolbarbuttons = [] #active buttons on the toolbar
-        self.toolbaractions = {'x cross profile': ['x cross profile', tk.PhotoImage(file='images/x_profile.gif').subsample(2, 2)], #accessible images for toolbarbuttons
-                              'y cross profile': ['y cross profile', tk.PhotoImage(file='images/y_profile.gif').subsample(2, 2)],
-                              '2d profile': ['2d profile', tk.PhotoImage(file='images/2d_profile.gif').subsample(2, 2)],
-                              '2d surface': ['2d surface', tk.PhotoImage(file='images/3d_profile.gif').subsample(2, 2)],
-                              'plot positions': ['positions', tk.PhotoImage(file='images/positions.gif').subsample(2, 2)],
-                              'beam stability': ['beam stability', tk.PhotoImage(file='images/beam_stability.gif').subsample(2, 2)],
-                              'plot orientation': ['orientation', tk.PhotoImage(file='images/orientation.gif').subsample(2, 2)],
-                              'increase exposure': ['inc_exp', tk.PhotoImage(file='images/increase_exp.gif').subsample(2, 2)],
-                              'decrease exposure': ['dec_exp', tk.PhotoImage(file='images/decrease_exp.gif').subsample(2, 2)],
-                              'view log': ['view_log', tk.PhotoImage(file='images/log.gif').subsample(2, 2)],
-                              'show windows': ['show windows', tk.PhotoImage(file='images/show_windows.gif').subsample(2, 2)],
-                              'clear windows': ['clear windows', tk.PhotoImage(file='images/clear_windows.gif').subsample(2, 2)],
-                              'basic workspace': ['basic workspace', tk.PhotoImage(file='images/basic_workspace.gif').subsample(2, 2)],
-                              'load workspace': ['load workspace', tk.PhotoImage(file='images/load_workspace.gif').subsample(2, 2)],
-                              'save workspace': ['save workspace', tk.PhotoImage(file='images/save_workspace.gif').subsample(2, 2)],
-                              'show webcam': ['show webcam', tk.PhotoImage(file='images/show_webcam.gif').subsample(2, 2)],
-                              'calculation results': ['calculation results', tk.PhotoImage(file='images/calc_results.gif').subsample(2, 2)]
+        self.icons = {} #subsampled toolbar icons, loaded on first use
+        self.toolbaractions = {'x cross profile': ['x cross profile', 'images/x_profile.gif'], #accessible images for toolbarbuttons
+                              'y cross profile': ['y cross profile', 'images/y_profile.gif'],
+                              '2d profile': ['2d profile', 'images/2d_profile.gif'],
+                              '2d surface': ['2d surface', 'images/3d_profile.gif'],
+                              'plot positions': ['positions', 'images/positions.gif'],
+                              'beam stability': ['beam stability', 'images/beam_stability.gif'],
+                              'plot orientation': ['orientation', 'images/orientation.gif'],
+                              'increase exposure': ['inc_exp', 'images/increase_exp.gif'],
+                              'decrease exposure': ['dec_exp', 'images/decrease_exp.gif'],
+                              'view log': ['view_log', 'images/log.gif'],
+                              'show windows': ['show windows', 'images/show_windows.gif'],
+                              'clear windows': ['clear windows', 'images/clear_windows.gif'],
+                              'basic workspace': ['basic workspace', 'images/basic_workspace.gif'],
+                              'load workspace': ['load workspace', 'images/load_workspace.gif'],
+                              'save workspace': ['save workspace', 'images/save_workspace.gif'],
+                              'show webcam': ['show webcam', 'images/show_webcam.gif'],
+                              'calculation results': ['calculation results', 'images/calc_results.gif']
                                }
         self.toolbaroptions = ['x Cross Profile', 'y Cross Profile'] #initial choices for active buttons on toolbar
         self.camera_index = 0
         self.beam_width, self.beam_width_e2, self.beam_diameter = None, None, None
+        self.width_scale = 1. #sensor_scale of the frame the widths were measured on
         self.centroid = None
         self.peak_cross = None
         self.power = np.nan
+        self.peak_value, self.min_value = np.nan, np.nan #pixel value statistics from the frame histogram
+        self.saturated_pixels, self.saturated_fraction = 0, 0.
+        self.noise_floor = np.nan
         self.colourmap = None
         self.style_sheet = 'default'
         self.graphs = { #if graphs are shown or not
@@ -191,31 +207,81 @@ class Controller(tk.Frame, WorkspaceManager):
         'centroid':True,
         'peak cross':True
         }
-        self.running_time = np.array([]) #arrays for information logged throughout the running period
-        self.centroid_hist_x, self.centroid_hist_y = np.array([]), np.array([])
-        self.peak_hist_x, self.peak_hist_y = np.array([]), np.array([])
-        self.ellipse_hist_angle, self.ma_hist, self.MA_hist, self.ellipticity_hist, self.eccentricity_hist = np.array([]), np.array([]), np.array([]), np.array([]), np.array([])
-        self.width_hist, self.width_e2_hist = np.array([]), np.array([])
+        self.history_recent = 600. #seconds of history kept at full resolution before decimating
+        self.history_memory = 100. #MB the history may take up
+        self.stats_window = 1000 #records the windowed statistics are taken over
+        self.fields = history.FIELDS #fields of the history records, with those of any further cameras
+        self.new_history() #information logged throughout the running period, with its running statistics and allan deviation
+        self.disk_log = None #writes the history to disk as it is made
+        self.disk_log_state = tk.IntVar()
+        self.log_directory = 'logs'
+        self.exporter = None #export running in the background
+        self.recorder = None #lossless recording of the analysis frames
+        self.recorder_failure = None #why the last recording stopped by itself, shown until the next one
+        self.recorder_state = tk.IntVar()
+        self.recording_directory = 'recordings'
+        self.event_ring = recording.EventRing() #frames from just before a pass/fail test fails
+        self.replay = None #recording or measurement log being played back in place of the camera
+        self.replay_stats = None #statistics of a measurement log replay, kept up with seeks
+        self.replay_controls = None
+        self.video, self.video_end = None, 0 #video being taken and when it stops
+        self.frame_id = 0 #count of frames read from the camera
+        self.export_columns = recording.EXPORT_DEFAULT
         self.MA, self.ma, self.ellipse_x, self.ellipse_y, self.ellipse_angle = np.nan, np.nan, np.nan, np.nan, None
         self.ellipticity, self.eccentricity = None, None
         self.tick_counter = 0
         self.plot_tick = 0.1 #refresh rate of plots in sec
         self.pixel_scale = 5.6 #default pixel scale of webcam in um
+        self.sensor_scale = 1. #configured resolution pixels per captured pixel. not 1 when a smaller capture mode is in use
+        self.sensor_width, self.sensor_height = 1, 1 #configured resolution
+        self.capture_modes = [(1280, 720, 0), (640, 360, 0), (320, 180, 0)] #modes tried when reducing the capture resolution
+        self.min_beam_pixels = 20 #smallest beam size in captured pixels when reducing the capture resolution
+        self.hardware_roi_state = tk.IntVar()
+        self.settle_frames = 0 #frames still to discard after a capture mode change
+        self.cameras = [] #further cameras profiled alongside this one, each on its own thread
+        self.distance = 0. #position of this camera along the beam in mm
+        self.align_tolerance = 0.05 #largest time difference in s between measurements treated as simultaneous
+        self.preview_mode = (320, 180, 0) #capture mode streamed and tracked in dual resolution mode
+        self.full_res_interval = 0 #seconds between full resolution measurements. 0 for on demand only
+        self.full_res_pending, self.last_full_res = False, 0
+        self.full_res_width, self.full_res_width_e2 = None, None #latest full resolution widths in um
+        self.dual_res_state = tk.IntVar()
 
         self.basic_workspace = [(0.4166666666666667, 0.4166666666666667, 0.4127604166666667, 0.7314814814814815, 'plot', 'x cross profile'), (0.4166666666666667, 0.4166666666666667, 0.8307291666666666, 0.7314814814814815, 'plot', 'y cross profile'), (0.4166666666666667, 0.41898148148148145, -0.004557291666666667, 0.7280092592592593, 'webcam'), (1.2454427083333333, 0.5, -0.0032552083333333335, 0.1863425925925926, 'plot', 'positions')]
         self.workspace = []
         self.width, self.height  = 1,1
+        self.transform = output.GeometricTransform() #cached rotation/crop/zoom/undistortion map
         self.stream = output.SoundFeedback(self) #for sound indicator. threaded process
 
         self.analysis_frame = None
+        self.idle = False #low power mode while nothing needs a live measurement
+        self.idle_interval = 200 #ms between frames when idle
+        self.frame_job = None
         self.analyse = analysis.Analyse(self) #creates instance for analysis routines
         self.analyse.start()
+        self.change_gate = analysis.ChangeGate() #skips analysis of frames that have not changed
+        self.gate_state = tk.IntVar()
+        self.frame_stack = analysis.FrameStack() #running average of the last n frames
+        self.stack_length = tk.IntVar(value=1)
+        self.stack_decimate = tk.IntVar()
+        self.last_results = None
+        self.auto_exposure = analysis.AutoExposure() #histogram driven exposure search
+        self.peak_percentile = 99.99 #percentile of the histogram taken as the beam peak, ignoring a few hot pixels
 
         self.raw_passfail = ['False'] * 7
         self.ellipse_passfail = ['False'] * 4
 
         self.bg_frame = 0
         self.bg_subtract = 0
+        self.bg_noise = None #per-pixel noise standard deviation from the background calibration
+        self.bg_cache = {} #background calibration at each capture mode used, keyed by (height, width)
+        self.bg_noise_level = np.nan
+        self.bg_model = calibration.BackgroundModel() #running background that tracks ambient drift
+        self.bg_model_state = tk.IntVar()
+        self.flatfield = calibration.FlatField() #dark frame and pixel gain correction, stored per camera and resolution
+        self.hotpixels = calibration.HotPixelMap() #bad sensor pixels patched from their neighbours
+        self.stack_capture = None #(kind, worker) while capturing dark or flat frames
+        self.calibration_frames = 100
 
         frame = tk.Frame.__init__(self, parent,relief=tk.GROOVE,width=100,height=100,bd=1)
         self.parent = parent
@@ -240,7 +306,9 @@ class Controller(tk.Frame, WorkspaceManager):
         ################################NAVIGATION BAR###################################NAVBAR
         self.menubar = tk.Menu(self.parent)
         fileMenu = tk.Menu(self.menubar, tearoff=1)
-        fileMenu.add_command(label="Export Data", command=self.save_csv)
+        fileMenu.add_command(label="Export Data", command=self.export_data)
+        fileMenu.add_checkbutton(label="Log measurements to disk", variable=self.disk_log_state, command=self.toggle_disk_log)
+        fileMenu.add_command(label="Replay Recording or Log", command=self.start_replay)
         fileMenu.add_separator()
         fileMenu.add_command(label="Quit", command=self.close_window)
         self.menubar.add_cascade(label="File", menu=fileMenu)
@@ -252,8 +320,24 @@ class Controller(tk.Frame, WorkspaceManager):
         controlMenu.add_separator()
         controlMenu.add_command(label="Calibrate background subtraction", command=self.progress.calibrate_bg)
         controlMenu.add_command(label="Reset background subtraction", command=self.progress.reset_bg)
+        controlMenu.add_checkbutton(label="Track background drift", variable=self.bg_model_state, command=self.toggle_bg_model)
+        controlMenu.add_command(label="Capture dark frames", command=self.capture_dark)
+        controlMenu.add_command(label="Capture flat-field frames", command=self.capture_flat)
+        controlMenu.add_command(label="Reset flat-field correction", command=self.reset_flatfield)
+        controlMenu.add_command(label="Reset hot pixel map", command=self.reset_hotpixels)
+        controlMenu.add_checkbutton(label="Skip unchanged frames", variable=self.gate_state, command=self.toggle_change_gate)
+        submenu = tk.Menu(controlMenu, tearoff=1)
+        for n in [1, 2, 4, 8, 16, 32]:
+            submenu.add_radiobutton(label=str(n), value=n, variable=self.stack_length, command=self.set_stack_length)
+        submenu.add_separator()
+        submenu.add_checkbutton(label="Analyse once every N frames", variable=self.stack_decimate, command=self.toggle_stack_decimate)
+        controlMenu.add_cascade(label='Average frames', menu=submenu, underline=0)
         controlMenu.add_separator()
+        controlMenu.add_command(label="Auto exposure", command=self.auto_expose)
         controlMenu.add_cascade(label='Change Camera', menu=self.camera_menu, underline=0)
+        controlMenu.add_checkbutton(label="Reduce capture resolution around beam", variable=self.hardware_roi_state, command=self.hardware_roi)
+        controlMenu.add_checkbutton(label="Dual resolution (low resolution preview)", variable=self.dual_res_state, command=self.dual_resolution)
+        controlMenu.add_command(label="Measure at full resolution", command=self.measure_full_res)
         controlMenu.add_separator()
         controlMenu.add_command(label="Show all windows", command= self.show_all)
         controlMenu.add_command(label="Close all windows", command= self.close_all)
@@ -269,7 +353,7 @@ class Controller(tk.Frame, WorkspaceManager):
         submenu.add_command(label="Max Pixel Value", command= lambda:self.stream.start('max pixel'))
         submenu.add_command(label="Orientation", command= lambda:self.stream.start('orientation'))
         controlMenu.add_cascade(label='Start Sound indicator', menu=submenu, underline=0)
-        controlMenu.add_command(label="Stop Sound", command= lambda:self.stream.streamer.stop_stream())
+        controlMenu.add_command(label="Stop Sound", command= lambda:self.stream.stop())
         self.menubar.add_cascade(label="Control", menu=controlMenu)
 
         windowMenu = tk.Menu(self.menubar, tearoff=1)
@@ -286,11 +370,15 @@ class Controller(tk.Frame, WorkspaceManager):
         windowMenu.add_command(label="Plot Orientation", command=lambda: self.view_plot('orientation'))
         windowMenu.add_separator()
         windowMenu.add_command(label="Beam Stability", command=lambda: self.view_plot('beam stability'))
+        windowMenu.add_command(label="Allan Deviation", command=lambda: self.view_plot('allan deviation'))
+        windowMenu.add_command(label="Intensity Histogram", command=lambda: self.view_plot('histogram'))
+        windowMenu.add_command(label="Pointing and Divergence", command=lambda: self.view_plot('pointing'))
         self.menubar.add_cascade(label="Windows", menu=windowMenu)
 
         imageMenu = tk.Menu(self.menubar, tearoff=1)
         imageMenu.add_command(label="Take Screenshot", command=self.save_screenshot)
         imageMenu.add_command(label="Take Video /10 s", command=lambda: self.save_video(10))
+        imageMenu.add_checkbutton(label="Record raw frames", variable=self.recorder_state, command=self.toggle_recording)
         imageMenu.add_separator()
         submenu = tk.Menu(imageMenu, tearoff=1)
         submenu.add_command(label="Normal", command= lambda: self.change_colourmap('normal'))
@@ -323,7 +411,7 @@ class Controller(tk.Frame, WorkspaceManager):
         self.pb = tk.Checkbutton(self.toolbar, text="Profiler Active (<space>)", variable=self.profiler_state, command=self.profiler_active)
         self.pb.pack(side=tk.LEFT, padx=2, pady=2)
 
-        self.cog = tk.PhotoImage(file='images/cog.gif').subsample(2, 2)
+        self.cog = self.icon('images/cog.gif')
         insertButt = tk.Button(self.toolbar, image=self.cog, width=32, height=32, text="Customise Toolbar", command=self.change_toolbar)
         insertButt.pack(side=tk.LEFT, padx=(2, 20), pady=2)
 
@@ -334,21 +422,76 @@ class Controller(tk.Frame, WorkspaceManager):
         for button in newbuttons:
             self.update_toolbar(button)
 
-    def load_camera_menu(self, camera_count):
-        for i in range(camera_count):
-            self.camera_menu.add_command(label=str(i), command= lambda i=i: self.change_cam(i))
+    def load_camera_menu(self, inventory):
+        self.camera_menu.delete(0, tk.END)
+        for cam in inventory:
+            i = cam['index']
+            label = str(i) + ' (' + str(cam.get('width', '?')) + 'x' + str(cam.get('height', '?')) + ' ' + str(cam.get('backend', '')) + ')'
+            self.camera_menu.add_command(label=label, command= lambda i=i: self.change_cam(i))
+
+    def revalidate_cameras(self, inventory):
+        '''Probes the camera indices again on a background thread, leaving those in use alone,
+        and refreshes the cache and camera menu with what is found.'''
+        in_use = [self.camera_index] + [cam.camera_index for cam in self.cameras]
+        skip = dict((cam['index'], cam) for cam in inventory if cam['index'] in in_use)
+        self.discovery = None
+        def run():
+            self.discovery = camera.discover(skip=skip)
+        thread = Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        self.after(500, self.check_discovery)
+
+    def check_discovery(self):
+        if self.discovery is None:
+            self.after(500, self.check_discovery)
+            return
+        camera.save_inventory(self.discovery)
+        self.load_camera_menu(self.discovery)
+        self.log('Found cameras ' + ', '.join(str(cam['index']) for cam in self.discovery))
+
+    def icon(self, filename):
+        '''Loads a toolbar icon at half size. Icons are only loaded when their button is shown,
+        and the subsampled copies are cached in memory and in images/cache.'''
+        if filename in self.icons:
+            return self.icons[filename]
+        cached = os.path.join('images', 'cache', os.path.basename(filename))
+        if os.path.isfile(cached) and os.path.getmtime(cached) >= os.path.getmtime(filename):
+            image = tk.PhotoImage(file=cached)
+        else:
+            image = tk.PhotoImage(file=filename).subsample(2, 2)
+            try:
+                if not os.path.isdir(os.path.dirname(cached)):
+                    os.makedirs(os.path.dirname(cached))
+                image.write(cached, format='gif')
+            except (OSError, IOError, tk.TclError):
+                pass #not writable, so subsample again next time
+        self.icons[filename] = image
+        return image
+
+    def startup_report(self):
+        '''Logs how long each stage of startup took, up to the window showing the first frame.'''
+        startup_mark('window shown')
+        stages = []
+        for (_, last), (stage, t) in zip(STARTUP[:-1], STARTUP[1:]):
+            stages.append(stage + ' ' + '{0:.2f}'.format(t - last) + ' s')
+        self.log('Startup: ' + ', '.join(stages) + '. Time to first frame ' + '{0:.2f}'.format(STARTUP[-1][1] - STARTUP[0][1]) + ' s')
 
     def refresh_plot(self):
         '''Refresh plot windows if they are active'''
         if len(self.plot_frames) > 0:
             for plot in self.plot_frames:
-                plot.refresh_frame()
+                if plot.is_shown(): #minimised and covered windows are not redrawn
+                    plot.refresh_frame()
 
     def change_style(self, option, set=False, verbose=True):
         '''Changes the style sheet used in the plot'''
         if self.style_sheet != option or set==True:
             if verbose: self.log('Changed style sheet ' + option)
             self.style_sheet = option
+            if not self.plot_frames and not set: #applied when the first plot window opens
+                return
+            import matplotlib.pyplot as plt
             plt.style.use(option)
             plt.cla()
             plt.clf()
@@ -371,6 +514,24 @@ class Controller(tk.Frame, WorkspaceManager):
         self.log('Changing exposure to ' + str(self.exp))
         self.cap.set(15, self.exp)
 
+    def auto_expose(self):
+        '''Starts searching for the exposure that puts the beam peak at the target level.'''
+        self.auto_exposure.start()
+        self.log('Searching for exposure, target peak ' + str(int(100*self.auto_exposure.target)) + '% of full scale')
+
+    def auto_exposure_step(self):
+        '''Feeds the histogram peak of the current frame to the exposure search.'''
+        new_exp = self.auto_exposure.next_exposure(self.exp, self.analyse.hist_percentile(self.peak_percentile))
+        if new_exp is not None:
+            self.exp = new_exp
+            self.cap.set(15, self.exp)
+        if not self.auto_exposure.active:
+            self.frame_stack.set_length(self.frame_stack.n) #drop frames averaged at other exposures
+            self.change_gate.reset()
+            self.log('Auto exposure settled at ' + str(self.exp))
+            if isinstance(self.bg_frame, np.ndarray) and not self.bg_model.enabled:
+                self.log('Background calibration may have been taken at a different exposure')
+
     def change_gain(self, option):
         '''Changes the gain of the camera.'''
         gain = float(option)
@@ -386,7 +547,153 @@ class Controller(tk.Frame, WorkspaceManager):
             raise Exception("Camera not accessible")
         self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
         self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        self.sensor_width, self.sensor_height = self.width, self.height
+        self.sensor_scale = 1.
+        self.hardware_roi_state.set(0)
         self.set_exp()
+        self.load_calibration()
+
+    def load_calibration(self):
+        '''Loads the flat-field and hot pixel calibrations for this camera and resolution.'''
+        filename = self.flatfield.load(self.camera_index, self.width, self.height)
+        if filename is not None:
+            self.log('Loaded flat-field calibration ' + filename)
+        filename = self.hotpixels.load(self.camera_index, self.width, self.height)
+        if filename is not None:
+            self.log('Loaded hot pixel map ' + filename + ' (' + str(len(self.hotpixels.bad)) + ' pixels)')
+
+    def frame_pixel_scale(self):
+        '''Size in um of a pixel of the current frame.'''
+        return self.pixel_scale*self.sensor_scale
+
+    def set_capture_mode(self, width, height, fps=0):
+        '''Renegotiates the capture mode with the camera. Measurements keep being logged in
+        pixels of the configured resolution through sensor_scale.'''
+        self.width, self.height, actual_fps = camera.negotiate_mode(self.cap, width, height, fps)
+        self.sensor_scale = self.sensor_width/float(self.width)
+        self.load_calibration()
+        self.settle_frames = 3 #the driver may still hand over frames in the old mode
+        if isinstance(self.bg_frame, np.ndarray) and self.bg_frame.shape[:2] != (self.height, self.width):
+            self.bg_cache[self.bg_frame.shape[:2]] = self.bg_frame.copy(), self.bg_noise #so switching back does not resample twice
+            if (self.height, self.width) in self.bg_cache:
+                self.bg_frame, self.bg_noise = self.bg_cache[(self.height, self.width)]
+                self.bg_frame = self.bg_frame.copy()
+            else:
+                self.bg_frame = cv2.resize(self.bg_frame, (self.width, self.height), interpolation=cv2.INTER_AREA)
+                if self.bg_noise is not None:
+                    self.bg_noise = cv2.resize(self.bg_noise, (self.width, self.height), interpolation=cv2.INTER_AREA)
+            if self.bg_model.enabled:
+                self.bg_model.reset(self.bg_frame, self.bg_noise)
+        self.log('Capture mode now ' + str(self.width) + 'x' + str(self.height) + ' at ' + str(actual_fps) + ' fps (sensor scale ' + '{0:.2f}'.format(self.sensor_scale) + ')')
+
+    def hardware_roi(self, option=None):
+        '''Drops to the smallest capture mode that still resolves the located beam, raising the
+        frame rate, or restores the configured resolution.'''
+        if option is None:
+            option = self.hardware_roi_state.get() == 1
+        if not option:
+            self.set_capture_mode(self.sensor_width, self.sensor_height)
+            self.hardware_roi_state.set(0)
+            return
+        self.dual_res_state.set(0)
+        if self.peak_cross is None or self.peak_cross == (np.nan, np.nan):
+            self.log('Locate the beam with the profiler before reducing the capture resolution')
+            self.hardware_roi_state.set(0)
+            return
+        beam_size = self.MA if str(self.MA) != 'nan' else 50
+        mode = camera.choose_mode(self.capture_modes, self.sensor_width, beam_size*self.sensor_scale, self.min_beam_pixels)
+        if mode is None or mode[0] >= self.sensor_width:
+            self.log('No smaller capture mode would still resolve the beam')
+            self.hardware_roi_state.set(0)
+            return
+        self.set_capture_mode(*mode)
+        self.hardware_roi_state.set(1)
+
+    def dual_resolution(self, option=None):
+        '''Streams and tracks the beam in the low resolution preview mode, measuring at full
+        resolution periodically or on demand.'''
+        if option is None:
+            option = self.dual_res_state.get() == 1
+        self.full_res_pending = False
+        if not option:
+            self.set_capture_mode(self.sensor_width, self.sensor_height)
+            self.dual_res_state.set(0)
+            return
+        if self.preview_mode[0] >= self.sensor_width:
+            self.log('Preview mode must be smaller than the configured resolution')
+            self.dual_res_state.set(0)
+            return
+        self.hardware_roi_state.set(0)
+        self.set_capture_mode(*self.preview_mode)
+        self.last_full_res = time.time()
+        self.dual_res_state.set(1)
+
+    def measure_full_res(self):
+        '''Switches to full resolution for a single measurement, then back to the preview.'''
+        if self.dual_res_state.get() != 1:
+            self.log('Full resolution measurements are taken in dual resolution mode')
+            return
+        if not self.active:
+            self.log('Activate the profiler to measure at full resolution')
+            return
+        if self.full_res_pending:
+            return
+        self.full_res_pending = True
+        self.set_capture_mode(self.sensor_width, self.sensor_height)
+        if self.width != self.sensor_width:
+            self.log('Camera did not return to full resolution')
+            self.full_res_pending = False
+            self.set_capture_mode(*self.preview_mode)
+
+    def finish_full_res(self):
+        '''Keeps the widths measured on the full resolution frame, whose record in the history
+        is flagged full_res, shows them in the calculation results and returns to the preview.'''
+        self.full_res_pending = False
+        self.last_full_res = time.time()
+        scale = self.frame_pixel_scale()
+        self.full_res_width = np.array(self.beam_width, dtype=float)*scale if self.beam_width is not None else None
+        self.full_res_width_e2 = np.array(self.beam_width_e2, dtype=float)*scale if self.beam_width_e2 is not None else None
+        self.log('Full resolution widths (um): ' + str(self.full_res_width) + ', 1/e^2: ' + str(self.full_res_width_e2))
+        if self.info_frame is not None:
+            self.info_frame.refresh_frame()
+        self.set_capture_mode(*self.preview_mode)
+
+    def start_cameras(self):
+        '''Starts capturing on the further cameras given in the config.'''
+        for cam in self.cameras:
+            cam.start()
+            self.log('Started ' + cam.name + ' (camera ' + str(cam.camera_index) + ') at ' + str(cam.distance) + ' mm')
+
+    def poll_cameras(self):
+        '''Collects the measurements of the further cameras, once per frame of this one, and
+        stops any camera that has failed.'''
+        for cam in list(self.cameras):
+            cam.poll()
+            if cam.error is not None:
+                self.log(cam.name + ' (camera ' + str(cam.camera_index) + ') ' + cam.error + ', so it has been stopped')
+                cam.stop()
+                self.cameras.remove(cam)
+
+    def record_pointing(self, frame_time, frame):
+        '''Aligns the further cameras with this frame, read at frame_time, and records the pointing
+        angle and divergence between the nearest and furthest planes measured, along with what
+        each further camera measured. The frame is measured before rotation and zoom, in the
+        sensor's own coordinates like the further cameras' frames.'''
+        grey = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        planes = [(self.distance, np.array(camera.beam_moments(grey))*self.frame_pixel_scale())]
+        measurements = {} #each camera's own centroid and widths, in um
+        for cam in self.cameras:
+            measurement = cam.at(frame_time, self.align_tolerance)
+            if measurement is not None:
+                planes.append((cam.distance, measurement))
+                prefix = cam.name.lower()
+                measurements.update({prefix + '_centroid_x': measurement[0], prefix + '_centroid_y': measurement[1], prefix + '_width': measurement[2:4]})
+        planes.sort(key=lambda plane: plane[0])
+        if len(planes) > 1 and planes[-1][0] != planes[0][0]:
+            angle_x, angle_y, divergence = camera.pointing(planes[0][1], planes[-1][1], planes[-1][0] - planes[0][0])
+        else:
+            angle_x, angle_y, divergence = np.nan, np.nan, np.nan
+        self.history.set_last(pointing_x=angle_x, pointing_y=angle_y, divergence=divergence, **measurements)
 
     def change_cam(self, option):
         '''Switches between camera_indexes and therefore different connected cameras.'''
@@ -414,56 +721,113 @@ class Controller(tk.Frame, WorkspaceManager):
     def show_frame(self):
         '''Shows camera view with relevant labels and annotations included.'''
         _, frame = self.cap.read() #read camera input
+        frame_time = time.time()
+        self.frame_id += 1
+        replaying_frames = isinstance(self.replay, recording.ReplayCapture) #recorded frames are already corrected
+        if replaying_frames:
+            frame_time = self.replay.frame_time
+        record_time = frame_time if self.replay is not None else frame_time-self.pause_delay #the history's time base, leaving out the time the profiler was paused
+        if self.replay is not None:
+            self.replay_tick()
+
+        idle = not (self.active or self.webcam_frame is not None or self.stack_capture is not None or self.bg_subtract > 0 or self.auto_exposure.active or self.full_res_pending
+                    or self.recorder is not None or self.video is not None or self.replay is not None)
+        if idle != self.idle:
+            self.idle = idle
+            if idle: #the sound indicator only follows live measurements
+                self.stream.pause()
+            else:
+                self.stream.resume()
+
+        settling = self.settle_frames > 0 or frame.shape[1] != int(self.width) #frames from before a capture mode change are not measurements
+        if self.settle_frames > 0:
+            self.settle_frames -= 1
+        if self.dual_res_state.get() == 1 and self.full_res_interval > 0 and not self.full_res_pending:
+            if time.time() - self.last_full_res > self.full_res_interval:
+                self.measure_full_res()
+
+        if self.stack_capture is not None:
+            self.stack_capture[1].add(frame)
+        if self.video is not None:
+            self.write_video(frame, frame_time)
+        if self.event_ring.pending or 'True' in self.raw_passfail or 'True' in self.ellipse_passfail: #only while a test is armed
+            self.event_ring.add(frame, record_time, self.frame_id) #on the history's time base, so the saved metrics line up with the frames
+        if self.cameras:
+            self.poll_cameras()
+        if not replaying_frames:
+            frame = self.flatfield.correct(frame) #dark frame subtraction and gain correction
+            frame = self.hotpixels.patch(frame) #replace only the known bad pixels
 
         self.frame = frame
 
         if self.bg_subtract > 0:
             self.progress.next_step()
 
-        frame = cv2.subtract(frame, self.bg_frame)
+        if self.bg_model.enabled and not self.idle:
+            self.bg_model.update(frame, max(self.analyse.otsu, self.noise_floor + 5*self.noise_sigma())) #mask out the beam
+            self.bg_frame = self.bg_model.background()
+
+        if not replaying_frames:
+            frame = cv2.subtract(frame, self.bg_frame)
+
+        if self.frame_stack.enabled() and not self.idle and not self.auto_exposure.active: #average the last n frames for better signal to noise. not while searching the exposure, or frames from earlier exposures would be fed to the search
+            self.frame_stack.add(frame)
+            frame = self.frame_stack.average()
 
         # frame = np.asarray(Image.open("output.png"))
         # frame = cv2.flip(frame, 1)
-        if self.roi != 1: #apply region of interest scaling
-            size = self.width/self.roi, self.height/self.roi
-            analysis_frame = frame[(self.height/2)-(size[1]/2):(self.height/2)+(size[1]/2), (self.width/2)-(size[0]/2):(self.width/2)+(size[0]/2)]
-            frame = cv2.resize(analysis_frame,None,fx=self.width/size[0], fy=self.height/size[1], interpolation = cv2.INTER_CUBIC)
+        if replaying_frames: #rotated and zoomed when they were recorded
+            self.transform.update(frame.shape[1], frame.shape[0], 0, 1)
         else:
-            analysis_frame = frame
-            frame = cv2.resize(frame,None,fx=640./float(self.width), fy=360./float(self.height), interpolation = cv2.INTER_CUBIC)
+            self.transform.update(frame.shape[1], frame.shape[0], self.angle, self.roi) #rebuilds the remap only when rotation, zoom or resolution change
+        analyse_frame = not self.idle or self.analysis_frame is None #analysis only conversions are skipped when idle
+        native_frame = frame #as the sensor sees it, for lining up with the further cameras
+        if analyse_frame:
+            analysis_frame = self.transform.analysis(frame) #rotation, crop, zoom and undistortion in a single resample
+        frame = self.transform.display(frame)
 
-        self.analysis_frame_colour = frame
         if self.colourmap is None: #apply colourmap change
             cv2image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGBA)
         else:
             cv2image = cv2.applyColorMap(frame, self.colourmap)
 
-        if self.angle != 0: #apply rotation
-            cv2image = self.rotate_image(cv2image)
+        if analyse_frame:
+            self.analysis_frame_colour = analysis_frame #the 4 sigma widths are measured at native scale too, not on the resized view
+            self.analysis_frame = cv2.cvtColor(analysis_frame,cv2.COLOR_BGR2GRAY) # convert to greyscale
+            self.analyse.calc_histogram() #one histogram per frame, shared by thresholding, saturation and peak value
+            if self.recorder is not None:
+                self.recorder.add(self.analysis_frame, frame_time, self.frame_id)
 
-        self.analysis_frame = cv2.cvtColor(self.rotate_image(analysis_frame),cv2.COLOR_BGR2GRAY) # convert to greyscale
+        if self.auto_exposure.active:
+            self.auto_exposure_step()
 
         self.elapsed_time = time.time() - self.last_tick
         self.last_tick = time.time()
 
-        if self.active:
+        if self.active and not self.auto_exposure.active and not settling and not isinstance(self.replay, recording.ReplayLog) and self.frame_stack.due(): #frames taken while the exposure is searched are not measurements. due() last, as it uses up the slot
 
-            peak_cross = self.analyse.find_peak()
+            analysed = self.last_results is None or not self.change_gate.enabled or self.change_gate.changed(self.analysis_frame, self.noise_sigma())
+            if analysed:
+                peak_cross = self.analyse.find_peak()
+                centroid = self.analyse.get_centroid()
+                ellipses = self.analyse.find_ellipses() #fit ellipse and print data to screen
+                self.last_results = peak_cross, centroid, ellipses
+            else: #frame unchanged within the noise, so reuse the previous metrics
+                peak_cross, centroid, ellipses = self.last_results
             self.peak_cross = peak_cross
 
             if peak_cross != (np.nan, np.nan):
                 cross_size = 10
-                screen_peak_cross = peak_cross[0]*(640./self.width), peak_cross[1]*(360./self.height)
+                screen_peak_cross = peak_cross[0]*self.transform.display_scale[0], peak_cross[1]*self.transform.display_scale[1]
                 cv2.line(cv2image, (int(screen_peak_cross[0])-cross_size, int(screen_peak_cross[1])), (int(screen_peak_cross[0])+cross_size, int(screen_peak_cross[1])), 255, thickness=1)
                 cv2.line(cv2image, (int(screen_peak_cross[0]), int(screen_peak_cross[1])+cross_size), (int(screen_peak_cross[0]), int(screen_peak_cross[1])-cross_size), 255, thickness=1)
 
-            centroid = self.analyse.get_centroid()
             if centroid != (np.nan, np.nan):
                 if centroid[0] < self.width or centroid[1] < self.height: #ensure centroid lies within correct regions
                     self.centroid = centroid
 
                     cross_size = 20
-                    screen_centroid = centroid[0]*(640./self.width), centroid[1]*(360./self.height)
+                    screen_centroid = centroid[0]*self.transform.display_scale[0], centroid[1]*self.transform.display_scale[1]
                     cv2.line(cv2image, (int(screen_centroid[0])-cross_size, int(screen_centroid[1])), (int(screen_centroid[0])+cross_size, int(screen_centroid[1])), 255, thickness=1)
                     cv2.line(cv2image, (int(screen_centroid[0]), int(screen_centroid[1])+cross_size), (int(screen_centroid[0]), int(screen_centroid[1])-cross_size), 255, thickness=1)
                 else:
@@ -472,52 +836,83 @@ class Controller(tk.Frame, WorkspaceManager):
             else:
                 self.centroid = None
 
-            ellipses = self.analyse.find_ellipses() #fit ellipse and print data to screen
             if ellipses != None:
                 (x,y),(ma,MA),angle = ellipses
                 self.MA, self.ma, self.ellipse_x, self.ellipse_y, self.ellipse_angle = MA, ma, x, y, angle
                 self.ellipticity, self.eccentricity = 1-(self.ma/self.MA), np.sqrt(1-(self.ma/self.MA)**2)
-                fix_x, fix_y = (640./self.width), (360./self.height)
+                fix_x, fix_y = self.transform.display_scale
                 screen_ellipses = (x*fix_x, y*fix_y), (ma*fix_x, MA*fix_x), angle #hope the aspect ratio kept same for fix_x, fix_y. should do properly with trig
                 cv2.ellipse(cv2image,screen_ellipses,(0,255,0),1)
             else:
                 self.MA, self.ma, self.ellipse_x, self.ellipse_y, self.ellipse_angle = np.nan, np.nan, np.nan, np.nan, np.nan
                 self.ellipticity, self.eccentricity = np.nan, np.nan
 
-            #record data that should be logged throughout time
-            self.centroid_hist_x, self.centroid_hist_y = np.append(self.centroid_hist_x, centroid[0]), np.append(self.centroid_hist_y, centroid[1])
-            self.peak_hist_x, self.peak_hist_y = np.append(self.peak_hist_x, peak_cross[0]), np.append(self.peak_hist_y, peak_cross[1])
-            self.ellipse_hist_angle = np.append(self.ellipse_hist_angle, self.ellipse_angle)
-            self.running_time = np.append(self.running_time, time.time()-self.pause_delay) #making sure to account for time that pause has been active
-            self.width_hist = np.append(self.width_hist, self.beam_width)
-            self.width_e2_hist = np.append(self.width_e2_hist, self.beam_width_e2)
-            self.ma_hist = np.append(self.ma_hist, self.ma)
-            self.MA_hist = np.append(self.MA_hist, self.MA)
-            self.ellipticity_hist = np.append(self.ellipticity_hist, self.ellipticity)
-            self.eccentricity_hist = np.append(self.eccentricity_hist, self.eccentricity)
+            if analysed: #measured before recording, so the widths are logged with the frame they came from
+                self.beam_width = self.analyse.get_beam_width()
+                self.beam_width_e2 = self.analyse.get_e2_width(self.peak_cross)
+                self.width_scale = self.sensor_scale
+                if self.beam_width is not None:
+                    self.beam_diameter = np.mean(self.beam_width)
+                else:
+                    self.beam_diameter = None
+            full_res = analysed and self.full_res_pending and self.sensor_scale == 1. #the full resolution frame of dual resolution mode
+
+            #record data that should be logged throughout time, in pixels of the configured resolution
+            s = self.sensor_scale
+            ws = self.width_scale #the widths may come from a frame at another capture mode
+            if self.replay is None or len(self.history) == 0 or record_time > self.history.time_range()[1]: #a paused replay is not logged again
+                self.history.append(time=record_time,
+                                    centroid_x=centroid[0]*s, centroid_y=centroid[1]*s,
+                                    peak_x=peak_cross[0]*s, peak_y=peak_cross[1]*s,
+                                    angle=self.ellipse_angle,
+                                    width=np.array(self.beam_width, dtype=float)*ws if self.beam_width is not None else None,
+                                    width_e2=np.array(self.beam_width_e2, dtype=float)*ws if self.beam_width_e2 is not None else None,
+                                    ma=self.ma*s, MA=self.MA*s,
+                                    ellipticity=self.ellipticity, eccentricity=self.eccentricity,
+                                    full_res=float(full_res))
+                if self.cameras and self.replay is None:
+                    self.record_pointing(frame_time, native_frame)
+                if self.disk_log is not None and self.replay is None:
+                    self.write_disk_log()
+                self.stats.add(self.history.recent_records()[-1:])
+                self.allan.add(self.history.recent_records()[-1:])
 
             if self.info_frame != None:
                 self.pass_fail_testing()
 
-            self.beam_width = self.analyse.get_beam_width()
-            self.beam_width_e2 = self.analyse.get_e2_width(self.peak_cross)
-            if self.beam_width is not None:
-                self.beam_diameter = np.mean(self.beam_width)
-            else:
-                self.beam_diameter = None
+            if full_res:
+                self.finish_full_res()
+
+        for event in self.event_ring.ready():
+            self.log('Saved frames from around the failure to ' + self.event_ring.save(event, self.history.recent_records()) + '.npz')
 
         status_string = "Profiler: " + str(self.TrueFalse(self.active)) + " | " + "Centroid: " + str(self.TrueFalse(self.centroid)) + " | Peak Cross: " + str(self.TrueFalse(self.peak_cross)) + " | Ellipse: " + str(self.TrueFalse(self.ellipse_angle)) + '                  ' + 'Zoom Factor: ' + str(self.roi) + ' | Exposure: ' + str(self.exp) + ' | Rotation: ' + str(self.angle) + ' | FPS: ' + str(round(1./self.elapsed_time))
+        if self.change_gate.enabled:
+            status_string += ' | Reused: ' + str(int(round(100*self.change_gate.reuse_ratio()))) + '%'
+        if self.saturated_pixels > 0 and not self.idle: #saturation corrupts width measurements so warn about it
+            status_string += ' | SATURATED: ' + str(self.saturated_pixels) + ' px (' + '{0:.2f}'.format(100*self.saturated_fraction) + '%)'
+        if self.idle:
+            status_string += ' | Idle'
+        if self.recorder is not None and self.recorder.error is not None: #e.g. the disk filled up
+            self.recorder_failure = str(self.recorder.error)
+            self.toggle_recording(False)
+        if self.recorder is not None:
+            status_string += ' | REC ' + str(self.recorder.recorded) + ' frames'
+            if self.recorder.dropped > 0:
+                status_string += ', ' + str(self.recorder.dropped) + ' dropped'
+        elif self.recorder_failure is not None:
+            status_string += ' | RECORDING FAILED: ' + self.recorder_failure
         self.status.set(status_string)
 
         self.imgtk = ImageTk.PhotoImage(image=Image.fromarray(cv2image))
 
         if self.webcam_frame is not None:
             self.webcam_frame.show_frame()
-        self.lmain.after(10, self.show_frame)
+        self.frame_job = self.lmain.after(self.idle_interval if self.idle else 10, self.show_frame)
 
         self.img = frame
         curr_time = time.time()
-        if curr_time - self.plot_time > self.plot_tick and self.active: #if tickrate period elapsed, update the plot with new data
+        if curr_time - self.plot_time > self.plot_tick and (self.active or self.replay is not None): #if tickrate period elapsed, update the plot with new data
             self.refresh_plot()
             self.tick_counter += 1
             if self.tick_counter > 2 and self.info_frame != None: #if 10 ticks passed update results window
@@ -525,6 +920,141 @@ class Controller(tk.Frame, WorkspaceManager):
                 self.tick_counter = 0
             self.plot_time = time.time() #update plot time info
 
+    def wake(self):
+        '''Brings the next frame forward when leaving idle, rather than waiting out the idle interval.'''
+        if self.idle and self.frame_job is not None:
+            self.lmain.after_cancel(self.frame_job)
+            self.frame_job = self.lmain.after(1, self.show_frame)
+
+    def capture_dark(self):
+        '''Starts capturing a stack of dark frames. The laser and room light should be blocked.'''
+        self.log('Capturing dark frames...')
+        self.start_capture('dark')
+
+    def capture_flat(self):
+        '''Starts capturing a stack of flat frames under uniform illumination.'''
+        self.log('Capturing flat-field frames...')
+        self.start_capture('flat')
+
+    def start_capture(self, kind):
+        if self.stack_capture is not None:
+            self.stack_capture[1].cancel()
+        worker = calibration.StackWorker(self.calibration_frames) #accumulates off the Tk thread
+        worker.start()
+        self.stack_capture = (kind, worker)
+        self.capture_step()
+
+    def capture_step(self):
+        '''Polls the dark or flat stack being captured and stores the result once complete.'''
+        kind, stack = self.stack_capture
+        self.progress.v.set(stack.progress())
+        if not stack.done:
+            self.after(100, self.capture_step)
+        else:
+            if kind == 'dark':
+                self.flatfield.set_dark(stack.mean(), stack.std())
+                self.hotpixels.detect(stack.mean(), stack.std())
+            else:
+                flat = stack.mean()
+                self.flatfield.set_flat(flat)
+                self.hotpixels.detect(self.flatfield.dark, self.flatfield.dark_std, flat)
+            filename = self.flatfield.save(self.camera_index, self.width, self.height)
+            self.log('Flat-field ' + kind + ' calibration complete. Written ' + filename + ' to disk.')
+            filename = self.hotpixels.save(self.camera_index, self.width, self.height)
+            self.log('Found ' + str(len(self.hotpixels.bad)) + ' hot/dead pixels. Written ' + filename + ' to disk.')
+            self.progress.v.set(0)
+            self.stack_capture = None
+
+    def reset_flatfield(self):
+        self.flatfield.reset()
+        self.log('Reset flat-field correction')
+
+    def reset_hotpixels(self):
+        self.hotpixels.reset()
+        self.log('Reset hot pixel map')
+
+    def noise_sigma(self):
+        '''Best estimate of the per-pixel noise standard deviation in counts.'''
+        if self.bg_model.enabled and self.bg_model.var is not None:
+            return self.bg_model.noise_level()
+        if self.bg_noise is not None:
+            return self.bg_noise_level
+        if self.flatfield.noise is not None:
+            return self.flatfield.noise
+        return 1.
+
+    def toggle_bg_model(self, option=None):
+        '''Turns the running background model on or off.'''
+        if option is None:
+            option = self.bg_model_state.get() == 1
+        self.bg_model.enabled = option
+        self.bg_model_state.set(int(option))
+        if option:
+            self.bg_model.reset(self.bg_frame, self.bg_noise)
+            self.log('Tracking background drift')
+        else:
+            if isinstance(self.bg_frame, np.ndarray):
+                self.bg_frame = self.bg_frame.copy() #keep the last modelled background
+            self.log('Stopped tracking background drift')
+
+    def toggle_change_gate(self, option=None):
+        '''Turns skipping the analysis of unchanged frames on or off.'''
+        if option is None:
+            option = self.gate_state.get() == 1
+        self.change_gate.enabled = option
+        self.change_gate.reset()
+        self.gate_state.set(int(option))
+        if option:
+            self.log('Skipping analysis of unchanged frames')
+        else:
+            self.log('Analysing every frame')
+
+    def toggle_disk_log(self, option=None):
+        '''Starts writing the measurements to a new log on disk as they are made, or stops.'''
+        if option is None:
+            option = self.disk_log_state.get() == 1
+        if self.disk_log is not None:
+            self.disk_log.stop()
+            self.disk_log = None
+            if not option:
+                self.log('Stopped logging measurements to disk')
+        if option:
+            directory = os.path.join(self.log_directory, time.strftime('%Y%m%d_%H%M%S'))
+            try:
+                self.disk_log = recording.MeasurementLog(directory, self.fields)
+            except OSError:
+                self.log('Could not create ' + directory + ' for the measurement log')
+                option = False
+            else:
+                self.disk_log.start()
+                self.log('Logging measurements to ' + directory)
+        self.disk_log_state.set(int(option))
+
+    def write_disk_log(self):
+        '''Hands the latest record to the disk log.'''
+        if self.disk_log.error is not None:
+            self.log('Measurement log stopped: ' + str(self.disk_log.error))
+            self.disk_log = None
+            self.disk_log_state.set(0)
+            return
+        if not self.disk_log.add(self.history.last()) and self.disk_log.dropped == 1:
+            self.log('The measurement log cannot keep up with the disk, so measurements are being dropped from it')
+
+    def set_stack_length(self, option=None):
+        '''Sets the number of frames averaged before analysis.'''
+        if option is None:
+            option = self.stack_length.get()
+        self.frame_stack.set_length(option)
+        self.stack_length.set(self.frame_stack.n)
+        self.log('Averaging ' + str(self.frame_stack.n) + ' frames')
+
+    def toggle_stack_decimate(self):
+        self.frame_stack.decimate = self.stack_decimate.get() == 1
+        if self.frame_stack.decimate:
+            self.log('Analysing once every ' + str(self.frame_stack.n) + ' frames')
+        else:
+            self.log('Analysing every frame')
+
     def set_angle(self, option):
         '''Sets the rotation angle.'''
         self.log('Changed angle to ' + str(option))
@@ -553,6 +1083,7 @@ class Controller(tk.Frame, WorkspaceManager):
             self.pause_delay += time.time()-self.last_pause
             self.active = True
             self.pb.select()
+            self.wake()
         elif not box and self.active:
             self.log('Profiler INACTIVE')
             self.last_pause = time.time()
@@ -561,25 +1092,19 @@ class Controller(tk.Frame, WorkspaceManager):
 
         self.toggle_navbar()
 
-    def rotate_image(self, image):
-        '''Rotates the given array by the rotation angle, returning as an array.'''
-        image_height, image_width = image.shape[0:2]
-
-        image_rotated = output.rotate_image(image, self.angle)
-        image_rotated_cropped = output.crop_around_centre(
-            image_rotated,
-            *output.largest_rotated_rect(
-                image_width,
-                image_height,
-                math.radians(self.angle)
-            )
-        )
-        return image_rotated_cropped
-
     def close_window(self):
         '''Close GUI routine. Stops threaded sound process to avoid problems in shutdown.'''
-        self.stream.streamer.stop_stream()
-        self.stream.streamer.close()
+        self.stream.close()
+        for cam in self.cameras:
+            cam.stop()
+        if self.disk_log is not None:
+            self.disk_log.stop()
+            self.disk_log.join(5.) #let the last records reach the disk
+        if self.recorder is not None:
+            self.recorder.stop()
+            self.recorder.join(5.)
+        if isinstance(self.replay, recording.ReplayCapture): #the camera is put aside while a recording plays
+            clear_capture(self.live_cap)
         on_closing(self)
 
     def info_window(self, title, info, modal=False):
@@ -597,27 +1122,183 @@ class Controller(tk.Frame, WorkspaceManager):
         self.log('Written ' + filename + ' to disk.')
 
     def save_video(self, wait):
-        filename = 'outputvideo_%s.avi' % (str(time.strftime("%d-%m_%H%M")))
+        '''Takes a video of the next wait seconds. Frames are written as they are shown.'''
+        if self.video is not None:
+            self.log('A video is already being taken')
+            return
+        self.video_file = 'outputvideo_%s.avi' % (str(time.strftime("%d-%m_%H%M")))
         self.log('Writing video to disk, of length ' + str(wait) + ' seconds.')
-        video  = cv2.VideoWriter(filename, -1, 25, (self.width, self.height));
-        start = time.time()
-        while time.time() - start < wait:
-           f,img = self.cap.read()
-           video.write(img)
-        self.log('Video capture completed successfully. Written ' + filename + ' to disk.')
-        video.release()
-
-    def save_csv(self):
-        '''Saves .csv file of recorded data in columns.'''
-        f = tkFileDialog.asksaveasfile(mode='w', initialfile='output.csv', defaultextension=".csv")
-        if f is None: # asksaveasfile return `None` if dialog closed with "cancel".
+        self.video = cv2.VideoWriter(self.video_file, -1, 25, (int(self.width), int(self.height)))
+        self.video_end = time.time() + wait
+
+    def write_video(self, frame, t):
+        if t < self.video_end:
+            self.video.write(frame)
+            return
+        self.video.release()
+        self.video = None
+        self.log('Video capture completed successfully. Written ' + self.video_file + ' to disk.')
+
+    def toggle_recording(self, option=None):
+        '''Starts or stops a lossless recording of the greyscale analysis frames.'''
+        if option is None:
+            option = self.recorder_state.get() == 1
+        if self.recorder is not None:
+            self.recorder.stop()
+            self.log('Recorded ' + str(self.recorder.recorded) + ' frames to ' + self.recorder.directory + ', ' + str(self.recorder.dropped) + ' dropped')
+            if self.recorder.error is not None:
+                self.log('Recording stopped early: ' + str(self.recorder.error))
+            self.recorder = None
+        if option:
+            directory = os.path.join(self.recording_directory, time.strftime('%Y%m%d_%H%M%S'))
+            try:
+                self.recorder = recording.FrameRecorder(directory, info={'pixel_scale': self.frame_pixel_scale(), 'angle': self.angle, 'roi': self.roi})
+            except OSError:
+                self.log('Could not create ' + directory + ' for the recording')
+                option = False
+            else:
+                self.recorder.start()
+                self.recorder_failure = None
+                self.log('Recording raw frames to ' + directory)
+        self.recorder_state.set(int(option))
+
+    def start_replay(self):
+        '''Plays back a frame recording through the profiler, or a measurement log into the plots,
+        in place of the camera.'''
+        directory = tkFileDialog.askdirectory(title='Frame recording or measurement log to replay')
+        if not directory:
             return
+        self.stop_replay()
+        try:
+            if recording.is_recording(directory):
+                reader = recording.FrameReader(directory)
+                if len(reader) == 0:
+                    raise ValueError('no frames')
+                self.replay = recording.ReplayCapture(reader)
+                self.live_cap, self.cap = self.cap, self.replay
+                self.live_settings = self.width, self.height, self.sensor_scale, self.pixel_scale
+                self.height, self.width = reader[0].shape[:2]
+                self.sensor_scale, self.width_scale = 1., 1.
+                self.pixel_scale = reader.info.get('pixel_scale', self.pixel_scale) #size of a recorded pixel
+            else:
+                reader = recording.LogReader(directory)
+                if len(reader) == 0:
+                    raise ValueError('no measurements')
+                self.replay = recording.ReplayLog(reader)
+        except (OSError, IOError, ValueError, KeyError) as e:
+            self.log('Could not replay ' + directory + ': ' + str(e))
+            return
+        self.live_history, self.live_stats, self.live_allan = self.history, self.stats, self.allan
+        self.new_history(reader.fields() if isinstance(self.replay, recording.ReplayLog) else None)
+        if isinstance(self.replay, recording.ReplayLog):
+            self.replay_stats = recording.ReplayStats(reader, self.stats, self.allan)
+        self.replay_controls = interface.ReplayControls(self)
+        if isinstance(self.replay, recording.ReplayCapture):
+            self.log('Replaying ' + str(len(reader)) + ' frames from ' + directory + '. Activate the profiler to measure them.')
+        else:
+            self.log('Replaying ' + str(len(reader)) + ' measurements from ' + directory)
+        self.wake()
 
-        output = np.column_stack((self.running_time.flatten(),(self.centroid_hist_x*self.pixel_scale).flatten(),(self.centroid_hist_y*self.pixel_scale).flatten(),
-        (self.peak_hist_x*self.pixel_scale).flatten(),(self.peak_hist_y*self.pixel_scale).flatten(), (self.width_e2_hist*self.pixel_scale).flatten(), (self.width_hist*self.pixel_scale).flatten(), 
-        self.ellipse_hist_angle.flatten(), (self.ma_hist*self.pixel_scale).flatten(), (self.MA_hist*self.pixel_scale).flatten(), self.ellipticity_hist.flatten(), self.eccentricity_hist.flatten()))
-        np.savetxt('output.csv',output,delimiter=',',header='BiLBO Data Export. Units same as given in calc results. \n running time, centroid_hist_x, centroid_hist_y, peak_hist_x, peak_hist_y, width_hist, width_e2_hist, ellipse angle, minor axis, major axis, ellipticity, eccentricity')
-        self.log('Successfully exported data.')
+    def stop_replay(self):
+        '''Goes back to the camera and the live history.'''
+        if self.replay is None:
+            return
+        if isinstance(self.replay, recording.ReplayCapture):
+            self.cap = self.live_cap
+            self.width, self.height, self.sensor_scale, self.pixel_scale = self.live_settings
+            self.width_scale = self.sensor_scale
+        self.history, self.stats, self.allan = self.live_history, self.live_stats, self.live_allan
+        self.replay, self.replay_stats = None, None
+        self.replay_controls.close()
+        self.replay_controls = None
+        self.log('Stopped replay')
+
+    def replay_tick(self):
+        '''Hands the log records that are due to the history and updates the controls.'''
+        if isinstance(self.replay, recording.ReplayLog):
+            records = self.replay.due()
+            if records is not None:
+                self.history.extend(records)
+                self.replay_stats.add(records)
+        self.replay_controls.update(self.replay)
+
+    def replay_play(self):
+        self.replay.play(not self.replay.playing)
+
+    def replay_speed(self, speed):
+        self.replay.speed = float(speed)
+
+    def replay_step(self, n):
+        '''Steps n frames, or n measurements of a log, forward or back.'''
+        before = self.replay.time
+        self.replay.step(n)
+        self.refill_history(before)
+
+    def replay_seek(self, fraction):
+        before = self.replay.time
+        self.replay.seek(self.replay.start + fraction*(self.replay.end - self.replay.start))
+        self.refill_history(before)
+
+    def refill_history(self, before):
+        '''Rebuilds the replayed history up to the playback time after a seek: from the log's index
+        for a log, or afresh when going back through frames, which are measured as they show.
+        The history of a log gets the last history_recent seconds; its running statistics and
+        allan deviation still cover the whole log up to the new time, caught up from where they
+        were or from the nearest checkpoint before it rather than from the start.'''
+        if isinstance(self.replay, recording.ReplayLog):
+            records = self.replay.rewind(self.history_recent)
+            self.new_history(self.replay.reader.fields())
+            self.history.extend(records)
+            self.stats, self.allan = self.replay_stats.seek(self.replay.time)
+        elif self.replay.time < before:
+            self.new_history()
+
+    def new_history(self, fields=None):
+        '''Starts an empty history with fields (self.fields if not given), along with its running
+        statistics and allan deviation.'''
+        if fields is None:
+            fields = self.fields
+        self.history = history.TieredHistory(fields, recent=self.history_recent, memory=self.history_memory*1e6)
+        self.stats = history.RunningStats(fields, window=self.stats_window)
+        self.allan = history.AllanDeviation(fields=fields)
+
+    def export_data(self):
+        '''Exports the recorded data, in the background, to .csv, .npz or .parquet.'''
+        if self.exporter is not None and not self.exporter.done:
+            self.log('An export is already running')
+            return
+        dialog = interface.ExportDialog(self, [c[0] for c in recording.export_columns(self.history.fields)], self.export_columns)
+        if dialog.result is None:
+            return
+        self.export_columns, in_um, minutes = dialog.result
+        filename = tkFileDialog.asksaveasfilename(initialfile='output.csv', defaultextension='.csv',
+                   filetypes=[('CSV', '*.csv'), ('Compressed NumPy', '*.npz'), ('Parquet', '*.parquet')])
+        if not filename: # asksaveasfilename returns '' if dialog closed with "cancel".
+            return
+        scale, units = (self.pixel_scale, 'um') if in_um else (1., 'pixels')
+        if minutes is None or len(self.history) == 0:
+            blocks = self.history.snapshot()
+            stats, label = (self.stats.components, self.stats.summary()), 'session'
+        else:
+            start = self.history.time_range()[1] - 60*minutes
+            blocks = [self.history.window(start).copy()]
+            stats, label = (history.components(self.history.fields), self.history.summary(start)), 'last ' + str(minutes) + ' min' #over the exported records only
+        self.exporter = recording.Exporter(blocks, filename, self.export_columns, scale, units, stats=stats, fields=self.history.fields, stats_label=label)
+        self.exporter.start()
+        self.log('Exporting ' + str(self.exporter.total) + ' records to ' + filename)
+        self.poll_export()
+
+    def poll_export(self):
+        '''Follows the export on the progress bar until it has finished.'''
+        self.progress.v.set(self.exporter.progress())
+        if not self.exporter.done:
+            self.after(100, self.poll_export)
+            return
+        self.progress.v.set(0)
+        if self.exporter.error is not None:
+            self.log('Export failed: ' + str(self.exporter.error))
+        else:
+            self.log('Successfully exported data to ' + self.exporter.filename)
 
     def calc_results(self):
         '''Opens calculation results window'''
@@ -658,15 +1339,15 @@ class Controller(tk.Frame, WorkspaceManager):
                         self.info_frame.raw_xbounds = [('x ≥ 0.00', 'x ≤ 0.00'), #refresh this to reflect change in pixel scale
                         ('0.00', '0.00'),
                         ('0.00', '255.00'),
-                        ('x ≥ 0.00', 'x ≤ ' + '{0:.2f}'.format(self.width*self.pixel_scale)),
-                        ('x ≥ 0.00', 'x ≤ ' + '{0:.2f}'.format(self.width*self.pixel_scale)),
+                        ('x ≥ 0.00', 'x ≤ ' + '{0:.2f}'.format(self.width*self.frame_pixel_scale())),
+                        ('x ≥ 0.00', 'x ≤ ' + '{0:.2f}'.format(self.width*self.frame_pixel_scale())),
                         ('0.00', '0.00')
                         ]
                         self.info_frame.raw_ybounds = [('y ≥ 0.00', 'y ≤ 0.00'),
                         (' ', ' '),
                         (' ', ' '),
-                        ('y ≥ 0.00', 'y ≤ ' + '{0:.2f}'.format(self.height*self.pixel_scale)),
-                        ('y ≥ 0.00', 'y ≤ ' + '{0:.2f}'.format(self.height*self.pixel_scale)),
+                        ('y ≥ 0.00', 'y ≤ ' + '{0:.2f}'.format(self.height*self.frame_pixel_scale())),
+                        ('y ≥ 0.00', 'y ≤ ' + '{0:.2f}'.format(self.height*self.frame_pixel_scale())),
                         (' ', ' ')
                         ]
                         self.info_frame.refresh_frame()
@@ -691,6 +1372,7 @@ class Controller(tk.Frame, WorkspaceManager):
         '''Opens Webcam Feed'''
         if self.webcam_frame is None:
             self.webcam_frame = self.view('webcam')
+            self.wake()
         else:
             # self.log('Webcam window already loaded')
             self.webcam_frame.window.lift()
@@ -720,72 +1402,73 @@ class Controller(tk.Frame, WorkspaceManager):
         if button.lower() in self.toolbaractions.keys():
             if self.toolbaractions[button.lower()][0] in ['inc_exp', 'dec_exp', 'view_log', 'calculation results', 'show windows', 'clear windows', 'save workspace', 'load workspace', 'show webcam', 'basic workspace']:
                 if self.toolbaractions[button.lower()][0] == 'view_log':
-                    self.toolbarbuttons.append([tk.Button(self.toolbar, text=button, height=32, width=32, image=self.toolbaractions[button.lower()][1], command=self.view_log), button])
+                    self.toolbarbuttons.append([tk.Button(self.toolbar, text=button, height=32, width=32, image=self.icon(self.toolbaractions[button.lower()][1]), command=self.view_log), button])
                 elif self.toolbaractions[button.lower()][0] == 'clear windows':
-                    self.toolbarbuttons.append([tk.Button(self.toolbar, text=button, height=32, width=32, image=self.toolbaractions[button.lower()][1], command= self.close_all), button])
+                    self.toolbarbuttons.append([tk.Button(self.toolbar, text=button, height=32, width=32, image=self.icon(self.toolbaractions[button.lower()][1]), command= self.close_all), button])
                 elif self.toolbaractions[button.lower()][0] == 'inc_exp':
-                    self.toolbarbuttons.append([tk.Button(self.toolbar, text=button, height=32, width=32, image=self.toolbaractions[button.lower()][1], command= lambda: self.adjust_exp(1)), button])
+                    self.toolbarbuttons.append([tk.Button(self.toolbar, text=button, height=32, width=32, image=self.icon(self.toolbaractions[button.lower()][1]), command= lambda: self.adjust_exp(1)), button])
                 elif self.toolbaractions[button.lower()][0] == 'dec_exp':
-                    self.toolbarbuttons.append([tk.Button(self.toolbar, text=button, height=32, width=32, image=self.toolbaractions[button.lower()][1], command= lambda: self.adjust_exp(-1)), button])
+                    self.toolbarbuttons.append([tk.Button(self.toolbar, text=button, height=32, width=32, image=self.icon(self.toolbaractions[button.lower()][1]), command= lambda: self.adjust_exp(-1)), button])
                 elif self.toolbaractions[button.lower()][0] == 'load workspace':
-                    self.toolbarbuttons.append([tk.Button(self.toolbar, text=button, height=32, width=32, image=self.toolbaractions[button.lower()][1], command= self.load_workspace), button])
+                    self.toolbarbuttons.append([tk.Button(self.toolbar, text=button, height=32, width=32, image=self.icon(self.toolbaractions[button.lower()][1]), command= self.load_workspace), button])
                 elif self.toolbaractions[button.lower()][0] == 'save workspace':
-                    self.toolbarbuttons.append([tk.Button(self.toolbar, text=button, height=32, width=32, image=self.toolbaractions[button.lower()][1], command= self.save_workspace), button])
+                    self.toolbarbuttons.append([tk.Button(self.toolbar, text=button, height=32, width=32, image=self.icon(self.toolbaractions[button.lower()][1]), command= self.save_workspace), button])
                 elif self.toolbaractions[button.lower()][0] == 'show webcam':
-                    self.toolbarbuttons.append([tk.Button(self.toolbar, text=button, height=32, width=32, image=self.toolbaractions[button.lower()][1], command= self.view_webcam), button])
+                    self.toolbarbuttons.append([tk.Button(self.toolbar, text=button, height=32, width=32, image=self.icon(self.toolbaractions[button.lower()][1]), command= self.view_webcam), button])
                 elif self.toolbaractions[button.lower()][0] == 'show windows':
-                    self.toolbarbuttons.append([tk.Button(self.toolbar, text=button, height=32, width=32, image=self.toolbaractions[button.lower()][1], command= self.show_all), button])
+                    self.toolbarbuttons.append([tk.Button(self.toolbar, text=button, height=32, width=32, image=self.icon(self.toolbaractions[button.lower()][1]), command= self.show_all), button])
                 elif self.toolbaractions[button.lower()][0] == 'calculation results':
-                    self.toolbarbuttons.append([tk.Button(self.toolbar, text=button, height=32, width=32, image=self.toolbaractions[button.lower()][1], command= self.calc_results), button])
+                    self.toolbarbuttons.append([tk.Button(self.toolbar, text=button, height=32, width=32, image=self.icon(self.toolbaractions[button.lower()][1]), command= self.calc_results), button])
                 elif self.toolbaractions[button.lower()][0] == 'basic workspace':
-                    self.toolbarbuttons.append([tk.Button(self.toolbar, text=button, height=32, width=32, image=self.toolbaractions[button.lower()][1], command= lambda: self.load_workspace(workspace=self.basic_workspace)), button])
+                    self.toolbarbuttons.append([tk.Button(self.toolbar, text=button, height=32, width=32, image=self.icon(self.toolbaractions[button.lower()][1]), command= lambda: self.load_workspace(workspace=self.basic_workspace)), button])
             else:
-                self.toolbarbuttons.append([tk.Button(self.toolbar, text=button, height=32, width=32, image=self.toolbaractions[button.lower()][1], command= lambda: self.view_plot(self.toolbaractions[button.lower()][0])), button])
+                self.toolbarbuttons.append([tk.Button(self.toolbar, text=button, height=32, width=32, image=self.icon(self.toolbaractions[button.lower()][1]), command= lambda: self.view_plot(self.toolbaractions[button.lower()][0])), button])
         else:
             self.toolbarbuttons.append([tk.Button(self.toolbar, text=button), button])
         self.toolbarbuttons[-1][0].pack(side=tk.LEFT, padx=2, pady=2)
 
     def pass_fail_testing(self):
         '''Sets off alarm if pass/fail test criteria are not met.'''
+        pixel_scale = self.frame_pixel_scale()
         for index in np.where(np.array(self.raw_passfail) == 'True')[0]:
             x_lower, x_upper = [float(i) if i.replace('.','').isdigit() else i for i in self.info_frame.raw_xbounds[index]]
             if index == 0:
                 if self.beam_width_e2 is not None:
                     y_lower, y_upper = [float(i[5:]) for i in self.info_frame.raw_ybounds[index]]
-                    if self.beam_width_e2[0]*self.pixel_scale <= float(x_lower[5:]) or self.beam_width_e2[0]*self.pixel_scale >= float(x_upper[5:]) or self.beam_width_e2[1]*self.pixel_scale <= y_lower or self.beam_width_e2[1]*self.pixel_scale >= y_upper:
-                        self.alert("Pass/Fail Test", "Beam Width has failed to meet criteria!")
+                    if self.beam_width_e2[0]*pixel_scale <= float(x_lower[5:]) or self.beam_width_e2[0]*pixel_scale >= float(x_upper[5:]) or self.beam_width_e2[1]*pixel_scale <= y_lower or self.beam_width_e2[1]*pixel_scale >= y_upper:
+                        self.test_failed("Beam Width has failed to meet criteria!", self.info_frame.raw_xbounds[index], self.info_frame.raw_ybounds[index])
                         self.raw_passfail[index] = 'False' #reset value
                         self.info_frame.refresh_frame()
             if index == 1:
                 if self.beam_diameter is not None:
-                    if self.beam_diameter*self.pixel_scale <= x_lower or self.beam_diameter*self.pixel_scale >= x_upper:
-                        self.alert("Pass/Fail Test", "Beam Diameter has failed to meet criteria!")
+                    if self.beam_diameter*pixel_scale <= x_lower or self.beam_diameter*pixel_scale >= x_upper:
+                        self.test_failed("Beam Diameter has failed to meet criteria!", self.info_frame.raw_xbounds[index], self.info_frame.raw_ybounds[index])
                         self.raw_passfail[index] = 'False' #reset value
                         self.info_frame.refresh_frame()
             if index == 2:
-                if np.max(self.analysis_frame) >= x_upper or np.max(self.analysis_frame) <= x_lower:
-                    self.alert("Pass/Fail Test", "Peak Pixel Value has failed to meet criteria!")
+                if self.peak_value >= x_upper or self.peak_value <= x_lower:
+                    self.test_failed("Peak Pixel Value has failed to meet criteria!", self.info_frame.raw_xbounds[index], self.info_frame.raw_ybounds[index])
                     self.raw_passfail[index] = 'False' #reset value
                     self.info_frame.refresh_frame()
             if index == 3:
                 if self.peak_cross is not None:
                     y_lower, y_upper = [float(i[5:]) for i in self.info_frame.raw_ybounds[index]]
-                    if self.peak_cross[0]*self.pixel_scale <= float(x_lower[5:]) or self.peak_cross[0]*self.pixel_scale >= float(x_upper[5:]) or self.peak_cross[1]*self.pixel_scale <= y_lower or self.peak_cross[1]*self.pixel_scale >= y_upper:
-                            self.alert("Pass/Fail Test", "Peak Position has failed to meet criteria!")
+                    if self.peak_cross[0]*pixel_scale <= float(x_lower[5:]) or self.peak_cross[0]*pixel_scale >= float(x_upper[5:]) or self.peak_cross[1]*pixel_scale <= y_lower or self.peak_cross[1]*pixel_scale >= y_upper:
+                            self.test_failed("Peak Position has failed to meet criteria!", self.info_frame.raw_xbounds[index], self.info_frame.raw_ybounds[index])
                             self.raw_passfail[index] = 'False' #reset value
                             self.info_frame.refresh_frame()
             if index == 4:
                 if self.centroid is not None:
                     y_lower, y_upper = [float(i[5:]) for i in self.info_frame.raw_ybounds[index]]
-                    if self.centroid[0]*self.pixel_scale <= float(x_lower[5:]) or self.centroid[0]*self.pixel_scale >= float(x_upper[5:]) or self.centroid[1]*self.pixel_scale <= y_lower or self.centroid[1]*self.pixel_scale >= y_upper:
-                            self.alert("Pass/Fail Test", "Centroid Position has failed to meet criteria!")
+                    if self.centroid[0]*pixel_scale <= float(x_lower[5:]) or self.centroid[0]*pixel_scale >= float(x_upper[5:]) or self.centroid[1]*pixel_scale <= y_lower or self.centroid[1]*pixel_scale >= y_upper:
+                            self.test_failed("Centroid Position has failed to meet criteria!", self.info_frame.raw_xbounds[index], self.info_frame.raw_ybounds[index])
                             self.raw_passfail[index] = 'False' #reset value
                             self.info_frame.refresh_frame()
             if index == 5:
                 if self.power != np.nan and self.beam_diameter is not None:
                     powdens = float("{:.2E}".format((255000/square(self.parent.beam_diameter))*self.power))
                     if powdens <= float(x_lower) or powdens >= float(x_upper):
-                            self.alert("Pass/Fail Test", "Power Density has failed to meet criteria!")
+                            self.test_failed("Power Density has failed to meet criteria!", self.info_frame.raw_xbounds[index], self.info_frame.raw_ybounds[index])
                             self.raw_passfail[index] = 'False' #reset value
                             self.info_frame.refresh_frame()
 
@@ -795,25 +1478,31 @@ class Controller(tk.Frame, WorkspaceManager):
                 if self.ma <= float(x_lower[5:]) or self.ma >= float(x_upper[5:]):
                     y_lower, y_upper = [float(i[5:]) for i in self.info_frame.ellipse_ybounds[index]]
                     if self.MA <= y_lower or self.MA >= y_upper:
-                        self.alert("Pass/Fail Test", "Ellipse axes have failed to meet criteria!")
+                        self.test_failed("Ellipse axes have failed to meet criteria!", self.info_frame.ellipse_xbounds[index], self.info_frame.ellipse_ybounds[index])
                         self.ellipse_passfail[index] = 'False'
                         self.info_frame.refresh_frame()
             if index == 1:
                 if self.ellipticity <= x_lower or self.ellipticity >= x_upper:
-                    self.alert("Pass/Fail Test", "Ellipticity has failed to meet criteria!")
+                    self.test_failed("Ellipticity has failed to meet criteria!", self.info_frame.ellipse_xbounds[index], self.info_frame.ellipse_ybounds[index])
                     self.ellipse_passfail[index] = 'False'
                     self.info_frame.refresh_frame()
             if index == 2:
                 if self.eccentricity <= x_lower or self.eccentricity >= x_upper:
-                    self.alert("Pass/Fail Test", "Eccentricity has failed to meet criteria!")
+                    self.test_failed("Eccentricity has failed to meet criteria!", self.info_frame.ellipse_xbounds[index], self.info_frame.ellipse_ybounds[index])
                     self.ellipse_passfail[index] = 'False'
                     self.info_frame.refresh_frame()
             if index == 3:
                 if self.ellipse_angle <= x_lower or self.ellipse_angle >= x_upper:
-                    self.alert("Pass/Fail Test", "Ellipse orientation has failed to meet criteria!")
+                    self.test_failed("Ellipse orientation has failed to meet criteria!", self.info_frame.ellipse_xbounds[index], self.info_frame.ellipse_ybounds[index])
                     self.ellipse_passfail[index] = 'False'
                     self.info_frame.refresh_frame()
 
+    def test_failed(self, text, xbounds, ybounds):
+        '''Alerts a failed pass/fail test and saves the frames from around the failure.'''
+        self.event_ring.trigger({'rule': text, 'x bounds': list(xbounds), 'y bounds': list(ybounds),
+                                 'time': time.time(), 'frame_id': self.frame_id})
+        self.alert("Pass/Fail Test", text)
+
     def alert(self, title, text):
         '''Makes a sound and shows alert window'''
         print('\a')
@@ -848,8 +1537,41 @@ class Controller(tk.Frame, WorkspaceManager):
                 self.pixel_scale = float(config.get('WebcamSpecifications', 'pixel_scale'))
             if config.has_option('WebcamSpecifications', 'base_exp'):
                 self.exp = float(config.get('WebcamSpecifications', 'base_exp')) #then set exp
+            if config.has_option('WebcamSpecifications', 'exposure_range'):
+                self.auto_exposure.low, self.auto_exposure.high = [float(i) for i in config.get('WebcamSpecifications', 'exposure_range').replace(', ',',').split(',')]
+            if config.has_option('WebcamSpecifications', 'auto_exposure_target'):
+                self.auto_exposure.target = float(config.get('WebcamSpecifications', 'auto_exposure_target'))
             if config.has_option('WebcamSpecifications', 'resolution'):
                 self.width, self.height = [float(i) for i in config.get('WebcamSpecifications', 'resolution').replace(', ',',').split(',')]
+            if config.has_option('WebcamSpecifications', 'capture_modes'):
+                self.capture_modes = camera.parse_modes(config.get('WebcamSpecifications', 'capture_modes'))
+            if config.has_option('WebcamSpecifications', 'preview_mode'):
+                self.preview_mode = camera.parse_modes(config.get('WebcamSpecifications', 'preview_mode'))[0]
+            if config.has_option('WebcamSpecifications', 'full_res_interval'):
+                self.full_res_interval = float(config.get('WebcamSpecifications', 'full_res_interval'))
+            if config.has_option('WebcamSpecifications', 'distance'):
+                self.distance = float(config.get('WebcamSpecifications', 'distance'))
+            for section in config.sections(): #further cameras are given in sections named Camera1, Camera2...
+                if section.lower().startswith('camera'):
+                    options = dict(config.items(section))
+                    width, height = [float(i) for i in options.get('resolution', '640,360').replace(', ',',').split(',')]
+                    exp = float(options['base_exp']) if 'base_exp' in options else None
+                    self.cameras.append(camera.CameraWorker(section, int(options.get('camera_index', 1)), width, height,
+                        float(options.get('pixel_scale', self.pixel_scale)), exp, float(options.get('distance', 0)),
+                        float(options.get('min_signal', 20))))
+            self.fields = history.FIELDS + history.camera_fields([cam.name for cam in self.cameras])
+            if config.has_option('Miscellaneous', 'align_tolerance'):
+                self.align_tolerance = float(config.get('Miscellaneous', 'align_tolerance'))
+            if config.has_option('WebcamSpecifications', 'min_beam_pixels'):
+                self.min_beam_pixels = float(config.get('WebcamSpecifications', 'min_beam_pixels'))
+            if config.has_option('WebcamSpecifications', 'calibration'):
+                calibration_value = config.get('WebcamSpecifications', 'calibration')
+                if calibration_value != '':
+                    try:
+                        self.transform.load_calibration(calibration_value)
+                        self.log('Loaded lens calibration ' + calibration_value)
+                    except (IOError, KeyError):
+                        self.log('Could not load lens calibration ' + calibration_value)
 
             if config.has_option('LaserSpecifications', 'power'):
                 power = (config.get('LaserSpecifications', 'power'))
@@ -863,12 +1585,48 @@ class Controller(tk.Frame, WorkspaceManager):
             if config.has_option('Toolbar', 'buttons'):
                 self.toolbaroptions = config.get('Toolbar', 'buttons').replace(', ',',').split(',')
 
+            if config.has_option('Miscellaneous', 'idle_interval'):
+                self.idle_interval = int(config.get('Miscellaneous', 'idle_interval'))
+            if config.has_option('Miscellaneous', 'log_to_disk'):
+                self.disk_log_state.set(int(config.get('Miscellaneous', 'log_to_disk').lower() in ('true', '1', 'yes')))
+            if config.has_option('Miscellaneous', 'log_directory'):
+                self.log_directory = config.get('Miscellaneous', 'log_directory')
+            if config.has_option('Miscellaneous', 'event_frames'):
+                self.event_ring = recording.EventRing(self.event_ring.directory, int(config.get('Miscellaneous', 'event_frames')), self.event_ring.post_frames)
+            if config.has_option('Miscellaneous', 'event_post_frames'):
+                self.event_ring.post_frames = int(config.get('Miscellaneous', 'event_post_frames'))
+            if config.has_option('Miscellaneous', 'event_directory'):
+                self.event_ring.directory = config.get('Miscellaneous', 'event_directory')
+            if config.has_option('Miscellaneous', 'recording_directory'):
+                self.recording_directory = config.get('Miscellaneous', 'recording_directory')
+            if config.has_option('Miscellaneous', 'history_recent'):
+                self.history_recent = float(config.get('Miscellaneous', 'history_recent'))
+            if config.has_option('Miscellaneous', 'history_memory'):
+                self.history_memory = float(config.get('Miscellaneous', 'history_memory'))
+            if config.has_option('Miscellaneous', 'stats_window'):
+                self.stats_window = int(config.get('Miscellaneous', 'stats_window'))
+            self.new_history()
             if config.has_option('Miscellaneous', 'plot_tick'):
                 self.plot_tick = float(config.get('Miscellaneous', 'plot_tick'))
             if config.has_option('Miscellaneous', 'colourmap'):
                 self.change_colourmap(config.get('Miscellaneous', 'colourmap'))
             if config.has_option('Miscellaneous', 'camera_index'):
                 self.camera_index = int(config.get('Miscellaneous', 'camera_index'))
+            if config.has_option('Miscellaneous', 'change_gate'):
+                if config.get('Miscellaneous', 'change_gate').lower() in ('true', '1', 'yes'):
+                    self.change_gate.enabled = True
+                    self.gate_state.set(1)
+            if config.has_option('Miscellaneous', 'background_model'):
+                if config.get('Miscellaneous', 'background_model').lower() in ('true', '1', 'yes'):
+                    self.bg_model.enabled = True
+                    self.bg_model_state.set(1)
+            if config.has_option('Miscellaneous', 'average_frames'):
+                self.frame_stack.set_length(config.get('Miscellaneous', 'average_frames'))
+                self.stack_length.set(self.frame_stack.n)
+            if config.has_option('Miscellaneous', 'average_decimate'):
+                if config.get('Miscellaneous', 'average_decimate').lower() in ('true', '1', 'yes'):
+                    self.frame_stack.decimate = True
+                    self.stack_decimate.set(1)
             if config.has_option('Miscellaneous', 'style_sheet'):
                 self.style_sheet = config.get('Miscellaneous', 'style_sheet')
             if config.has_option('Miscellaneous', 'workspace'):
@@ -876,15 +1634,18 @@ class Controller(tk.Frame, WorkspaceManager):
                 self.workspace = []
                 for window in windows:
                     window_params = window[1:-1].split(',')
+                    iconic = () #windows saved minimised end with 'iconic'
+                    if window_params[-1].replace('\'','').replace('"','').replace(')','') == 'iconic':
+                        window_params, iconic = window_params[:-1], ('iconic',)
                     if len(window_params) == 6:
-                        w, h, x, y, windowtype, graphtype = window[1:-1].split(',')
+                        w, h, x, y, windowtype, graphtype = window_params
                         windowtype = windowtype.replace('\'','')
                         graphtype = graphtype.replace('\'','').replace('"','')
-                        self.workspace.append((float(w), float(h), float(x), float(y), windowtype, graphtype))
+                        self.workspace.append((float(w), float(h), float(x), float(y), windowtype, graphtype) + iconic)
                     elif len(window_params) == 5:
-                        w, h, x, y, windowtype = window[1:-1].split(',')
+                        w, h, x, y, windowtype = window_params
                         windowtype = windowtype.replace('\'','')
-                        self.workspace.append((float(w), float(h), float(x), float(y), windowtype))
+                        self.workspace.append((float(w), float(h), float(x), float(y), windowtype) + iconic)
                     else:
                         self.log('Could not find workspace details.')
 
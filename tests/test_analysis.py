@@ -0,0 +1,80 @@
+import numpy as np
+import cv2
+
+from utils.analysis import otsu_threshold, ChangeGate, FrameStack, AutoExposure
+
+def test_otsu_matches_opencv():
+    random = np.random.RandomState(1)
+    for low, high in [(40, 180), (20, 90), (100, 230)]:
+        image = np.r_[random.normal(low, 12, 3000), random.normal(high, 20, 1000)]
+        image = np.clip(image, 0, 255).astype(np.uint8).reshape(40, 100)
+        hist = cv2.calcHist([image], [0], None, [256], [0, 256])
+        reference = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[0]
+        assert otsu_threshold(hist) == int(reference)
+
+def test_otsu_of_an_empty_histogram():
+    assert otsu_threshold(np.zeros(256)) == 0
+
+def spot(x, y, width=640, height=480):
+    xx, yy = np.meshgrid(np.arange(width), np.arange(height))
+    return 20 + 200*np.exp(-((xx - x)**2 + (yy - y)**2)/(2*30.**2))
+
+def test_change_gate_reuses_unchanged_frames():
+    random = np.random.RandomState(8)
+    gate = ChangeGate()
+    changed = []
+    for i in range(100):
+        beam = spot(200 + 20*(i//10), 240) #moves every 10th frame
+        frame = np.clip(np.round(beam + random.normal(0, 2, beam.shape)), 0, 255).astype(np.uint8)
+        changed.append(gate.changed(frame, 2.))
+    assert [i for i, c in enumerate(changed) if c] == list(range(0, 100, 10))
+    assert gate.reuse_ratio() == 0.9
+    gate.reset()
+    assert gate.reuse_ratio() == 0.
+
+def test_frame_stack_averages_the_last_frames():
+    random = np.random.RandomState(9)
+    frames = random.randint(0, 256, (20, 6, 8)).astype(np.uint8)
+    stack = FrameStack(5)
+    for i in range(12): #past a wraparound of the ring
+        stack.add(frames[i])
+        assert np.abs(stack.average() - frames[max(i - 4, 0):i+1].mean(axis=0)).max() <= 0.5
+    stack.set_length(3) #starts again from the next frame
+    for i in range(12, 20):
+        stack.add(frames[i])
+        assert np.abs(stack.average() - frames[max(i - 2, 12):i+1].mean(axis=0)).max() <= 0.5
+
+def test_frame_stack_decimates():
+    stack = FrameStack(3)
+    stack.decimate = True
+    due = []
+    for i in range(9):
+        stack.add(np.zeros((2, 2), np.uint8))
+        due.append(stack.due())
+    assert due == [False, False, True]*3
+
+def search(brightness, exp=-8, **options):
+    '''Runs the exposure search against a camera whose peak doubles with each exposure step up
+    to saturation. Returns where it settled and the peak there.'''
+    peak = lambda exp: min(brightness*2.**exp, 255.)
+    auto = AutoExposure(**options)
+    auto.start()
+    for i in range(100):
+        new_exp = auto.next_exposure(exp, peak(exp))
+        if new_exp is not None:
+            exp = new_exp
+        if not auto.active:
+            return exp, peak(exp)
+    raise AssertionError('did not converge')
+
+def test_auto_exposure_finds_the_target():
+    exp, peak = search(204*2.**6)
+    assert exp == -6 and abs(peak/255. - 0.8) <= 0.1
+
+def test_auto_exposure_stays_below_saturation():
+    exp, peak = search(150*2.**6) #0.59 at -6 and saturated at -5, so the target can't be met
+    assert exp == -6 and peak == 150
+
+def test_auto_exposure_stops_at_the_camera_limits():
+    assert search(1.)[0] == -1 #too dim even at the longest exposure
+    assert search(1e9)[0] == -15 #saturated even at the shortest
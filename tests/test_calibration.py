@@ -0,0 +1,109 @@
+import numpy as np
+
+from utils.calibration import FlatField, HotPixelMap, BackgroundModel
+
+def stacks(shape=(30, 40)):
+    random = np.random.RandomState(2)
+    dark = random.uniform(2, 10, shape).astype(np.float32)
+    dark_std = random.uniform(0.5, 1.5, shape).astype(np.float32)
+    response = 120*random.uniform(0.8, 1.2, shape).astype(np.float32)
+    return dark, dark_std, response
+
+def test_flat_field_evens_out_the_response():
+    dark, dark_std, response = stacks()
+    flat_field = FlatField()
+    flat_field.set_dark(dark, dark_std)
+    flat_field.set_flat(dark + response)
+    level = response.mean()
+    for scale in (0.5, 1.):
+        frame = np.round(dark + scale*response).astype(np.uint8)
+        reference = np.clip((frame - dark)*level/response, 0, 255).astype(np.uint8)
+        corrected = flat_field.correct(frame)
+        assert np.abs(corrected.astype(int) - reference).max() <= 1
+        assert np.abs(corrected - scale*level).max() <= 2 #rounding the frame to whole counts
+
+def test_dark_only_subtracts_with_saturation():
+    dark, dark_std, response = stacks()
+    flat_field = FlatField()
+    flat_field.set_dark(dark, dark_std)
+    frame = np.random.RandomState(3).randint(0, 256, dark.shape).astype(np.uint8)
+    reference = np.clip(frame.astype(int) - np.round(dark), 0, 255)
+    assert np.array_equal(flat_field.correct(frame), reference)
+    assert np.isclose(flat_field.noise, dark_std.mean())
+
+def test_flat_field_leaves_other_shapes_alone():
+    dark, dark_std, response = stacks()
+    flat_field = FlatField()
+    flat_field.set_dark(dark, dark_std)
+    frame = np.zeros((10, 10), np.uint8)
+    assert flat_field.correct(frame) is frame
+
+def test_flat_field_round_trip(tmp_path):
+    dark, dark_std, response = stacks()
+    flat_field = FlatField(str(tmp_path))
+    flat_field.set_dark(dark, dark_std)
+    flat_field.set_flat(dark + response)
+    flat_field.save(0, 40, 30)
+    loaded = FlatField(str(tmp_path))
+    assert loaded.load(0, 40, 30) is not None
+    assert loaded.load(1, 40, 30) is None
+    loaded.load(0, 40, 30)
+    frame = np.round(dark + response).astype(np.uint8)
+    assert np.array_equal(loaded.correct(frame), flat_field.correct(frame))
+
+def neighbour_median(image, row, col):
+    padded = np.pad(image, 1, mode='reflect')
+    block = padded[row:row+3, col:col+3].ravel()
+    return np.median(np.delete(block, 4))
+
+def test_hot_pixels_are_found_and_patched():
+    dark, dark_std, response = stacks()
+    bad = [(5, 7), (0, 0), (29, 13), (12, 39)]
+    for row, col in bad:
+        dark[row, col] = 200.
+    hot_pixels = HotPixelMap()
+    assert hot_pixels.detect(dark) == len(bad)
+    assert sorted(hot_pixels.bad) == sorted(row*40 + col for row, col in bad)
+
+    frame = np.round(dark).astype(np.uint8)
+    reference = frame.copy()
+    for row, col in bad:
+        reference[row, col] = neighbour_median(frame, row, col)
+    assert np.array_equal(hot_pixels.patch(frame.copy()), reference)
+
+def test_dead_pixels_are_found_from_the_flat():
+    dark, dark_std, response = stacks()
+    response[8, 8] = 0.
+    hot_pixels = HotPixelMap()
+    assert hot_pixels.detect(dark, dark_std, dark + response) == 1
+    assert list(hot_pixels.bad) == [8*40 + 8]
+
+def test_hot_pixel_round_trip(tmp_path):
+    dark, dark_std, response = stacks()
+    dark[3, 4] = 250.
+    hot_pixels = HotPixelMap(str(tmp_path))
+    hot_pixels.detect(dark)
+    hot_pixels.save(0, 40, 30)
+    loaded = HotPixelMap(str(tmp_path))
+    loaded.load(0, 40, 30)
+    assert loaded.shape == (30, 40)
+    assert np.array_equal(loaded.bad, hot_pixels.bad)
+    assert np.array_equal(loaded.neighbours, hot_pixels.neighbours)
+
+def test_background_model_tracks_ambient_drift():
+    model = BackgroundModel(alpha=0.05, margin=5)
+    model.reset(np.full((30, 40, 3), 20, np.uint8))
+    frame = np.full((30, 40, 3), 30, np.uint8) #ambient light came up, with no beam in view
+    for i in range(200):
+        model.update(frame, 5)
+    assert np.allclose(model.mean, 30, atol=0.1)
+
+def test_background_model_leaves_out_the_beam():
+    model = BackgroundModel(alpha=0.05, margin=5)
+    model.reset(np.full((30, 40, 3), 20, np.uint8))
+    frame = np.full((30, 40, 3), 25, np.uint8)
+    frame[10:20, 15:25] = 200
+    for i in range(200):
+        model.update(frame, 10)
+    assert np.allclose(model.mean[:5], 25, atol=0.1)
+    assert np.allclose(model.mean[12:18, 17:23], 20) #under the beam, so never updated
@@ -0,0 +1,123 @@
+import numpy as np
+
+from utils.history import RunningStats, AllanDeviation, TieredHistory, components
+
+FIELDS = [('time', 'f8'), ('a', 'f8'), ('b', 'f8', (2,))]
+
+def records(n, nans=0., seed=4):
+    random = np.random.RandomState(seed)
+    out = np.zeros(n, np.dtype(FIELDS))
+    out['time'] = 0.1*np.arange(n)
+    out['a'] = np.cumsum(random.normal(0, 1, n)) #a random walk, so the octaves differ
+    out['b'] = random.normal(5, 2, (n, 2))
+    for name in ('a', 'b'):
+        out[name][random.uniform(size=out[name].shape) < nans] = np.nan
+    return out
+
+def values(data):
+    return np.column_stack([data['a'], data['b']])
+
+def add_in_pieces(accumulator, data, sizes=(1, 7, 1, 1, 300, 1, 64)):
+    i, k = 0, 0
+    while i < len(data):
+        accumulator.add(data[i:i+sizes[k % len(sizes)]])
+        i += sizes[k % len(sizes)]
+        k += 1
+
+def test_running_stats_match_numpy():
+    data = records(2000, nans=0.05)
+    stats = RunningStats(FIELDS, window=100)
+    add_in_pieces(stats, data)
+    n, mean, std, low, high = stats.summary()
+    v = values(data)
+    assert np.array_equal(n, (~np.isnan(v)).sum(axis=0))
+    assert np.allclose(mean, np.nanmean(v, axis=0))
+    assert np.allclose(std, np.nanstd(v, axis=0))
+    assert np.array_equal(low, np.nanmin(v, axis=0))
+    assert np.array_equal(high, np.nanmax(v, axis=0))
+
+    n, mean, std, low, high = stats.summary(windowed=True)
+    v = v[-100:]
+    assert np.array_equal(n, (~np.isnan(v)).sum(axis=0))
+    assert np.allclose(mean, np.nanmean(v, axis=0))
+    assert np.allclose(std, np.nanstd(v, axis=0))
+    assert np.array_equal(low, np.nanmin(v, axis=0))
+    assert np.array_equal(high, np.nanmax(v, axis=0))
+
+    assert stats.get('b', 1, windowed=True)[1] == mean[2]
+
+def test_running_stats_without_samples():
+    stats = RunningStats(FIELDS)
+    data = records(10)
+    data['a'] = np.nan
+    stats.add(data)
+    n, mean, std, low, high = stats.get('a')
+    assert n == 0 and np.isnan(mean) and np.isnan(low) and np.isnan(high)
+
+def oadev(y, m, stride=1):
+    '''Overlapping Allan deviation of evenly spaced samples y at m samples, from the second
+    differences of their running sum taken every stride samples.'''
+    x = np.r_[0, np.cumsum(y)][::stride]
+    lag = m//stride
+    d = x[2*lag:] - 2*x[lag:-lag] + x[:-2*lag]
+    return np.sqrt(np.mean(d**2)/(2*m**2))
+
+def test_allan_deviation_matches_the_direct_sum():
+    data = records(5000)
+    allan = AllanDeviation([('a', None), ('b', 0)], FIELDS, exact=4)
+    add_in_pieces(allan, data)
+    tau, adev = allan.deviation()
+    assert len(tau) == 12 #the last octave needing 2*2^12 <= 5000 records
+    assert np.allclose(tau, 0.1*2**np.arange(12))
+    for octave in range(12):
+        m = 2**octave
+        stride = max(m//2**4, 1) #octaves past 2^exact only use every stride-th running sum
+        assert np.isclose(adev[octave, 0], oadev(data['a'], m, stride), rtol=1e-10)
+        assert np.isclose(adev[octave, 1], oadev(data['b'][:, 0], m, stride), rtol=1e-10)
+
+def test_allan_deviation_blocks_match_single_records():
+    data = records(3000, nans=0.01)
+    one, block, pieces = [AllanDeviation([('a', None), ('b', 0), ('b', 1)], FIELDS, exact=3) for i in range(3)]
+    for i in range(len(data)):
+        one.add(data[i:i+1])
+    block.add(data)
+    add_in_pieces(pieces, data)
+    reference = one.deviation()[1]
+    assert np.allclose(block.deviation()[1], reference, rtol=1e-10, equal_nan=True)
+    assert np.allclose(pieces.deviation()[1], reference, rtol=1e-10, equal_nan=True)
+    assert np.array_equal(block.counts, one.counts) #differences across a nan left out alike
+
+def test_tiered_history_parts_are_views():
+    history = TieredHistory(FIELDS, recent=10., memory=1e6)
+    data = records(3000)
+    for record in data:
+        history.append(time=record['time'], a=record['a'], b=record['b'])
+    parts = history.parts()
+    assert len(parts) > 1
+    assert np.shares_memory(parts[-1], history.recent_records())
+    assert sum(len(part) for part in parts) == len(history)
+    assert np.array_equal(np.concatenate([part['time'] for part in parts]), history['time'])
+    recent = history.window(data['time'][-1] - 5)
+    assert np.shares_memory(recent, history.recent_records())
+    assert np.array_equal(recent['a'], data['a'][-51:])
+
+def test_window_stats_match_numpy_across_tiers():
+    random = np.random.RandomState(7)
+    data = records(60000, nans=0.05)
+    data['time'] = np.cumsum(random.uniform(0.01, 0.05, len(data))) #uneven, as frames come
+    history = TieredHistory(FIELDS, recent=120., tiers=((1., 600.), (60., None)), memory=1e7)
+    for record in data[:30000]:
+        history.append(time=record['time'], a=record['a'], b=record['b'])
+    history.extend(data[30000:])
+    assert all(len(tier) > 0 for tier in history.tiers)
+    last = data['time'][-1]
+    # decimated tiers only hold whole buckets, so windows reaching into them start on a bucket
+    for start, end in [(last - 100.37, last - 3.2), (last - 0.3, last), (np.floor(last - 400), last - 7.7), (np.floor((last - 1500)/60)*60, None)]:
+        v = values(data[(data['time'] >= start) & (data['time'] <= (last if end is None else end))])
+        n, mean, std, low, high = history.summary(start, end)
+        assert [c[0] for c in components(FIELDS)] == ['a', 'b', 'b']
+        assert np.array_equal(n, (~np.isnan(v)).sum(axis=0))
+        assert np.allclose(mean, np.nanmean(v, axis=0))
+        assert np.allclose(std, np.nanstd(v, axis=0))
+        assert np.array_equal(low, np.nanmin(v, axis=0))
+        assert np.array_equal(high, np.nanmax(v, axis=0))
@@ -0,0 +1,52 @@
+import numpy as np
+import cv2
+
+from utils.output import GeometricTransform
+
+def frame(width=64, height=48):
+    return np.random.RandomState(0).randint(0, 256, (height, width)).astype(np.uint8)
+
+def test_identity_passes_frames_through():
+    transform = GeometricTransform()
+    image = frame()
+    assert transform.update(64, 48, 0, 1)
+    assert not transform.update(64, 48, 0, 1) #nothing changed, so no rebuild
+    assert transform.analysis(image) is image
+    assert transform.analysis_size == (64, 48)
+
+def test_half_turn_flips_the_frame():
+    transform = GeometricTransform()
+    image = frame()
+    transform.update(64, 48, 180, 1)
+    assert transform.analysis_size == (64, 48)
+    assert np.array_equal(transform.analysis(image), image[::-1, ::-1])
+
+def test_zoom_crops_the_centre():
+    transform = GeometricTransform()
+    image = frame()
+    transform.update(64, 48, 0, 2)
+    assert transform.analysis_size == (32, 24)
+    assert np.array_equal(transform.analysis(image), image[12:36, 16:48])
+
+def test_distort_matches_opencv():
+    transform = GeometricTransform()
+    transform.camera_matrix = np.array([[500., 0, 320], [0, 480., 240], [0, 0, 1]])
+    transform.dist_coeffs = np.array([-0.2, 0.05, 0.001, -0.002, 0.01])
+    x, y = np.meshgrid(np.linspace(0, 639, 9), np.linspace(0, 479, 7))
+    xd, yd = transform.distort(x, y, 640, 480)
+
+    K = transform.camera_matrix
+    points = np.dstack([(x - K[0, 2])/K[0, 0], (y - K[1, 2])/K[1, 1], np.ones_like(x)]).reshape(-1, 1, 3)
+    reference = cv2.projectPoints(points, np.zeros(3), np.zeros(3), K, transform.dist_coeffs)[0].reshape(-1, 2)
+    assert np.allclose(xd.ravel(), reference[:, 0])
+    assert np.allclose(yd.ravel(), reference[:, 1])
+
+def test_distort_scales_to_the_resolution():
+    transform = GeometricTransform()
+    transform.camera_matrix = np.array([[500., 0, 320], [0, 480., 240], [0, 0, 1]])
+    transform.dist_coeffs = np.array([-0.2, 0.05, 0., 0., 0.])
+    x, y = np.array([100., 500.]), np.array([50., 400.])
+    full = transform.distort(x, y, 640, 480)
+    transform.calib_size = (1280, 960) #calibrated at twice the resolution
+    transform.camera_matrix = transform.camera_matrix*[[2], [2], [1]]
+    assert np.allclose(transform.distort(x, y, 640, 480), full)
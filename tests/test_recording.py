@@ -0,0 +1,111 @@
+import os
+import numpy as np
+
+from utils.history import RunningStats, AllanDeviation
+from utils.recording import MeasurementLog, LogReader, FrameRecorder, FrameReader, ReplayStats
+
+FIELDS = [('time', 'f8'), ('a', 'f8'), ('b', 'f8', (2,))]
+
+def records(n):
+    out = np.zeros(n, np.dtype(FIELDS))
+    out['time'] = 0.5*np.arange(n)
+    out['a'] = np.arange(n)
+    out['b'] = np.arange(2*n).reshape(n, 2)
+    return out
+
+def write_log(directory, data, chunk_size=64):
+    log = MeasurementLog(directory, FIELDS, chunk_size=chunk_size, flush_interval=60.)
+    log.start()
+    for record in data:
+        assert log.add(record)
+    log.stop()
+    log.join(10)
+    assert log.error is None and log.dropped == 0
+
+def test_log_round_trip(tmp_path):
+    directory = str(tmp_path/'log')
+    data = records(300)
+    write_log(directory, data)
+    reader = LogReader(directory)
+    assert len(reader) == 300
+    assert len(reader.chunks) == 5 #four full chunks and the one being filled
+    assert reader.time_range() == (0., 149.5)
+    assert np.dtype(reader.fields()) == np.dtype(FIELDS)
+    assert np.array_equal(reader.query(), data)
+    assert np.array_equal(reader.query(20., 40.), data[40:81])
+    assert np.array_equal(np.concatenate(list(reader.blocks(20., 40.))), data[40:81])
+    assert np.array_equal(np.concatenate(list(reader.blocks())), data)
+
+def test_log_chunks_missing_from_the_index_are_found(tmp_path):
+    directory = str(tmp_path/'log')
+    data = records(100)
+    write_log(directory, data)
+    os.remove(os.path.join(directory, 'index.json')) #as if the crash came before the index was written
+    assert np.array_equal(LogReader(directory).query(), data)
+
+def test_log_drops_records_when_full(tmp_path):
+    log = MeasurementLog(str(tmp_path/'log'), FIELDS, queue_size=2) #not started, so nothing is written
+    data = records(3)
+    assert log.add(data[0]) and log.add(data[1])
+    assert not log.add(data[2])
+    assert log.dropped == 1
+
+def test_replay_stats_follow_seeks(tmp_path):
+    directory = str(tmp_path/'log')
+    data = records(3000)
+    data['a'] = np.random.RandomState(6).normal(0, 1, len(data))
+    write_log(directory, data)
+    reader = LogReader(directory)
+    fresh = lambda: (RunningStats(FIELDS, window=50), AllanDeviation([('a', None), ('b', 0)], FIELDS, exact=3))
+    replay = ReplayStats(reader, *fresh(), spacing=256, max_checkpoints=4)
+    for t in (1000., 1200., 300., 300.5, 299.5, 1499.5, 10.):
+        stats, allan = replay.seek(t)
+        reference_stats, reference_allan = fresh()
+        reference_stats.add(data[data['time'] <= t])
+        reference_allan.add(data[data['time'] <= t])
+        for got, want in zip(stats.summary() + stats.summary(True), reference_stats.summary() + reference_stats.summary(True)):
+            assert np.allclose(got, want, equal_nan=True)
+        assert np.allclose(allan.deviation()[1], reference_allan.deviation()[1], equal_nan=True)
+        assert len(replay.checkpoints) <= 4
+    assert replay.spacing > 256 #thinned out on the way to the end
+
+def test_frames_round_trip(tmp_path):
+    directory = str(tmp_path/'frames')
+    random = np.random.RandomState(5)
+    frames = [random.randint(0, 256, (12, 16, 3)).astype(np.uint8) for i in range(10)]
+    frames += [random.randint(0, 256, (6, 8, 3)).astype(np.uint8) for i in range(3)] #a change of size starts a new chunk
+    ids = [0, 1, 2, 3, 4, 6, 7, 8, 9, 10, 11, 12, 13] #frame 5 never arrived
+    recorder = FrameRecorder(directory, chunk_frames=4, info={'pixel_scale': 2.5})
+    recorder.start()
+    for i, frame in enumerate(frames):
+        assert recorder.add(frame, 0.1*ids[i], ids[i])
+    recorder.stop()
+    recorder.join(10)
+    assert recorder.error is None and recorder.recorded == len(frames)
+
+    reader = FrameReader(directory)
+    assert len(reader) == len(frames)
+    for i, frame in enumerate(frames):
+        assert np.array_equal(reader[i], frame)
+    assert list(reader.frame_ids) == ids
+    assert reader.missing() == 1
+    assert reader.info == {'pixel_scale': 2.5}
+    assert reader.at(0.48) == 4 #frame 5 is missing, so the frames either side are at 0.4 and 0.6 s
+    assert reader.at(0.52) == 5
+    assert reader.at(-1.) == 0 and reader.at(100.) == len(frames) - 1
+
+def test_stopping_a_failed_recorder_returns(tmp_path):
+    recorder = FrameRecorder(str(tmp_path/'frames'), queue_size=4)
+    def fail(frame, t, frame_id):
+        raise OSError('disk full')
+    recorder.write = fail
+    frame = np.zeros((4, 4), np.uint8)
+    for i in range(4):
+        recorder.add(frame, 0.1*i, i)
+    recorder.start()
+    recorder.join(10)
+    assert isinstance(recorder.error, OSError)
+    while not recorder.queue.full(): #nothing is left to empty it
+        recorder.queue.put_nowait((frame, 0., 0))
+    recorder.stop()
+    assert not recorder.add(frame, 1., 5)
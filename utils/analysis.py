@@ -1,24 +1,183 @@
 import cv2
 import numpy as np
 
-import matplotlib.pyplot as plt
-from matplotlib import cm
-from matplotlib.patches import Circle
-
-import scipy.optimize as opt
-from scipy import ndimage
-from scipy.ndimage.filters import gaussian_filter, convolve
-import scipy.integrate as integrate
-
 import copy
-
-from PIL import Image
 import threading
+
+# scipy and matplotlib are imported where they are used, keeping them out of startup
+        
+def otsu_threshold(hist):
+    '''Finds Otsu's threshold from a 256 bin intensity histogram.'''
+    hist = hist.ravel().astype(np.float64)
+    total = hist.sum()
+    if total == 0:
+        return 0
+    w0 = np.cumsum(hist) #pixels at or below each threshold
+    mu = np.cumsum(hist*np.arange(len(hist)))
+    w1 = total - w0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        between = (mu[-1]*w0 - mu*total)**2 / (w0*w1) #between class variance (unnormalised)
+    between[~np.isfinite(between)] = 0
+    return int(np.argmax(between))
+
+class ChangeGate():
+    '''Decides whether a frame has changed enough since the last analysed one to be worth
+    analysing again. Downsampled copies are compared and the largest difference is tested
+    against what the sensor noise alone would give.'''
+    def __init__(self, factor=8, threshold=5.):
+        self.factor = factor #downsampling factor in each direction
+        self.threshold = threshold #allowed difference in noise standard deviations
+        self.enabled = False
+        self.last = None
+        self.reused, self.total = 0, 0
+        
+    def reset(self):
+        self.last = None
+        self.reused, self.total = 0, 0
+        
+    def changed(self, frame, noise):
+        '''Returns True if the frame differs from the last analysed one by more than the noise.'''
+        height, width = frame.shape[:2]
+        small = cv2.resize(frame, (max(width//self.factor, 1), max(height//self.factor, 1)), interpolation=cv2.INTER_AREA)
+        self.total += 1
+        if self.last is None or self.last.shape != small.shape:
+            self.last = small
+            return True
+        # averaging factor**2 pixels reduces the noise by factor, but not below the 8 bit rounding
+        limit = self.threshold*np.sqrt(2*((float(noise)/self.factor)**2 + 1/12.))
+        if cv2.norm(small, self.last, cv2.NORM_INF) > limit:
+            self.last = small
+            return True
+        self.reused += 1
+        return False
+        
+    def reuse_ratio(self):
+        return float(self.reused)/self.total if self.total > 0 else 0.
+        
+class FrameStack():
+    '''Averages the last n frames using a ring of frames and a running integer sum, so each
+    new frame costs one add and one subtract however many frames are averaged.'''
+    def __init__(self, n=1):
+        self.n = n
+        self.decimate = False #only analyse once every n frames
+        self.ring, self.sum, self.out = None, None, None
+        self.index, self.count, self.fresh = 0, 0, 0
+        
+    def enabled(self):
+        return self.n > 1
+        
+    def set_length(self, n):
+        self.n = max(int(n), 1)
+        self.ring = None
+        
+    def add(self, frame):
+        '''Adds the newest frame and drops the oldest one from the running sum.'''
+        if self.ring is None or self.ring.shape[1:] != frame.shape:
+            self.ring = np.zeros((self.n,) + frame.shape, np.uint8)
+            self.sum = np.zeros(frame.shape, np.int32)
+            self.out = np.empty(frame.shape, np.uint8)
+            self.index, self.count, self.fresh = 0, 0, 0
+        np.subtract(self.sum, self.ring[self.index], out=self.sum)
+        np.add(self.sum, frame, out=self.sum)
+        self.ring[self.index] = frame
+        self.index = (self.index + 1) % self.n
+        self.count = min(self.count + 1, self.n)
+        self.fresh += 1
+        
+    def average(self):
+        cv2.convertScaleAbs(self.sum, self.out, alpha=1./max(self.count, 1)) #rounds to uint8, the sum is never negative
+        return self.out
+        
+    def due(self):
+        '''Whether the averaged frame should be analysed now. Counts as analysing it, so only
+        ask once the frame is otherwise going to be.'''
+        if not self.enabled() or not self.decimate:
+            return True
+        if self.fresh >= self.n:
+            self.fresh = 0
+            return True
+        return False
+        
+class AutoExposure():
+    '''Drives the exposure so that the beam peak sits at a target fraction of full scale.
+    The exposure setting is bracketed between the camera limits and the bracket is halved
+    once per measurement, with the frames taken while the camera settles thrown away.'''
+    def __init__(self, low=-15, high=-1, target=0.8, tolerance=0.1, settle=3, step=1):
+        self.low, self.high = low, high #exposure setting limits
+        self.target = target #wanted peak as a fraction of full scale
+        self.tolerance = tolerance
+        self.settle = settle #frames discarded after every exposure change
+        self.step = step #smallest exposure change the camera honours
+        self.active = False
+        self.lo, self.hi = low, high
+        self.hi_measured = False
+        self.wait = 0
+        
+    def start(self):
+        self.lo, self.hi = self.low, self.high
+        self.hi_measured = False #whether hi is known to be too bright or just the camera limit
+        self.wait = self.settle
+        self.active = True
+        
+    def stop(self):
+        self.active = False
+        
+    def next_exposure(self, exp, peak):
+        '''Takes the peak pixel value of a frame taken at exposure exp. Returns the exposure to
+        try next, or None if it should stay as it is. active is cleared once converged.'''
+        if not self.active:
+            return None
+        if self.wait > 0: #the camera may still be delivering frames at the old exposure
+            self.wait -= 1
+            return None
+        level = peak/255.
+        if abs(level - self.target) <= self.tolerance:
+            self.active = False
+            return None
+        if level > self.target: #too bright or saturated, the answer is below exp
+            self.hi = min(self.hi, exp)
+            self.hi_measured = True
+        else:
+            self.lo = max(self.lo, exp)
+        if self.hi - self.lo <= self.step: #bracket closed, settle on the side that does not saturate
+            self.active = False
+            new_exp = self.lo if self.hi_measured else self.hi
+            return new_exp if new_exp != exp else None
+        new_exp = self.lo + self.step*int(round((self.hi - self.lo)/(2.*self.step)))
+        self.wait = self.settle
+        return new_exp
         
 class Analyse(threading.Thread):
     def __init__(self, master):
         threading.Thread.__init__(self)
         self.master = master       
+        self.hist = np.zeros(256, np.float32)
+        self.cdf = np.zeros(256, np.float32)
+        self.otsu = 0
+        
+    def calc_histogram(self):
+        '''Builds the intensity histogram of the analysis frame once per frame and derives
+        the Otsu threshold, min/max pixel values, saturation and noise floor from it.'''
+        self.hist = cv2.calcHist([self.master.analysis_frame], [0], None, [256], [0, 256]).ravel()
+        self.cdf = np.cumsum(self.hist)
+        total = self.cdf[-1]
+        self.otsu = otsu_threshold(self.hist)
+        
+        filled = np.nonzero(self.hist)[0]
+        if len(filled) > 0:
+            self.master.min_value, self.master.peak_value = int(filled[0]), int(filled[-1])
+        else:
+            self.master.min_value, self.master.peak_value = np.nan, np.nan
+        self.master.saturated_pixels = int(self.hist[255])
+        self.master.saturated_fraction = self.hist[255]/total if total > 0 else 0.
+        self.master.noise_floor = self.hist_percentile(50)
+        
+    def hist_percentile(self, q):
+        '''Returns the pixel value below which q percent of the pixels in the frame lie.'''
+        total = self.cdf[-1]
+        if total == 0:
+            return np.nan
+        return int(np.searchsorted(self.cdf, total*q/100.))
         
     def get_centroid(self):
         # function finds centroid of a white laserspot within a dark background
@@ -117,9 +276,9 @@ class Analyse(threading.Thread):
         return centroid
         
     def find_ellipses(self):
-        # Otsu's threshbesting after Gaussian filtering
+        # Otsu's threshbesting after Gaussian filtering. threshold comes from the shared frame histogram
         blur = cv2.GaussianBlur(self.master.analysis_frame,(5,5),0)
-        ret,thresh = cv2.threshold(blur,0,255,cv2.THRESH_BINARY+cv2.THRESH_OTSU)
+        ret,thresh = cv2.threshold(blur,self.otsu,255,cv2.THRESH_BINARY)
 
         # ret,thresh = cv2.threshold(self.master.analysis_frame,127,255,0)
         _,contours,hierarchy = cv2.findContours(thresh, 1, 2)
@@ -148,6 +307,7 @@ class Analyse(threading.Thread):
         return I
         
     def fit_gaussian(self, with_bounds):
+        import scipy.optimize as opt
         size = 50
         x, y = self.master.peak_cross
         self.crop_img = self.master.analysis_frame[y-size/2:y+size/2, x-size/2:x+size/2]
@@ -190,6 +350,8 @@ class Analyse(threading.Thread):
         return pred_params
 
     def plot_gaussian(self, ax, params):           
+        import matplotlib.pyplot as plt
+        from matplotlib.patches import Circle
         if self.master.colourmap is None:
             cmap=plt.cm.BrBG
         elif self.master.colourmap == 2:
@@ -230,6 +392,7 @@ class Analyse(threading.Thread):
     def find_peak(self):
         # apply a Gaussian blur to the image then find the brightest
         # region
+        from scipy.ndimage.filters import gaussian_filter
         img = gaussian_filter(self.master.analysis_frame, 10, mode='constant')
         gray = cv2.GaussianBlur(img, (5,5), 0)
         (minVal, maxVal, minLoc, maxLoc) = cv2.minMaxLoc(gray)
@@ -265,6 +428,7 @@ class Analyse(threading.Thread):
         return pts
         
     def get_beam_width(self):
+        from scipy.ndimage.filters import convolve
         infilm = self.master.analysis_frame_colour
         a,b,c = infilm.shape
         X = np.zeros((1,c - 1))
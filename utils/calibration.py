@@ -0,0 +1,318 @@
+import os
+import numpy as np
+import cv2
+import threading
+
+try:
+    import Queue
+except ImportError:
+    import queue as Queue
+
+class StackAccumulator():
+    '''Accumulates a stack of frames in place in float32, giving the per-pixel mean and
+    noise standard deviation without keeping the frames themselves.'''
+    def __init__(self, n_frames):
+        self.n_frames = n_frames
+        self.count = 0
+        self.sum, self.sum_sq, self.buf = None, None, None
+
+    def add(self, frame):
+        '''Adds one frame to the stack. Returns True once the stack is complete.'''
+        if self.sum is None or self.sum.shape != frame.shape:
+            self.sum = np.zeros(frame.shape, np.float32)
+            self.sum_sq = np.zeros(frame.shape, np.float32)
+            self.buf = np.empty(frame.shape, np.float32)
+            self.count = 0
+        np.copyto(self.buf, frame, casting='unsafe')
+        self.sum += self.buf
+        np.multiply(self.buf, self.buf, out=self.buf)
+        self.sum_sq += self.buf
+        self.count += 1
+        return self.count >= self.n_frames
+
+    def progress(self):
+        return 100.*self.count/self.n_frames
+
+    def mean(self):
+        return self.sum/max(self.count, 1)
+
+    def std(self):
+        mean = self.mean()
+        var = self.sum_sq/max(self.count, 1) - mean**2
+        return np.sqrt(np.clip(var, 0, None))
+
+class StackWorker(threading.Thread):
+    '''Accumulates a stack of frames on a worker thread so calibration never blocks the GUI.
+    Frames are handed over with add() and the result is picked up once done is set.'''
+    def __init__(self, n_frames):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.stack = StackAccumulator(n_frames)
+        self.queue = Queue.Queue(maxsize=n_frames)
+        self.done = False
+        self.cancelled = False
+        self.mean, self.std = None, None
+
+    def add(self, frame):
+        '''Queues a copy of the frame, dropping it if the worker has fallen behind.'''
+        if self.done or self.cancelled:
+            return
+        try:
+            self.queue.put_nowait(frame.copy())
+        except Queue.Full:
+            pass
+
+    def progress(self):
+        return self.stack.progress()
+
+    def cancel(self):
+        self.cancelled = True
+        try:
+            self.queue.put_nowait(None)
+        except Queue.Full:
+            pass
+
+    def run(self):
+        while not self.cancelled:
+            frame = self.queue.get()
+            if frame is None:
+                continue
+            if self.stack.add(frame):
+                self.mean, self.std = self.stack.mean(), self.stack.std()
+                self.done = True
+                break
+
+class BackgroundModel():
+    '''Continuously updated background: an exponential moving average over the pixels away
+    from the beam, which tracks ambient drift, along with the running per-pixel noise.'''
+    def __init__(self, alpha=0.02, margin=15):
+        self.alpha = alpha #weight of each new frame
+        self.kernel = np.ones((margin, margin), np.uint8) #keeps the beam wings out of the model
+        self.enabled = False
+        self.mean, self.var = None, None
+        self.buf, self.diff, self.out = None, None, None
+
+    def reset(self, background=None, noise=None):
+        '''Restarts the model, optionally from a calibrated background and noise.'''
+        self.mean, self.var = None, None
+        if isinstance(background, np.ndarray):
+            self.mean = background.astype(np.float32)
+            self.var = np.ones(background.shape, np.float32)
+            if noise is not None and noise.shape == background.shape:
+                self.var = (noise**2).astype(np.float32)
+
+    def update(self, frame, threshold):
+        '''Adds the frame to the model everywhere except where the beam is more than threshold
+        above the model, as the threshold comes from background subtracted frames. The typical
+        difference across the frame is taken as drift, so it is tracked rather than masked.'''
+        grey = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        if self.mean is None or self.mean.shape != frame.shape:
+            excess = grey.astype(np.float32) #no model yet
+        else:
+            excess = grey - (cv2.cvtColor(self.mean, cv2.COLOR_BGR2GRAY) if self.mean.ndim == 3 else self.mean)
+        excess -= np.median(excess[::4, ::4]) #a change of ambient light over the whole frame is drift, not beam
+        beam = cv2.dilate(np.array(excess > threshold, np.uint8), self.kernel)
+        background = np.array(beam == 0, np.uint8)
+
+        if self.mean is None or self.mean.shape != frame.shape:
+            self.mean = frame.astype(np.float32)
+            if beam.any(): #do not start the model off with the beam in it
+                self.mean[beam > 0] = np.median(frame[beam == 0], axis=0) if background.any() else 0
+            self.var = np.ones(frame.shape, np.float32)
+        if self.buf is None or self.buf.shape != frame.shape:
+            self.buf = np.empty(frame.shape, np.float32)
+            self.diff = np.empty(frame.shape, np.float32)
+            self.out = np.empty(frame.shape, np.uint8)
+
+        np.copyto(self.buf, frame, casting='unsafe')
+        cv2.subtract(self.buf, self.mean, self.diff)
+        cv2.multiply(self.diff, self.diff, self.diff)
+        cv2.accumulateWeighted(self.buf, self.mean, self.alpha, mask=background)
+        cv2.accumulateWeighted(self.diff, self.var, self.alpha, mask=background)
+
+    def background(self):
+        cv2.convertScaleAbs(self.mean, self.out) #rounds and saturates, the mean is never negative
+        return self.out
+
+    def noise(self):
+        '''Per-pixel noise standard deviation.'''
+        return np.sqrt(self.var)
+
+    def noise_level(self):
+        '''Noise standard deviation averaged over the frame.'''
+        return float(np.sqrt(np.mean(self.var)))
+
+class FlatField():
+    '''Dark frame subtraction and per-pixel gain correction for pixel response non-uniformity.
+    The calibration is stored on disk per camera and resolution.'''
+    def __init__(self, directory='calibration'):
+        self.directory = directory
+        self.dark, self.dark_std, self.gain = None, None, None
+        self.offset, self.dark_u8 = None, None
+        self.buf, self.out = None, None
+        self.noise = None #mean per-pixel noise standard deviation of the dark stack
+
+    def filename(self, camera_index, width, height):
+        return os.path.join(self.directory, 'flatfield_cam%i_%ix%i.npz' % (camera_index, width, height))
+
+    def is_active(self):
+        return self.dark is not None
+
+    def set_dark(self, dark, dark_std):
+        '''Sets the mean and noise of a stack of frames taken with no light on the sensor.'''
+        self.dark, self.dark_std = dark.astype(np.float32), dark_std.astype(np.float32)
+        self.prepare()
+
+    def set_flat(self, flat):
+        '''Computes the gain map from the mean of a stack of uniformly illuminated frames.'''
+        if self.dark is not None and self.dark.shape == flat.shape:
+            response = flat - self.dark
+        else:
+            response = np.array(flat, np.float32)
+        level = response.mean()
+        gain = np.ones(response.shape, np.float32)
+        responsive = response > 0.01*level #unresponsive pixels are left to the hot pixel map
+        gain[responsive] = level/response[responsive]
+        self.gain = gain
+        if self.dark is None:
+            self.dark, self.dark_std = np.zeros(flat.shape, np.float32), np.zeros(flat.shape, np.float32)
+        self.prepare()
+
+    def prepare(self):
+        '''Precomputes what the per frame correction needs.'''
+        self.dark_u8 = np.array(np.round(self.dark), dtype=np.uint8)
+        self.noise = float(np.mean(self.dark_std))
+        if self.gain is not None:
+            self.offset = self.dark*self.gain #frame*gain - dark*gain == (frame - dark)*gain
+        self.buf, self.out = None, None
+
+    def reset(self):
+        self.dark, self.dark_std, self.gain = None, None, None
+        self.offset, self.dark_u8 = None, None
+        self.buf, self.out = None, None
+        self.noise = None
+
+    def correct(self, frame):
+        '''Applies the correction, reusing preallocated buffers. Frames of a different shape
+        to the calibration are returned untouched.'''
+        if self.dark is None or frame.shape != self.dark.shape:
+            return frame
+        if self.gain is None:
+            return cv2.subtract(frame, self.dark_u8)
+        if self.buf is None:
+            self.buf = np.empty(frame.shape, np.float32)
+            self.out = np.empty(frame.shape, np.uint8)
+        cv2.multiply(frame, self.gain, self.buf, dtype=cv2.CV_32F)
+        cv2.subtract(self.buf, self.offset, self.buf)
+        np.clip(self.buf, 0, 255, out=self.buf)
+        np.copyto(self.out, self.buf, casting='unsafe')
+        return self.out
+
+    def save(self, camera_index, width, height):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        filename = self.filename(camera_index, width, height)
+        gain = self.gain if self.gain is not None else np.array([])
+        np.savez(filename, dark=self.dark, dark_std=self.dark_std, gain=gain)
+        return filename
+
+    def load(self, camera_index, width, height):
+        '''Loads a stored calibration. Returns the filename, or None if there isn't one.'''
+        filename = self.filename(camera_index, width, height)
+        self.reset()
+        if not os.path.isfile(filename):
+            return None
+        data = np.load(filename)
+        self.dark, self.dark_std = data['dark'], data['dark_std']
+        self.gain = data['gain'] if data['gain'].size > 0 else None
+        self.prepare()
+        return filename
+
+class HotPixelMap():
+    '''Finds hot, flickering and dead pixels from dark (and flat) stacks and replaces just
+    those pixels in each frame with the median of their neighbours.'''
+    def __init__(self, directory='calibration', threshold=6.):
+        self.directory = directory
+        self.threshold = threshold #robust standard deviations from the local median
+        self.shape = None
+        self.bad = np.array([], np.intp) #flat indices of the bad pixels
+        self.neighbours = np.zeros((0, 8), np.intp) #flat indices of their 8 neighbours
+
+    def filename(self, camera_index, width, height):
+        return os.path.join(self.directory, 'hotpixels_cam%i_%ix%i.npz' % (camera_index, width, height))
+
+    def is_active(self):
+        return len(self.bad) > 0
+
+    def outliers(self, image, above=True):
+        '''Pixels that stand out from their 3x3 neighbourhood by more than threshold robust sigmas.'''
+        image = np.array(image, np.float32)
+        residual = image - cv2.medianBlur(image, 3)
+        if not above:
+            residual = -residual
+        mad = np.median(np.abs(residual - np.median(residual)))
+        sigma = max(1.4826*mad, 0.5)
+        return residual > self.threshold*sigma
+
+    def detect(self, dark, dark_std=None, flat=None):
+        '''Builds the bad pixel map from the mean (and noise) of a dark stack and, optionally,
+        the mean of a flat stack. Returns the number of bad pixels found.'''
+        grey = lambda img: img.max(axis=2) if img.ndim == 3 else img
+        mask = self.outliers(grey(dark))
+        if dark_std is not None:
+            mask |= self.outliers(grey(dark_std)) #flickering pixels
+        if flat is not None:
+            flat = grey(flat) - (grey(dark) if dark is not None else 0)
+            mask |= self.outliers(flat, above=False) #dead or weak pixels
+        self.build(mask)
+        return len(self.bad)
+
+    def build(self, mask):
+        '''Precomputes the flat indices of the bad pixels and of their neighbours.'''
+        height, width = mask.shape
+        self.shape = mask.shape
+        rows, cols = np.nonzero(mask)
+        neighbours = []
+        for dr in (-1, 0, 1):
+            for dc in (-1, 0, 1):
+                if dr == 0 and dc == 0:
+                    continue
+                r, c = rows + dr, cols + dc
+                r = np.where(r < 0, -r, np.where(r >= height, 2*(height-1) - r, r)) #reflect at the edges
+                c = np.where(c < 0, -c, np.where(c >= width, 2*(width-1) - c, c))
+                neighbours.append(r*width + c)
+        self.bad = (rows*width + cols).astype(np.intp)
+        self.neighbours = np.array(neighbours, np.intp).T.reshape(-1, 8)
+
+    def patch(self, frame):
+        '''Replaces the bad pixels of the frame in place.'''
+        if len(self.bad) == 0 or frame.shape[:2] != self.shape:
+            return frame
+        if not frame.flags['C_CONTIGUOUS']:
+            frame = np.ascontiguousarray(frame)
+        pixels = frame.reshape(self.shape[0]*self.shape[1], -1)
+        pixels[self.bad] = np.median(pixels[self.neighbours], axis=1)
+        return frame
+
+    def reset(self):
+        self.shape = None
+        self.bad = np.array([], np.intp)
+        self.neighbours = np.zeros((0, 8), np.intp)
+
+    def save(self, camera_index, width, height):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        filename = self.filename(camera_index, width, height)
+        np.savez(filename, shape=np.array(self.shape), bad=self.bad, neighbours=self.neighbours)
+        return filename
+
+    def load(self, camera_index, width, height):
+        '''Loads a stored map. Returns the filename, or None if there isn't one.'''
+        filename = self.filename(camera_index, width, height)
+        self.reset()
+        if not os.path.isfile(filename):
+            return None
+        data = np.load(filename)
+        self.shape = tuple(int(i) for i in data['shape'])
+        self.bad, self.neighbours = data['bad'].astype(np.intp), data['neighbours'].astype(np.intp)
+        return filename
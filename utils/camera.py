@@ -0,0 +1,218 @@
+import cv2
+import numpy as np
+import threading
+import time
+import collections
+import json
+import os
+
+from . import calibration
+
+try:
+    import Queue
+except ImportError:
+    import queue as Queue
+
+def parse_modes(text):
+    '''Parses a list of capture modes such as "1280x720, 640x360@60" into (width, height, fps) tuples.'''
+    modes = []
+    for mode in text.replace(' ', '').split(','):
+        if mode == '':
+            continue
+        fps = 0
+        if '@' in mode:
+            mode, fps = mode.split('@')
+        width, height = mode.lower().split('x')
+        modes.append((int(width), int(height), float(fps)))
+    return modes
+
+def choose_mode(modes, sensor_width, beam_size, min_pixels):
+    '''Picks the smallest capture mode in which a beam beam_size full-sensor pixels across
+    still spans at least min_pixels pixels. Returns None if none of them do.'''
+    for mode in sorted(modes, key=lambda m: m[0]*m[1]):
+        if beam_size*mode[0]/float(sensor_width) >= min_pixels:
+            return mode
+    return None
+
+def negotiate_mode(cap, width, height, fps=0):
+    '''Asks the camera for a capture mode and returns the (width, height, fps) it settled on,
+    which may differ from what was asked for.'''
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+    if fps > 0:
+        cap.set(cv2.CAP_PROP_FPS, fps)
+    actual_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)) or int(width) #some backends report 0 until the first read
+    actual_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)) or int(height)
+    return actual_width, actual_height, cap.get(cv2.CAP_PROP_FPS)
+
+def probe(index):
+    '''Opens a camera index and reads a frame. Returns its inventory entry, or None if there
+    is no working camera there.'''
+    cap = cv2.VideoCapture(index)
+    try:
+        if not cap.isOpened():
+            return None
+        ret, frame = cap.read()
+        if not ret or frame is None:
+            return None
+        backend = cap.getBackendName() if hasattr(cap, 'getBackendName') else ''
+        return {'index': index, 'width': frame.shape[1], 'height': frame.shape[0], 'backend': backend}
+    except cv2.error:
+        return None
+    finally:
+        cap.release()
+
+def discover(indices=range(7), timeout=5., skip=None):
+    '''Probes the camera indices in parallel. Indices that have not answered within timeout
+    seconds are taken as absent; their threads are left to finish in the background.
+    Entries in skip (index: entry) are kept as they are without being probed, e.g. cameras in use.'''
+    if skip is None:
+        skip = {}
+    found = {}
+    def run(index):
+        entry = probe(index)
+        if entry is not None:
+            found[index] = entry
+    threads = []
+    for index in indices:
+        if index in skip:
+            continue
+        thread = threading.Thread(target=run, args=(index,))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    deadline = time.time() + timeout
+    for thread in threads:
+        thread.join(max(deadline - time.time(), 0))
+    found = dict(found)
+    found.update(skip)
+    return [found[i] for i in sorted(found)]
+
+def load_inventory(filename='cameras.json'):
+    '''The cameras found last time, or [] if they have not been looked for.'''
+    if not os.path.isfile(filename):
+        return []
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except ValueError:
+        return []
+
+def save_inventory(inventory, filename='cameras.json'):
+    with open(filename, 'w') as f:
+        json.dump(inventory, f, indent=1)
+
+def beam_moments(grey, min_signal=20):
+    '''Centroid (x, y) and second moment D4sigma widths (x, y) in pixels of the beam, taken
+    over the pixels above Otsu's threshold. All nan if there is no beam, i.e. the brightest
+    pixel is less than min_signal grey levels above the mean, as Otsu's threshold would
+    otherwise split the background noise.'''
+    if cv2.minMaxLoc(grey)[1] - cv2.mean(grey)[0] < min_signal:
+        return np.nan, np.nan, np.nan, np.nan
+    _, mask = cv2.threshold(grey, 0, 255, cv2.THRESH_BINARY+cv2.THRESH_OTSU)
+    m = cv2.moments(cv2.bitwise_and(grey, mask))
+    if m['m00'] == 0:
+        return np.nan, np.nan, np.nan, np.nan
+    return m['m10']/m['m00'], m['m01']/m['m00'], 4*np.sqrt(m['mu20']/m['m00']), 4*np.sqrt(m['mu02']/m['m00'])
+
+def nearest(times, t, tolerance):
+    '''Index of the entry of the sorted times nearest to t, or None if none lies within tolerance.'''
+    if len(times) == 0:
+        return None
+    i = int(np.searchsorted(times, t))
+    candidates = [j for j in (i-1, i) if 0 <= j < len(times)]
+    j = min(candidates, key=lambda j: abs(times[j] - t))
+    return j if abs(times[j] - t) <= tolerance else None
+
+def pointing(near, far, separation):
+    '''Pointing angles (x, y) and full angle divergence, all in mrad, from the measurements
+    (centroid x, centroid y, width x, width y in um) of the beam at two planes separation mm apart.'''
+    L = separation*1000. #um
+    angle_x = 1000*np.arctan((far[0] - near[0])/L)
+    angle_y = 1000*np.arctan((far[1] - near[1])/L)
+    divergence = 1000*(np.mean(far[2:4]) - np.mean(near[2:4]))/L
+    return angle_x, angle_y, divergence
+
+class CameraWorker(threading.Thread):
+    '''Captures and measures the beam on a further camera on its own thread, with its own
+    settings and background. Measurements are timestamped and kept as
+    (centroid x, centroid y, width x, width y) in um for the controller to align. If the
+    camera cannot be opened, or stops returning frames, the thread ends with error set.'''
+    max_failures = 50 #failed reads in a row, 0.1 s apart, before the camera is given up on
+
+    def __init__(self, name, camera_index, width=640, height=360, pixel_scale=5.6, exp=None, distance=0., min_signal=20):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.name = name
+        self.camera_index = camera_index
+        self.width, self.height = int(width), int(height)
+        self.pixel_scale = pixel_scale #um
+        self.exp = exp
+        self.distance = distance #mm along the beam
+        self.min_signal = min_signal #grey levels above the mean for there to be a beam
+        self.running = True
+        self.error = None #why the camera was given up on
+        self.queue = Queue.Queue() #(time, measurement) waiting for the controller
+        self.times = collections.deque(maxlen=200) #recent measurements for time alignment
+        self.measurements = collections.deque(maxlen=200)
+        self.bg_frame = None
+        self.stack = None
+        self.fps = 0.
+
+    def calibrate_bg(self, n_frames):
+        '''Accumulates a background for this camera from the next n_frames frames.'''
+        self.stack = calibration.StackAccumulator(n_frames)
+
+    def reset_bg(self):
+        self.bg_frame = None
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        cap = cv2.VideoCapture(self.camera_index)
+        if not cap.isOpened():
+            self.error = 'could not be opened'
+            return
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        if self.exp is not None:
+            cap.set(15, self.exp)
+        last = time.time()
+        failures = 0
+        while self.running:
+            ok, frame = cap.read()
+            t = time.time()
+            if not ok or frame is None:
+                failures += 1
+                if failures >= self.max_failures:
+                    self.error = 'stopped returning frames'
+                    break
+                time.sleep(0.1)
+                continue
+            failures = 0
+            self.fps, last = 1./max(t - last, 1e-6), t
+            grey = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            stack = self.stack
+            if stack is not None and stack.add(grey):
+                self.bg_frame = np.array(np.round(stack.mean()), dtype=np.uint8)
+                self.stack = None
+            if self.bg_frame is not None and self.bg_frame.shape == grey.shape:
+                grey = cv2.subtract(grey, self.bg_frame)
+            self.queue.put((t, np.array(beam_moments(grey, self.min_signal))*self.pixel_scale))
+        cap.release()
+
+    def poll(self):
+        '''Moves the queued measurements over to the alignment buffer. Called from the Tk thread.'''
+        while True:
+            try:
+                t, measurement = self.queue.get_nowait()
+            except Queue.Empty:
+                break
+            self.times.append(t)
+            self.measurements.append(measurement)
+
+    def at(self, t, tolerance):
+        '''The measurement nearest in time to t, or None if there isn't one within tolerance.'''
+        i = nearest(np.array(self.times), t, tolerance)
+        return self.measurements[i] if i is not None else None
@@ -0,0 +1,583 @@
+import numpy as np
+
+# one record per analysed frame. positions and sizes are in pixels of the configured resolution,
+# angles in degrees, pointing and divergence in mrad. full_res is 1 for the full resolution
+# measurements of dual resolution mode, 0 otherwise
+FIELDS = [('time', 'f8'),
+          ('centroid_x', 'f8'), ('centroid_y', 'f8'),
+          ('peak_x', 'f8'), ('peak_y', 'f8'),
+          ('angle', 'f8'),
+          ('width', 'f8', (2,)), ('width_e2', 'f8', (2,)),
+          ('ma', 'f8'), ('MA', 'f8'),
+          ('ellipticity', 'f8'), ('eccentricity', 'f8'),
+          ('pointing_x', 'f8'), ('pointing_y', 'f8'), ('divergence', 'f8'),
+          ('full_res', 'f8')]
+
+def camera_fields(names):
+    '''Fields for the measurements of further cameras, in um: the centroid and second moment
+    widths of each, under the camera's name.'''
+    out = []
+    for name in names:
+        name = name.lower()
+        out += [(name + '_centroid_x', 'f8'), (name + '_centroid_y', 'f8'), (name + '_width', 'f8', (2,))]
+    return out
+
+def stats_fields(fields):
+    '''Fields of a decimated tier: the mean of each field under its own name, with its min,
+    max, standard deviation and the number of samples (ignoring nan) alongside.'''
+    out = []
+    for field in fields:
+        name, rest = field[0], tuple(field[2:])
+        for suffix in ('', '_min', '_max', '_std'):
+            out.append((name + suffix, 'f8') + rest)
+        out.append((name + '_n', 'i4') + rest)
+    return out
+
+class HistoryStore():
+    '''Columnar store of the measurements logged throughout the running period. Records live in
+    one structured array that grows geometrically, so appending is amortised O(1), and
+    columns are handed out as views rather than copies. The oldest records can be dropped,
+    and the store never grows beyond max_records.'''
+    def __init__(self, fields=FIELDS, capacity=1024, max_records=None):
+        self.dtype = np.dtype(fields)
+        self.max_records = max_records
+        if max_records is not None:
+            capacity = min(capacity, max_records)
+        self.data = self.empty(capacity)
+        self.blank = self.empty(1)[0] #copied over each slot before it is filled
+        self.start, self.n = 0, 0
+
+    def empty(self, capacity):
+        data = np.empty(capacity, self.dtype)
+        for name in self.dtype.names:
+            data[name] = np.nan if data[name].dtype.kind == 'f' else 0 #fields not given read as nan
+        return data
+
+    def reserve(self, k):
+        '''Makes room for k more records at the end.'''
+        if self.start + self.n + k <= len(self.data):
+            return
+        if self.max_records is not None and self.n + k > self.max_records:
+            self.drop(self.n + k - self.max_records) #full, so the oldest records go
+        if self.n + k <= len(self.data)//2 or len(self.data) == self.max_records: #mostly dropped records, so compact
+            self.data[:self.n] = self.data[self.start:self.start+self.n]
+        else:
+            size = max(2*len(self.data), self.n + k)
+            if self.max_records is not None:
+                size = min(size, self.max_records)
+            data = self.empty(size)
+            data[:self.n] = self.data[self.start:self.start+self.n]
+            self.data = data
+        self.start = 0
+
+    def append(self, **values):
+        '''Adds one record. Fields left out are nan, and None is stored as nan.'''
+        self.reserve(1)
+        i = self.start + self.n
+        self.data[i] = self.blank
+        record = self.data[i]
+        for name, value in values.items():
+            if value is not None:
+                record[name] = value
+        self.n += 1
+
+    def extend(self, records):
+        '''Adds a block of records with the same fields.'''
+        if len(records) == 0:
+            return
+        if self.max_records is not None and len(records) > self.max_records:
+            records = records[-self.max_records:]
+        self.reserve(len(records))
+        i = self.start + self.n
+        self.data[i:i+len(records)] = records
+        self.n += len(records)
+
+    def drop(self, k):
+        '''Forgets the k oldest records.'''
+        k = min(k, self.n)
+        self.start += k
+        self.n -= k
+
+    def set_last(self, **values):
+        '''Fills in fields of the latest record.'''
+        for name, value in values.items():
+            if value is not None:
+                self.data[self.start+self.n-1][name] = value
+
+    def last(self):
+        '''A copy of the latest record.'''
+        return self.data[self.start+self.n-1].copy()
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, name):
+        '''A view of one column over the records so far.'''
+        return self.data[name][self.start:self.start+self.n]
+
+    def records(self):
+        '''A view of all the records so far.'''
+        return self.data[self.start:self.start+self.n]
+
+    def window(self, start=None, end=None):
+        '''A view of the records with start <= time <= end, found by bisection.'''
+        records = self.records()
+        i = 0 if start is None else np.searchsorted(records['time'], start, 'left')
+        j = len(records) if end is None else np.searchsorted(records['time'], end, 'right')
+        return records[i:j]
+
+def summarise(records, fields, bucket, raw):
+    '''Reduces time ordered records to one per bucket seconds, or to one altogether if bucket
+    is None. raw records are single samples; otherwise they are already summaries, whose
+    buckets must divide bucket exactly.'''
+    out = np.zeros(0, np.dtype(stats_fields(fields)))
+    if len(records) == 0:
+        return out
+    t = records['time']
+    keys = np.floor(t/bucket) if bucket is not None else np.zeros(len(t))
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    out = np.zeros(len(starts), out.dtype)
+    for field in fields:
+        name = field[0]
+        if raw:
+            mean = records[name]
+            n = (~np.isnan(mean)).astype(np.int64)
+            low, high, std = mean, mean, np.zeros(mean.shape)
+        else:
+            mean, n = records[name], records[name + '_n'].astype(np.int64)
+            low, high, std = records[name + '_min'], records[name + '_max'], records[name + '_std']
+        valid = n > 0
+        mean0 = np.where(valid, mean, 0)
+        std0 = np.where(valid, std, 0)
+        N = np.add.reduceat(n, starts, axis=0)
+        S = np.add.reduceat(n*mean0, starts, axis=0)
+        Q = np.add.reduceat(n*(std0**2 + mean0**2), starts, axis=0) #pooled sum of squares
+        with np.errstate(divide='ignore', invalid='ignore'):
+            M = S/N
+            out[name + '_std'] = np.sqrt(np.clip(Q/N - M**2, 0, None))
+        out[name] = M
+        out[name + '_n'] = N
+        out[name + '_min'] = np.fmin.reduceat(np.where(valid, low, np.nan), starts, axis=0) #fmin and fmax skip nan
+        out[name + '_max'] = np.fmax.reduceat(np.where(valid, high, np.nan), starts, axis=0)
+    return out
+
+class TieredHistory():
+    '''History with bounded memory. Samples are kept at full resolution for the last recent
+    seconds, then reduced to per bucket mean, min, max and standard deviation at 1 s and then
+    1 min buckets. Each tier has a share of a fixed memory budget, and the oldest 1 min
+    buckets are forgotten once it is used up. Columns read across all tiers, oldest first,
+    with decimated tiers giving their bucket means.'''
+    def __init__(self, fields=FIELDS, recent=600., tiers=((1., 86400.), (60., None)), memory=100e6):
+        self.fields = fields
+        self.recent = recent #seconds kept at full resolution
+        self.buckets = [bucket for bucket, _ in tiers]
+        self.windows = [window for _, window in tiers] #seconds kept in each tier before moving on, None for the last
+        raw_size = np.dtype(fields).itemsize
+        stats_size = np.dtype(stats_fields(fields)).itemsize
+        self.store = HistoryStore(fields, max_records=int(memory/2/raw_size)) #half the budget at full resolution
+        self.tiers = [HistoryStore(stats_fields(fields), max_records=int(memory/2/len(tiers)/stats_size)) for _ in tiers]
+        self.next_roll = None
+        self.cache = None #coarse tiers concatenated, per field
+        self.seconds = HistoryStore(stats_fields(fields), max_records=self.store.max_records) #finished first tier buckets of the full resolution samples, for stats()
+        self.summarised = -np.inf #full resolution samples before this time are in self.seconds
+
+    def append(self, **values):
+        t = values.get('time')
+        self.summarise_until(np.floor(t/self.buckets[0])*self.buckets[0]) #a new bucket finishes the last
+        if self.next_roll is None or t >= self.next_roll or len(self.store) == self.store.max_records:
+            self.roll(t)
+        self.store.append(**values)
+
+    def extend(self, records):
+        '''Adds a block of full resolution records, e.g. read back from a measurement log.'''
+        step = max(self.store.max_records//10, 1) #small enough pieces that rolling keeps room for each
+        for i in range(0, len(records), step):
+            piece = records[i:i+step]
+            self.summarise_until(np.floor(piece['time'][0]/self.buckets[0])*self.buckets[0])
+            self.roll(piece['time'][0])
+            self.store.extend(piece)
+        if len(records) > 0:
+            self.next_roll = None
+            self.summarise_until(np.floor(records['time'][-1]/self.buckets[0])*self.buckets[0])
+
+    def summarise_until(self, t):
+        '''Adds the full resolution samples from self.summarised up to t, in whole buckets of the
+        first tier, to self.seconds.'''
+        if t <= self.summarised:
+            return
+        times = self.store['time']
+        i, j = np.searchsorted(times, self.summarised, 'left'), np.searchsorted(times, t, 'left')
+        if j > i:
+            self.seconds.extend(summarise(self.store.records()[i:j], self.fields, self.buckets[0], True))
+        self.summarised = t
+
+    def set_last(self, **values):
+        self.store.set_last(**values)
+
+    def last(self):
+        return self.store.last()
+
+    def roll(self, now):
+        '''Moves samples that have aged out of a tier, or that would overflow it, into the next.'''
+        self.next_roll = now + self.buckets[0]
+        records, raw, source = self.store.records(), True, self.store
+        limit = self.recent
+        for i, tier in enumerate(self.tiers):
+            bucket = self.buckets[i]
+            cutoff = np.floor((now - limit)/bucket)*bucket #whole buckets only, so none is split
+            if len(source) > 0.9*source.max_records: #running out of room before the time is up
+                cutoff = max(cutoff, np.floor(source['time'][len(source)//5]/bucket)*bucket)
+            k = int(np.searchsorted(source['time'], cutoff))
+            if k > 0:
+                tier.extend(summarise(records[:k], self.fields, bucket, raw))
+                source.drop(k)
+                self.cache = None
+                if i == 0:
+                    self.seconds.drop(int(np.searchsorted(self.seconds['time'], cutoff)))
+            if self.windows[i] is None:
+                break
+            records, raw, source, limit = tier.records(), False, tier, self.windows[i]
+
+    def __len__(self):
+        return len(self.store) + sum(len(tier) for tier in self.tiers)
+
+    def __getitem__(self, name):
+        '''One column across all tiers, oldest first. This is a view only when nothing has been
+        decimated yet; otherwise the whole column is copied, so anything called often, like
+        the plots, should go through parts() or window() instead.'''
+        if all(len(tier) == 0 for tier in self.tiers):
+            return self.store[name]
+        if self.cache is None:
+            self.cache = {}
+        if name not in self.cache:
+            self.cache[name] = np.concatenate([tier[name] for tier in reversed(self.tiers)])
+        return np.concatenate([self.cache[name], self.store[name]])
+
+    def snapshot(self):
+        '''Copies of the records of each tier, oldest first, which stay valid while the history
+        carries on. Decimated tiers give their bucket means under the field names.'''
+        return [tier.records().copy() for tier in reversed(self.tiers) if len(tier) > 0] + [self.store.records().copy()]
+
+    def time_range(self):
+        '''Times of the first and latest records, or None if there are none.'''
+        parts = [tier for tier in reversed(self.tiers) if len(tier) > 0] + ([self.store] if len(self.store) > 0 else [])
+        if not parts:
+            return None
+        return parts[0]['time'][0], parts[-1]['time'][-1]
+
+    def window(self, start=None, end=None):
+        '''The records with start <= time <= end, with the fields of a full resolution record.
+        When the window lies within the full resolution tier, as for the last few minutes,
+        this is a view found by bisection and nothing is copied; decimated tiers give their
+        bucket means.'''
+        parts = self.parts(start, end)
+        if len(parts) == 1 and parts[0].dtype == self.store.dtype:
+            return parts[0]
+        out = np.empty(sum(len(part) for part in parts), self.store.dtype)
+        for name in out.dtype.names:
+            out[name] = np.concatenate([part[name] for part in parts]) if parts else []
+        return out
+
+    def parts(self, start=None, end=None):
+        '''Views of the records with start <= time <= end in each tier that has any, oldest
+        first. Decimated tiers give their bucket means under the field names, so every part
+        can be plotted the same way without copying anything.'''
+        parts = [tier.window(start, end) for tier in reversed(self.tiers)] + [self.store.window(start, end)]
+        return [part for part in parts if len(part) > 0]
+
+    def stats(self, start=None, end=None):
+        '''Mean, min, max, standard deviation and sample count of each field over a window, as one
+        record with the fields of a decimated tier. Decimated tiers contribute their buckets,
+        and the full resolution samples their finished first tier buckets, so only the samples
+        in the buckets at either end of the window are gone through.'''
+        parts = [tier.window(start, end) for tier in reversed(self.tiers)]
+        raw = self.store.window(start, end)
+        if len(raw) > 0:
+            bucket = self.buckets[0]
+            first, last = np.floor(raw['time'][0]/bucket)*bucket, np.floor(raw['time'][-1]/bucket)*bucket
+            i = np.searchsorted(raw['time'], first + bucket, 'left') #samples in the first bucket
+            j = max(np.searchsorted(raw['time'], last, 'left'), i) #and in the last, which may not be finished
+            seconds = self.seconds.records() #every bucket in between is finished, so it is in here
+            a, b = np.searchsorted(seconds['time'], first + bucket, 'left'), np.searchsorted(seconds['time'], last, 'left')
+            parts += [summarise(raw[:i], self.fields, None, True), seconds[a:b], summarise(raw[j:], self.fields, None, True)]
+        return summarise(np.concatenate(parts), self.fields, None, False)[0]
+
+    def summary(self, start=None, end=None):
+        '''stats() as count, mean, standard deviation, min and max arrays in the order of
+        components(fields), as RunningStats.summary() gives them.'''
+        record = self.stats(start, end)
+        out = []
+        for suffix in ('_n', '', '_std', '_min', '_max'):
+            out.append(np.array([record[name + suffix] if index is None else record[name + suffix][index] for name, index in components(self.fields)], float))
+        return tuple(out)
+
+    def recent_records(self):
+        '''The full resolution records, as a view.'''
+        return self.store.records()
+
+    def tier(self, i):
+        '''The records of decimated tier i (0 for 1 s buckets), as a view.'''
+        return self.tiers[i].records()
+
+def components(fields):
+    '''(field, index) of each number in a record after the time, in memory order. index is
+    None for scalar fields.'''
+    out = []
+    for field in fields[1:]:
+        if len(field) > 2:
+            out.extend((field[0], i) for i in range(int(np.prod(field[2]))))
+        else:
+            out.append((field[0], None))
+    return out
+
+class RunningStats():
+    '''Running count, mean, variance, min and max of every metric, kept with Welford (Chan for
+    blocks) updates at O(1) per record however long the session, so summaries never scan
+    the history. Given a window, the same statistics are also kept over the last window
+    records: a ring of the records lets each one be added and removed again, and the ring
+    is summed afresh once per window to keep rounding from building up. The window min and
+    max are taken from the ring when asked for. Fields must all be f8, the first the time.'''
+    def __init__(self, fields=FIELDS, window=None):
+        self.components = components(fields)
+        self.k = len(self.components)
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        k = self.k
+        self.n, self.mean, self.m2 = np.zeros(k), np.zeros(k), np.zeros(k)
+        self.low, self.high = np.full(k, np.inf), np.full(k, -np.inf)
+        if self.window is not None:
+            self.ring = np.full((self.window, k), np.nan)
+            self.head, self.since_sum = 0, 0
+            self.wn, self.wmean, self.wm2 = np.zeros(k), np.zeros(k), np.zeros(k)
+
+    def values(self, records):
+        '''The metrics of a block of records as rows of numbers.'''
+        records = np.ascontiguousarray(records)
+        return records.view(np.float64).reshape(len(records), self.k + 1)[:, 1:]
+
+    def add(self, records):
+        '''Adds a block of records, e.g. history.recent_records()[-1:] after each frame.'''
+        v = self.values(records)
+        if len(v) == 0:
+            return
+        if len(v) == 1: #one frame's record, the usual case
+            self.add_one(v[0])
+            return
+        valid = ~np.isnan(v)
+        nb = valid.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mb = np.where(valid, v, 0).sum(axis=0)/np.maximum(nb, 1)
+            m2b = (np.where(valid, v - mb, 0)**2).sum(axis=0)
+            n = self.n + nb
+            delta = mb - self.mean
+            self.mean += delta*nb/np.maximum(n, 1)
+            self.m2 += m2b + delta**2*self.n*nb/np.maximum(n, 1)
+        self.n = n
+        np.fmin(self.low, np.fmin.reduce(v, axis=0), out=self.low)
+        np.fmax(self.high, np.fmax.reduce(v, axis=0), out=self.high)
+        if self.window is not None:
+            for row in v[-self.window:]:
+                self.ring[self.head] = row
+                self.head = (self.head + 1) % self.window
+            self.resum()
+
+    def add_one(self, x):
+        '''Welford's update for a single record.'''
+        valid = ~np.isnan(x)
+        self.n += valid
+        delta = np.where(valid, x - self.mean, 0)
+        self.mean += delta/np.maximum(self.n, 1)
+        self.m2 += delta*np.where(valid, x - self.mean, 0)
+        np.fmin(self.low, x, out=self.low)
+        np.fmax(self.high, x, out=self.high)
+        if self.window is not None:
+            self.slide(x)
+
+    def slide(self, x):
+        '''Puts x into the window in place of the oldest record.'''
+        old = self.ring[self.head].copy()
+        self.ring[self.head] = x
+        self.head = (self.head + 1) % self.window
+        self.since_sum += 1
+        if self.since_sum >= self.window:
+            self.resum()
+            return
+        with np.errstate(invalid='ignore', divide='ignore'):
+            gone = ~np.isnan(old)
+            n = self.wn - gone
+            mean = np.where(gone, np.where(n > 0, (self.wmean*self.wn - np.where(gone, old, 0))/np.maximum(n, 1), 0), self.wmean)
+            self.wm2 -= np.where(gone, (old - self.wmean)*(old - mean), 0)
+            self.wn, self.wmean = n, mean
+            new = ~np.isnan(x)
+            n = self.wn + new
+            delta = np.where(new, x - self.wmean, 0)
+            self.wmean += delta/np.maximum(n, 1)
+            self.wm2 += np.where(new, delta*(x - self.wmean), 0)
+            self.wn = n
+        np.clip(self.wm2, 0, None, out=self.wm2)
+
+    def resum(self):
+        valid = ~np.isnan(self.ring)
+        self.wn = valid.sum(axis=0).astype(float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.wmean = np.where(valid, self.ring, 0).sum(axis=0)/np.maximum(self.wn, 1)
+            self.wm2 = (np.where(valid, self.ring - self.wmean, 0)**2).sum(axis=0)
+        self.since_sum = 0
+
+    def summary(self, windowed=False):
+        '''Count, mean, standard deviation, min and max of each metric, each an array in the order
+        of self.components. nan where there are no samples.'''
+        if windowed and self.window is not None:
+            n, mean, m2 = self.wn, self.wmean, self.wm2
+            low, high = np.fmin.reduce(self.ring, axis=0), np.fmax.reduce(self.ring, axis=0)
+        else:
+            n, mean, m2 = self.n, self.mean, self.m2
+            low, high = self.low.copy(), self.high.copy()
+        empty = n == 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            std = np.sqrt(m2/n)
+        mean = np.where(empty, np.nan, mean)
+        low[empty], high[empty] = np.nan, np.nan
+        return n, mean, std, low, high
+
+    def get(self, name, index=None, windowed=False):
+        '''(count, mean, std, min, max) of one metric.'''
+        i = self.components.index((name, index))
+        return tuple(a[i] for a in self.summary(windowed))
+
+ALLAN_METRICS = [('centroid_x', None), ('centroid_y', None), ('peak_x', None), ('peak_y', None), ('width', 0), ('width', 1)]
+
+class AllanDeviation():
+    '''Overlapping Allan deviation of the metrics at octave spaced averaging times of m = 2^k
+    records, kept up to date as records arrive rather than worked out again from the history.
+    Each octave has an accumulator of squared second differences of the running sum of the
+    metric, x[i] - 2x[i-m] + x[i-2m], so a record costs one update per octave, O(log n).
+    Octaves up to 2^exact records use every record (fully overlapping), from a ring of the
+    last 2^(exact+1) running sums. Each longer octave keeps its own ring of running sums taken
+    every m/2^exact records, stepping by that much, so memory also grows only as log n.
+    Differences spanning a nan, e.g. a frame with no beam, are left out. The records are
+    taken as evenly spaced, at their mean interval.'''
+    def __init__(self, metrics=ALLAN_METRICS, fields=FIELDS, exact=8):
+        self.metrics = metrics
+        everything = components(fields)
+        self.columns = [everything.index(metric) for metric in metrics]
+        self.k = len(everything)
+        self.exact = exact
+        self.lag = 2**exact #lag in ring entries of the longer octaves
+        self.size = 2*self.lag + 1
+        self.reset()
+
+    def reset(self):
+        k = len(self.metrics)
+        self.n = 0
+        self.first_time, self.last_time = np.nan, np.nan
+        self.x, self.gaps = np.zeros(k), np.zeros(k) #running sums of the metrics and of their nans
+        self.lags = 2**np.arange(self.exact + 1)
+        self.rings = [] #(sums, gaps) of the level 0 ring, then of each longer octave
+        self.sums, self.counts = np.zeros((self.exact + 1, k)), np.zeros((self.exact + 1, k))
+        self.add_level()
+
+    def add_level(self):
+        k = len(self.metrics)
+        self.rings.append((np.zeros((self.size, k)), np.zeros((self.size, k))))
+        if len(self.rings) > 1:
+            self.sums = np.vstack([self.sums, np.zeros(k)])
+            self.counts = np.vstack([self.counts, np.zeros(k)])
+
+    def add(self, records):
+        '''Adds a block of records, e.g. history.recent_records()[-1:] after each frame.'''
+        records = np.ascontiguousarray(records)
+        if len(records) == 0:
+            return
+        if self.n == 0:
+            self.first_time = records['time'][0]
+        self.last_time = records['time'][-1]
+        v = records.view(np.float64).reshape(len(records), self.k + 1)[:, 1:][:, self.columns]
+        if len(v) == 1:
+            self.add_one(v[0])
+        else:
+            self.add_block(v)
+
+    def add_one(self, y):
+        bad = np.isnan(y)
+        self.x += np.where(bad, 0, y)
+        self.gaps += bad
+        self.n += 1
+        i = self.n
+        x, gaps = self.rings[0]
+        x[i % self.size], gaps[i % self.size] = self.x, self.gaps
+        m = self.lags[2*self.lags <= i] #octaves with enough records so far
+        if len(m) > 0:
+            a, b = (i - m) % self.size, (i - 2*m) % self.size
+            d = self.x - 2*x[a] + x[b]
+            ok = gaps[b] == self.gaps
+            self.sums[:len(m)] += np.where(ok, d*d, 0)
+            self.counts[:len(m)] += ok
+        level = 1
+        while i % (2**level) == 0: #longer octaves, each updated every 2^level records
+            if level == len(self.rings):
+                self.add_level()
+            x, gaps = self.rings[level]
+            j = i >> level
+            x[j % self.size], gaps[j % self.size] = self.x, self.gaps
+            if j >= 2*self.lag:
+                a, b = (j - self.lag) % self.size, (j - 2*self.lag) % self.size
+                d = self.x - 2*x[a] + x[b]
+                ok = gaps[b] == self.gaps
+                octave = self.exact + level
+                self.sums[octave] += np.where(ok, d*d, 0)
+                self.counts[octave] += ok
+            level += 1
+
+    def add_block(self, y):
+        '''The same as add_one for each row of y, but a level at a time, e.g. to catch up with a
+        long log.'''
+        bad = np.isnan(y)
+        xs = self.x + np.cumsum(np.where(bad, 0, y), axis=0) #running sums after each row
+        gs = self.gaps + np.cumsum(bad, axis=0)
+        first, last = self.n + 1, self.n + len(y)
+        level = 0
+        while True:
+            prev = (first - 1) >> level #last entry of the level before this block
+            new = np.arange(prev + 1, (last >> level) + 1) #entries taken in this block
+            if len(new) == 0: #none at this level, so none at longer ones either
+                break
+            if level == len(self.rings):
+                self.add_level()
+            ring_x, ring_gaps = self.rings[level]
+            old = np.arange(prev - self.size + 1, prev + 1) % self.size
+            x = np.concatenate([ring_x[old], xs[(new << level) - first]])
+            gaps = np.concatenate([ring_gaps[old], gs[(new << level) - first]])
+            base = prev - self.size + 1 #entry of x[0]
+            if level == 0:
+                octaves = zip(self.lags, range(self.exact + 1))
+            else:
+                octaves = [(self.lag, self.exact + level)]
+            for lag, octave in octaves:
+                e = new[new >= 2*lag] - base
+                d = x[e] - 2*x[e - lag] + x[e - 2*lag]
+                ok = gaps[e - 2*lag] == gaps[e]
+                self.sums[octave] += np.where(ok, d*d, 0).sum(axis=0)
+                self.counts[octave] += ok.sum(axis=0)
+            keep = new[-self.size:]
+            ring_x[keep % self.size], ring_gaps[keep % self.size] = x[keep - base], gaps[keep - base]
+            level += 1
+        self.x, self.gaps, self.n = xs[-1], gs[-1], last
+
+    def deviation(self):
+        '''Averaging times in seconds and the Allan deviation of each metric there (one column
+        each, nan where there is nothing to go on), for the octaves reached so far.'''
+        if self.n < 2:
+            return np.zeros(0), np.zeros((0, len(self.metrics)))
+        reached = int(np.flatnonzero(self.counts.any(axis=1))[-1]) + 1 if self.counts.any() else 0
+        m = 2.**np.arange(reached)[:, None]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            adev = np.sqrt(self.sums[:reached]/(2*m**2*self.counts[:reached]))
+        return m[:, 0]*(self.last_time - self.first_time)/(self.n - 1), adev
+
+    def get(self, name, index=None):
+        '''Averaging times and Allan deviation of one metric.'''
+        tau, adev = self.deviation()
+        return tau, adev[:, self.metrics.index((name, index))]
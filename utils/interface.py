@@ -14,9 +14,10 @@ except ImportError:
     from tkinter import simpledialog as tkSimpleDialog
     
 import numpy as np
-import time
 import threading
 
+from . import calibration
+
 try:
     import ConfigParser
 except ImportError:
@@ -264,35 +265,136 @@ class ToolbarConfig(tkSimpleDialog.Dialog):
     def close(self):
         self.destroy()
         
+class ExportDialog(tkSimpleDialog.Dialog):
+    def __init__(self, master, columns, selected):
+        self.master = master
+        self.columns = columns
+        self.selected = selected
+        self.choices = []
+        tkSimpleDialog.Dialog.__init__(self, master)
+
+    def body(self, master):
+        tk.Label(master, text='Select columns to export').pack()
+        for column in self.columns:
+            choice = tk.IntVar(value=int(column in self.selected))
+            tk.Checkbutton(master, text=column, variable=choice).pack(side=tk.TOP, anchor=tk.W, padx=2)
+            self.choices.append(choice)
+        self.in_um = tk.IntVar(value=1)
+        tk.Checkbutton(master, text="Lengths in µm (else pixels)", variable=self.in_um).pack(side=tk.TOP, anchor=tk.W, padx=2, pady=5)
+        tk.Label(master, text="Only the last minutes (blank for all):").pack(side=tk.TOP, anchor=tk.W, padx=2)
+        self.e1 = tk.Entry(master)
+        self.e1.pack(side=tk.TOP, anchor=tk.W, padx=2)
+
+    def validate(self):
+        columns = [c for c, choice in zip(self.columns, self.choices) if choice.get() == 1]
+        if not columns:
+            tkMessageBox.showwarning("Nothing to export", "Select at least one column")
+            return 0
+        try:
+            minutes = float(self.e1.get()) if self.e1.get().strip() != '' else None
+        except ValueError:
+            tkMessageBox.showwarning("Bad input", "Illegal value for the number of minutes")
+            return 0
+        self.result = columns, self.in_um.get() == 1, minutes
+        return 1
+
+class ReplayControls():
+    '''Playback controls for a replayed frame recording or measurement log.'''
+    def __init__(self, master):
+        self.master = master
+        self.window = tk.Toplevel(master)
+        self.window.wm_title('Replay')
+        self.window.protocol("WM_DELETE_WINDOW", self.master.stop_replay)
+        bar = tk.Frame(self.window)
+        bar.pack(side=tk.TOP)
+        tk.Button(bar, text='|<', command=lambda: self.master.replay_step(-1)).pack(side=tk.LEFT)
+        self.play_text = tk.StringVar(value='Pause')
+        tk.Button(bar, textvariable=self.play_text, width=6, command=self.master.replay_play).pack(side=tk.LEFT)
+        tk.Button(bar, text='>|', command=lambda: self.master.replay_step(1)).pack(side=tk.LEFT)
+        tk.Label(bar, text='speed').pack(side=tk.LEFT, padx=5)
+        self.speed = tk.StringVar(value='1')
+        tk.OptionMenu(bar, self.speed, '0.1', '0.25', '0.5', '1', '2', '4', '8', command=self.master.replay_speed).pack(side=tk.LEFT)
+        self.position = tk.DoubleVar()
+        self.dragging = False
+        self.scale = tk.Scale(self.window, variable=self.position, from_=0, to=100, resolution=0.01,
+                              orient='horizontal', length=400, showvalue=0)
+        self.scale.bind('<ButtonPress-1>', self.press)
+        self.scale.bind('<ButtonRelease-1>', self.release)
+        self.scale.pack(side=tk.TOP, fill=tk.X, padx=5)
+        self.label = tk.StringVar()
+        tk.Label(self.window, textvariable=self.label).pack(side=tk.TOP)
+        tk.Button(self.window, text='Stop replay', command=self.master.stop_replay).pack(side=tk.TOP, pady=5)
+
+    def press(self, event):
+        self.dragging = True
+
+    def release(self, event):
+        self.dragging = False
+        self.master.replay_seek(self.position.get()/100.)
+
+    def update(self, replay):
+        '''Follows the playback position, unless the slider is being dragged.'''
+        self.label.set(replay.position())
+        self.play_text.set('Pause' if replay.playing else 'Play')
+        if not self.dragging:
+            self.position.set(100*replay.fraction())
+
+    def close(self):
+        self.window.destroy()
+
 class Progress(tk.Frame):
     def __init__(self, parent):
         self.parent = parent
         self.v = tk.DoubleVar()  
         self.progressbar = ttk.Progressbar(self.parent.statusbar, variable=self.v, orient=tk.HORIZONTAL, length=100, maximum=100, mode='determinate')
         self.progressbar.pack(side=tk.RIGHT, padx=5)
+        self.worker = None
         
     def next_step(self):
-        if self.parent.bg_subtract == 1:
-            self.v.set(0)
-            # Create a numpy self.array of floats to store the average (assume RGB images)
-            self.arr = np.zeros(self.parent.frame.shape, np.float)
-        if self.parent.bg_subtract >= 1:   
-            imarr = np.array(self.parent.frame,dtype=np.float)
-            self.arr = self.arr+imarr/100
-            self.progressbar.step(1)
-            time.sleep(0.01)
-            self.parent.bg_subtract += 1
-        if self.parent.bg_subtract == 100:
-            # Round values in self.array and cast as 16-bit integer
-            self.parent.bg_frame = np.array(np.round(self.arr),dtype=np.uint8)
-
-            self.parent.log('Background calibration complete')
+        '''Hands the current frame to the background calibration worker.'''
+        if self.worker is not None:
+            self.worker.add(self.parent.frame)
+            
+    def poll(self):
+        '''Updates the progress bar from the Tk thread until the worker has finished.'''
+        if self.worker is None:
+            return
+        self.v.set(self.worker.progress())
+        if self.worker.done:
+            self.parent.bg_frame = np.array(np.round(self.worker.mean),dtype=np.uint8)
+            self.parent.bg_noise = self.worker.std
+            self.parent.bg_noise_level = float(np.mean(self.worker.std))
+            self.parent.bg_cache = {}
+            if self.parent.bg_model.enabled:
+                self.parent.bg_model.reset(self.parent.bg_frame, self.parent.bg_noise)
+            self.parent.log('Background calibration complete. Mean noise ' + '{0:.2f}'.format(self.parent.bg_noise_level) + ' counts')
             self.v.set(0)
             self.parent.bg_subtract = 0
+            self.worker = None
+        else:
+            self.parent.after(100, self.poll)
         
     def calibrate_bg(self):
+        if self.worker is not None:
+            self.worker.cancel()
+        self.worker = calibration.StackWorker(self.parent.calibration_frames) #accumulates off the Tk thread
+        self.worker.start()
         self.parent.bg_subtract = 1
+        for cam in self.parent.cameras:
+            cam.calibrate_bg(self.parent.calibration_frames)
+        self.v.set(0)
+        self.poll()
         
     def reset_bg(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker = None
+            self.parent.bg_subtract = 0
+            self.v.set(0)
         self.parent.bg_frame = 0
-        self.parent.log('Reset background calibration')
\ No newline at end of file
+        self.parent.bg_noise = None
+        self.parent.bg_cache = {}
+        self.parent.bg_model.reset()
+        for cam in self.parent.cameras:
+            cam.reset_bg()
+        self.parent.log('Reset background calibration')
@@ -1,7 +1,6 @@
 import math
 import numpy as np
 import cv2
-import pyaudio
 import threading
 import time
 
@@ -11,6 +10,12 @@ class SoundFeedback():
         self.CHUNK = 4096
         self.RATE = 44100
         self.indicator = None
+        self.paused = False
+        self.streamer = None #audio is opened when an indicator is first started
+        
+    def open(self):
+        import pyaudio
+        self.paContinue = pyaudio.paContinue
         self.streamer = pyaudio.PyAudio().open(format = pyaudio.paFloat32,
                 channels = 2,
                 rate = self.RATE,
@@ -47,7 +52,7 @@ class SoundFeedback():
                         c = self.master.centroid[1]
                         max = self.master.height
             elif self.indicator == 'max pixel':
-                c = np.max(self.master.analysis_frame)
+                c = self.master.peak_value
                 max = 255         
             elif self.indicator == 'orientation':
                 if self.master.ellipse_angle is None:
@@ -58,11 +63,36 @@ class SoundFeedback():
                     
         chunk = self.sine(time.time(), (float(c)/float(max))*4400)
         data = chunk.astype(np.float32).tostring()
-        return (data, pyaudio.paContinue)
+        return (data, self.paContinue)
         
     def start(self, option):
         self.indicator = option
+        self.paused = False
+        if self.streamer is None:
+            self.open()
         self.streamer.start_stream()
+        
+    def stop(self):
+        self.indicator = None
+        self.paused = False
+        if self.streamer is not None:
+            self.streamer.stop_stream()
+        
+    def close(self):
+        if self.streamer is not None:
+            self.streamer.stop_stream()
+            self.streamer.close()
+        
+    def pause(self):
+        '''Stops the callback while the profiler idles, remembering to restart it.'''
+        if self.streamer is not None and self.streamer.is_active():
+            self.streamer.stop_stream()
+            self.paused = True
+            
+    def resume(self):
+        if self.paused and self.indicator is not None and self.streamer is not None:
+            self.streamer.start_stream()
+        self.paused = False
     
 def rotate_image(image, angle):
     """
@@ -132,6 +162,96 @@ def rotate_image(image, angle):
 
     return result
 
+class GeometricTransform():
+    '''Precomputes a single cv2.remap map for the whole geometric chain applied to each
+    camera frame: rotation, largest rectangle crop, zoom and optional lens undistortion.
+    The maps are only rebuilt when the angle, zoom or resolution changes.'''
+    def __init__(self, display_size=(640, 360)):
+        self.display_size = display_size
+        self.camera_matrix, self.dist_coeffs, self.calib_size = None, None, None
+        self.key = None
+        self.identity = True
+        self.analysis_maps, self.display_maps = None, None
+        self.analysis_size = display_size
+        self.display_scale = (1., 1.)
+
+    def load_calibration(self, filename):
+        '''Loads camera_matrix and dist_coeffs (and optionally the resolution they were
+        measured at) from a .npz file, as produced by cv2.calibrateCamera.'''
+        data = np.load(filename)
+        self.camera_matrix = np.array(data['camera_matrix'], dtype=np.float64)
+        self.dist_coeffs = np.zeros(5)
+        coeffs = np.array(data['dist_coeffs'], dtype=np.float64).ravel()[:5]
+        self.dist_coeffs[:len(coeffs)] = coeffs
+        self.calib_size = tuple(data['resolution']) if 'resolution' in data.files else None
+        self.key = None #force a rebuild
+
+    def update(self, width, height, angle, roi):
+        '''Rebuilds the maps if the geometry has changed. Returns True if it did.'''
+        key = (width, height, angle, roi, self.camera_matrix is not None)
+        if key == self.key:
+            return False
+        self.key = key
+        self.identity = angle == 0 and roi == 1 and self.camera_matrix is None
+
+        # size of the largest upright rectangle inside the rotated frame, then zoomed in on
+        theta = math.radians(angle)
+        crop_w, crop_h = largest_rotated_rect(width, height, theta)
+        crop_w = min(crop_w, width*abs(math.cos(theta)) + height*abs(math.sin(theta)))
+        crop_h = min(crop_h, width*abs(math.sin(theta)) + height*abs(math.cos(theta)))
+        region = (crop_w/float(roi), crop_h/float(roi))
+
+        self.analysis_size = (max(int(region[0]), 1), max(int(region[1]), 1))
+        self.display_scale = (self.display_size[0]/float(self.analysis_size[0]), self.display_size[1]/float(self.analysis_size[1]))
+        if not self.identity:
+            self.analysis_maps = self.build_maps(width, height, theta, region, self.analysis_size)
+            self.display_maps = self.build_maps(width, height, theta, region, self.display_size)
+        return True
+
+    def build_maps(self, width, height, theta, region, size):
+        '''Maps each output pixel back to its source position in the camera frame.'''
+        u = ((np.arange(size[0]) + 0.5)*region[0]/size[0] - region[0]/2.).astype(np.float32)
+        v = ((np.arange(size[1]) + 0.5)*region[1]/size[1] - region[1]/2.).astype(np.float32)
+        dx, dy = np.meshgrid(u, v)
+
+        # inverse of cv2.getRotationMatrix2D about the frame centre
+        cos_t, sin_t = math.cos(theta), math.sin(theta)
+        map_x = width/2. + cos_t*dx - sin_t*dy - 0.5
+        map_y = height/2. + sin_t*dx + cos_t*dy - 0.5
+
+        if self.camera_matrix is not None: #look up where the undistorted point lies on the raw sensor
+            map_x, map_y = self.distort(map_x, map_y, width, height)
+
+        return cv2.convertMaps(map_x.astype(np.float32), map_y.astype(np.float32), cv2.CV_16SC2)
+
+    def distort(self, x, y, width, height):
+        '''Applies the radial and tangential lens distortion model to ideal pixel positions.'''
+        K = self.camera_matrix.copy()
+        if self.calib_size is not None: #calibration taken at another resolution
+            K[0] *= width/float(self.calib_size[0])
+            K[1] *= height/float(self.calib_size[1])
+        fx, fy, cx, cy = K[0, 0], K[1, 1], K[0, 2], K[1, 2]
+        k1, k2, p1, p2, k3 = self.dist_coeffs
+
+        xn, yn = (x - cx)/fx, (y - cy)/fy
+        r2 = xn**2 + yn**2
+        radial = 1 + k1*r2 + k2*r2**2 + k3*r2**3
+        xd = xn*radial + 2*p1*xn*yn + p2*(r2 + 2*xn**2)
+        yd = yn*radial + p1*(r2 + 2*yn**2) + 2*p2*xn*yn
+        return xd*fx + cx, yd*fy + cy
+
+    def analysis(self, frame):
+        '''Returns the frame resampled at native scale for analysis.'''
+        if self.identity:
+            return frame
+        return cv2.remap(frame, self.analysis_maps[0], self.analysis_maps[1], cv2.INTER_LINEAR)
+
+    def display(self, frame):
+        '''Returns the frame resampled to the size of the webcam view.'''
+        if self.identity:
+            return cv2.resize(frame, self.display_size, interpolation=cv2.INTER_AREA)
+        return cv2.remap(frame, self.display_maps[0], self.display_maps[1], cv2.INTER_LINEAR)
+
 def largest_rotated_rect(w, h, angle):
     """
     Given a rectangle of size wxh that has been rotated by 'angle' (in
@@ -201,8 +321,6 @@ def gauss(x, *p):
     A, mu, sigma = p
     return A*np.exp(-(x-mu)**2/(2.*sigma**2))
     
-from matplotlib.colors import LinearSegmentedColormap
-
 parula = [[ 0.26710521,  0.03311059,  0.6188155 ],
        [ 0.26493929,  0.04780926,  0.62261795],
        [ 0.26260545,  0.06084214,  0.62619176],
@@ -460,4 +578,12 @@ parula = [[ 0.26710521,  0.03311059,  0.6188155 ],
        [ 0.98784836,  0.95112482,  0.14074826],
        [ 0.98680727,  0.95697596,  0.12661626]]
 
-parula_cm = LinearSegmentedColormap.from_list(__file__, parula)
\ No newline at end of file
+_parula_cm = None
+
+def parula_cm():
+    '''The parula colourmap, built on first use so matplotlib is not needed at startup.'''
+    global _parula_cm
+    if _parula_cm is None:
+        from matplotlib.colors import LinearSegmentedColormap
+        _parula_cm = LinearSegmentedColormap.from_list(__file__, parula)
+    return _parula_cm
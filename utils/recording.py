@@ -0,0 +1,712 @@
+import os
+import copy
+import json
+import time
+import threading
+import numpy as np
+import cv2
+
+try:
+    import Queue
+except ImportError:
+    import queue as Queue
+
+def replace(src, dst):
+    '''Renames src over dst in one step where the platform allows it.'''
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+    else: #python 2
+        if os.path.exists(dst) and os.name == 'nt':
+            os.remove(dst)
+        os.rename(src, dst)
+
+def write_atomic(filename, write):
+    '''Writes a file through a temporary one that is synced to disk and renamed over it, so a
+    crash leaves either the old or the new file, never half of one.'''
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    replace(tmp, filename)
+
+class MeasurementLog(threading.Thread):
+    '''Writes the measurement records to disk as they are made, in chunks of chunk_size records
+    saved as .npy files, so a crash loses at most the last flush_interval seconds. Records are
+    handed over with add() and written on this thread. Full chunks are never touched again;
+    the chunk being filled is rewritten on each flush. index.json lists the time range of
+    each chunk. At most queue_size records wait to be written; if the disk falls further
+    behind, records are dropped and counted rather than piling up in memory.'''
+    def __init__(self, directory, dtype, chunk_size=4096, flush_interval=2., queue_size=65536):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.directory = directory
+        self.dtype = np.dtype(dtype)
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval #s
+        self.queue = Queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.chunks = [] #index entries of the chunks so far
+        self.buf = np.empty(chunk_size, self.dtype)
+        self.n = 0 #records in the chunk being filled
+        self.dirty = False
+        self.running = True
+        self.error = None
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def add(self, record):
+        '''Queues one record (a numpy record of the log's dtype) for writing. Returns False if
+        it had to be dropped.'''
+        if self.error is not None:
+            return False
+        try:
+            self.queue.put_nowait(record)
+            return True
+        except Queue.Full:
+            self.dropped += 1
+            return False
+
+    def stop(self):
+        '''Writes out what is queued and stops the thread.'''
+        self.running = False
+        try:
+            self.queue.put_nowait(None) #wakes the thread up
+        except Queue.Full: #it will find running unset once it has emptied the queue
+            pass
+
+    def chunk_name(self, i):
+        return 'chunk_%05i.npy' % i
+
+    def flush(self):
+        if not self.dirty:
+            return
+        i = len(self.chunks) - 1
+        data = self.buf[:self.n]
+        write_atomic(os.path.join(self.directory, self.chunk_name(i)), lambda f: np.save(f, data))
+        self.chunks[i].update(start=float(data['time'][0]), end=float(data['time'][-1]), n=int(self.n))
+        index = {'chunk_size': self.chunk_size, 'fields': list(self.dtype.names), 'chunks': self.chunks}
+        write_atomic(os.path.join(self.directory, 'index.json'), lambda f: f.write(json.dumps(index, indent=1).encode('utf-8')))
+        self.dirty = False
+
+    def write(self, record):
+        if self.n == 0:
+            self.chunks.append({'file': self.chunk_name(len(self.chunks))})
+        self.buf[self.n] = record
+        self.n += 1
+        self.dirty = True
+        if self.n == self.chunk_size: #chunk full, so it is written for the last time
+            self.flush()
+            self.n = 0
+
+    def run(self):
+        next_flush = time.time() + self.flush_interval
+        stopping = False
+        while not stopping:
+            try:
+                record = self.queue.get(timeout=max(next_flush - time.time(), 0.01))
+            except Queue.Empty:
+                record = None
+            stopping = not self.running and self.queue.empty()
+            try:
+                if record is not None:
+                    self.write(record) #flushes when the chunk fills
+                if stopping or time.time() >= next_flush:
+                    self.flush()
+                    next_flush = time.time() + self.flush_interval
+            except (IOError, OSError) as e: #keep measuring, the log just stops being written
+                self.error = e
+                break
+
+class LogReader():
+    '''Reads a measurement log written by MeasurementLog. Chunks are memory mapped, so time range
+    queries only touch the chunks that overlap the range. Chunks missing from the index
+    (from a crash between writing a chunk and the index) are picked up from the directory.'''
+    def __init__(self, directory):
+        self.directory = directory
+        self.maps = {}
+        self.chunks = []
+        self.refresh()
+
+    def refresh(self):
+        '''Reloads the index, e.g. to follow a log that is still being written.'''
+        chunks = []
+        filename = os.path.join(self.directory, 'index.json')
+        if os.path.isfile(filename):
+            with open(filename) as f:
+                chunks = json.load(f)['chunks']
+        chunks = [c for c in chunks if 'n' in c]
+        indexed = set(c['file'] for c in chunks)
+        for name in sorted(os.listdir(self.directory)):
+            if name.startswith('chunk_') and name.endswith('.npy') and name not in indexed:
+                data = self.load(name, cached=False)
+                if len(data) > 0:
+                    chunks.append({'file': name, 'start': float(data['time'][0]), 'end': float(data['time'][-1]), 'n': len(data)})
+        self.chunks = sorted(chunks, key=lambda c: c['file'])
+        self.maps = {} #the chunk being filled may have been rewritten
+
+    def load(self, name, cached=True):
+        if name not in self.maps or not cached:
+            data = np.load(os.path.join(self.directory, name), mmap_mode='r')
+            if not cached:
+                return data
+            self.maps[name] = data
+        return self.maps[name]
+
+    def __len__(self):
+        return sum(c['n'] for c in self.chunks)
+
+    def fields(self):
+        '''The fields of the logged records, as in history.FIELDS.'''
+        return self.load(self.chunks[0]['file']).dtype.descr
+
+    def time_range(self):
+        if not self.chunks:
+            return None
+        return self.chunks[0]['start'], self.chunks[-1]['end']
+
+    def query(self, start=None, end=None):
+        '''The records with start <= time <= end, as a new array.'''
+        start = -np.inf if start is None else start
+        end = np.inf if end is None else end
+        parts = []
+        for c in self.chunks:
+            if c['end'] < start or c['start'] > end:
+                continue
+            data = self.load(c['file'])
+            t = data['time']
+            i, j = np.searchsorted(t, start, 'left'), np.searchsorted(t, end, 'right')
+            parts.append(data[i:j])
+        if not parts:
+            return np.zeros(0, self.load(self.chunks[0]['file']).dtype) if self.chunks else np.zeros(0)
+        return np.concatenate(parts)
+
+    def blocks(self, start=None, end=None):
+        '''The records with start <= time <= end one chunk at a time, for going over a run too
+        long to hold in memory, as when a replay catches its statistics up after a seek.'''
+        for c in self.chunks:
+            if (start is not None and c['end'] < start) or (end is not None and c['start'] > end):
+                continue
+            data = self.load(c['file'])
+            t = data['time']
+            i = 0 if start is None else np.searchsorted(t, start, 'left')
+            j = len(t) if end is None else np.searchsorted(t, end, 'right')
+            yield data[i:j]
+
+# (heading, history field, index into the field or None, whether it is a length in pixels)
+EXPORT_COLUMNS = [('running time', 'time', None, False),
+                  ('centroid x', 'centroid_x', None, True), ('centroid y', 'centroid_y', None, True),
+                  ('peak x', 'peak_x', None, True), ('peak y', 'peak_y', None, True),
+                  ('width x', 'width', 0, True), ('width y', 'width', 1, True),
+                  ('width_e2 x', 'width_e2', 0, True), ('width_e2 y', 'width_e2', 1, True),
+                  ('ellipse angle', 'angle', None, False),
+                  ('minor axis', 'ma', None, True), ('major axis', 'MA', None, True),
+                  ('ellipticity', 'ellipticity', None, False), ('eccentricity', 'eccentricity', None, False),
+                  ('pointing x', 'pointing_x', None, False), ('pointing y', 'pointing_y', None, False),
+                  ('divergence', 'divergence', None, False), ('full resolution', 'full_res', None, False)]
+EXPORT_DEFAULT = [c[0] for c in EXPORT_COLUMNS[:14]] #pointing only means something with further cameras
+
+def export_columns(fields):
+    '''EXPORT_COLUMNS followed by columns for any other fields of the records, such as those of
+    further cameras, which are already in um.'''
+    known = set(c[1] for c in EXPORT_COLUMNS)
+    columns = list(EXPORT_COLUMNS)
+    for field in fields:
+        name = field[0]
+        if name in known:
+            continue
+        if len(field) > 2:
+            columns += [(name.replace('_', ' ') + ' ' + 'xy'[i], name, i, False) for i in range(field[2][0])]
+        else:
+            columns.append((name.replace('_', ' '), name, None, False))
+    return columns
+EXPORT_FORMATS = ('.csv', '.npz', '.parquet')
+
+STATS_NAMES = ('count', 'mean', 'std', 'min', 'max')
+
+class Exporter(threading.Thread):
+    '''Writes blocks of history records to a .csv, compressed .npz or .parquet file (chosen by
+    the extension) on its own thread, chunk_size rows at a time. Lengths are multiplied by
+    scale, e.g. the pixel scale to give um. progress() and done are polled from the Tk thread.
+    Given statistics as (components, summary), e.g. history.RunningStats.components and
+    .summary(), the count, mean, std, min and max of each column are written into the header
+    as well, labelled stats_label.'''
+    def __init__(self, blocks, filename, columns=EXPORT_DEFAULT, scale=1., units='pixels', chunk_size=65536, stats=None, fields=None, stats_label='session'):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.blocks = blocks #structured arrays, oldest first
+        self.filename = filename
+        self.columns = [c for c in (EXPORT_COLUMNS if fields is None else export_columns(fields)) if c[0] in columns]
+        self.scale = scale
+        self.units = units
+        self.chunk_size = chunk_size
+        self.total = sum(len(b) for b in blocks)
+        self.rows = 0
+        self.done = False
+        self.error = None
+        self.stats = None
+        self.stats_label = stats_label
+        if stats is not None: #taken by the caller, as the statistics carry on changing on the Tk thread
+            components, summary = stats
+            summary = np.array(summary)
+            self.stats = {}
+            for c in self.columns:
+                if (c[1], c[2]) in components:
+                    values = summary[:, components.index((c[1], c[2]))]
+                    if c[3]:
+                        values[1:] *= self.scale #all but the count
+                    self.stats[c[0]] = values
+
+    def progress(self):
+        return 100.*self.rows/max(self.total, 1)
+
+    def column_stats(self, column):
+        '''count, mean, std, min and max of a column, or None.'''
+        if self.stats is None:
+            return None
+        return self.stats.get(column[0])
+
+    def column(self, block, column):
+        _, name, index, length = column
+        values = block[name] if index is None else block[name][:, index]
+        return values*self.scale if length else np.array(values)
+
+    def chunks(self):
+        for block in self.blocks:
+            for i in range(0, len(block), self.chunk_size):
+                yield block[i:i+self.chunk_size]
+
+    def run(self):
+        try:
+            extension = os.path.splitext(self.filename)[1].lower()
+            if extension == '.npz':
+                self.write_npz()
+            elif extension == '.parquet':
+                self.write_parquet()
+            else:
+                self.write_csv()
+        except Exception as e: #reported to the user by the controller
+            self.error = e
+        self.done = True
+
+    def write_csv(self):
+        with open(self.filename, 'w') as f:
+            f.write('# BiLBO Data Export. Lengths in ' + self.units + ' (further cameras in um), angles in degrees, pointing in mrad.\n')
+            f.write('# ' + ', '.join(c[0] for c in self.columns) + '\n')
+            if self.stats is not None: #one line per statistic, - where a column has none
+                for i, name in enumerate(STATS_NAMES):
+                    values = [self.column_stats(c) for c in self.columns]
+                    f.write('# ' + self.stats_label + ' ' + name + ': ' + ', '.join('-' if v is None else '%.15g' % v[i] for v in values) + '\n')
+            for chunk in self.chunks():
+                np.savetxt(f, np.column_stack([self.column(chunk, c) for c in self.columns]), delimiter=',', fmt='%.15g')
+                self.rows += len(chunk)
+
+    def write_npz(self):
+        '''One array per column, deflated. Each array is streamed into the archive chunk by
+        chunk where zipfile allows it (python 3.6 on).'''
+        import zipfile, sys
+        names = [c[0].replace(' ', '_') for c in self.columns]
+        stats = dict((name + '_stats', self.column_stats(c)) for name, c in zip(names, self.columns) if self.column_stats(c) is not None)
+        if sys.version_info < (3, 6):
+            arrays = dict((name, np.concatenate([self.column(b, c) for b in self.blocks])) for name, c in zip(names, self.columns))
+            arrays.update(stats)
+            self.rows = self.total
+            np.savez_compressed(self.filename, **arrays)
+            return
+        with zipfile.ZipFile(self.filename, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for name, values in stats.items(): #count, mean, std, min, max
+                with archive.open(name + '.npy', 'w') as f:
+                    np.lib.format.write_array(f, values)
+            for name, c in zip(names, self.columns):
+                with archive.open(name + '.npy', 'w', force_zip64=True) as f:
+                    np.lib.format.write_array_header_1_0(f, {'descr': np.lib.format.dtype_to_descr(np.dtype('f8')),
+                                                             'fortran_order': False, 'shape': (self.total,)})
+                    for chunk in self.chunks():
+                        f.write(np.ascontiguousarray(self.column(chunk, c), dtype='f8').tobytes())
+                        self.rows += len(chunk)/float(len(self.columns))
+        self.rows = self.total
+
+    def write_parquet(self):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError('Parquet export needs pyarrow (pip install pyarrow)')
+        schema = pa.schema([(c[0], pa.float64()) for c in self.columns])
+        if self.stats is not None:
+            metadata = dict((c[0], dict(zip(STATS_NAMES, self.column_stats(c).tolist()))) for c in self.columns if self.column_stats(c) is not None)
+            schema = schema.with_metadata({self.stats_label.replace(' ', '_') + '_stats': json.dumps(metadata)})
+        writer = pq.ParquetWriter(self.filename, schema)
+        try:
+            for chunk in self.chunks():
+                writer.write_table(pa.Table.from_arrays([pa.array(self.column(chunk, c)) for c in self.columns], schema=schema))
+                self.rows += len(chunk)
+        finally:
+            writer.close()
+
+class FrameRecorder(threading.Thread):
+    '''Records frames losslessly into .npy chunks of chunk_frames frames, preallocated and
+    memory mapped, alongside a frames_NNNNN.npy sidecar of (frame id, time) for each slot
+    (id -1 for slots never filled). Frames are copied into a queue of queue_size frames by
+    add(); when the writer falls behind, frames are dropped and counted rather than holding
+    up the camera. A change of frame size starts a new chunk.'''
+    SIDECAR = [('frame_id', 'i8'), ('time', 'f8')]
+
+    def __init__(self, directory, chunk_frames=256, queue_size=64, info=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.directory = directory
+        self.chunk_frames = chunk_frames
+        self.queue = Queue.Queue(maxsize=queue_size)
+        self.running = True
+        self.recorded, self.dropped = 0, 0
+        self.error = None
+        self.chunk, self.sidecar = None, None
+        self.n_chunks, self.slot = 0, 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        if info is not None: #settings needed to measure the frames again, e.g. the pixel scale
+            with open(os.path.join(directory, 'info.json'), 'w') as f:
+                json.dump(info, f, indent=1)
+
+    def add(self, frame, t, frame_id):
+        '''Queues a copy of the frame. Returns False if it had to be dropped.'''
+        if not self.running or self.error is not None:
+            return False
+        try:
+            self.queue.put_nowait((frame.copy(), t, frame_id))
+            return True
+        except Queue.Full:
+            self.dropped += 1
+            return False
+
+    def stop(self):
+        '''Writes out the queued frames and stops the thread.'''
+        self.running = False
+        try:
+            self.queue.put_nowait((None, None, None)) #wakes the thread up
+        except Queue.Full: #it stops once it has emptied the queue, or has already stopped on an error
+            pass
+
+    def new_chunk(self, frame):
+        self.close_chunk()
+        name = os.path.join(self.directory, '%s_%05i.npy')
+        self.chunk = np.lib.format.open_memmap(name % ('chunk', self.n_chunks), mode='w+', dtype=frame.dtype, shape=(self.chunk_frames,) + frame.shape)
+        self.sidecar = np.lib.format.open_memmap(name % ('frames', self.n_chunks), mode='w+', dtype=self.SIDECAR, shape=(self.chunk_frames,))
+        self.sidecar['frame_id'] = -1
+        self.n_chunks += 1
+        self.slot = 0
+
+    def close_chunk(self):
+        if self.chunk is not None:
+            self.chunk.flush()
+            self.sidecar.flush()
+        self.chunk, self.sidecar = None, None
+
+    def write(self, frame, t, frame_id):
+        if self.chunk is None or self.slot == self.chunk_frames or self.chunk.shape[1:] != frame.shape or self.chunk.dtype != frame.dtype:
+            self.new_chunk(frame)
+        self.chunk[self.slot] = frame
+        self.sidecar[self.slot] = (frame_id, t) #written after the frame, so a filled in id means a whole frame
+        self.slot += 1
+        self.recorded += 1
+
+    def run(self):
+        try:
+            while True:
+                frame, t, frame_id = self.queue.get()
+                if frame is not None:
+                    self.write(frame, t, frame_id)
+                if not self.running and self.queue.empty():
+                    break
+        except (IOError, OSError, ValueError) as e: #e.g. the disk is full
+            self.error = e
+        finally:
+            self.close_chunk()
+
+class FrameReader():
+    '''Reads a recording made by FrameRecorder. Frames are memory mapped, so seeking to any
+    frame or time is immediate.'''
+    def __init__(self, directory):
+        self.directory = directory
+        self.chunks = []
+        index = [] #(chunk, slot) of each frame
+        ids, times = [], []
+        names = sorted(n for n in os.listdir(directory) if n.startswith('chunk_') and n.endswith('.npy'))
+        for i, name in enumerate(names):
+            sidecar = np.load(os.path.join(directory, name.replace('chunk_', 'frames_')), mmap_mode='r')
+            slots = np.flatnonzero(sidecar['frame_id'] >= 0)
+            self.chunks.append(np.load(os.path.join(directory, name), mmap_mode='r'))
+            index.extend((i, int(s)) for s in slots)
+            ids.append(sidecar['frame_id'][slots])
+            times.append(sidecar['time'][slots])
+        self.index = index
+        self.info = {}
+        if os.path.isfile(os.path.join(directory, 'info.json')):
+            with open(os.path.join(directory, 'info.json')) as f:
+                self.info = json.load(f)
+        self.frame_ids = np.concatenate(ids) if ids else np.zeros(0, np.int64)
+        self.times = np.concatenate(times) if times else np.zeros(0)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        chunk, slot = self.index[i]
+        return self.chunks[chunk][slot]
+
+    def missing(self):
+        '''The number of frames between the first and last that were not recorded.'''
+        if len(self.frame_ids) == 0:
+            return 0
+        return int(self.frame_ids[-1] - self.frame_ids[0] + 1 - len(self.frame_ids))
+
+    def at(self, t):
+        '''Index of the frame nearest in time to t.'''
+        i = int(np.clip(np.searchsorted(self.times, t), 1, max(len(self.times) - 1, 1)))
+        return i - 1 if len(self.times) < 2 or abs(self.times[i-1] - t) <= abs(self.times[i] - t) else i
+
+class EventRing():
+    '''Keeps the last n_frames frames in a preallocated ring so that, when a pass/fail test
+    fails, what the beam looked like beforehand can be saved. trigger() takes the frames in
+    the ring and waits for post_frames more; the event is then written by a background thread
+    as an .npz bundle (frames, frame ids and times, the metric records over the same time)
+    with a .json description of the rule that fired.'''
+    def __init__(self, directory='events', n_frames=50, post_frames=10):
+        self.directory = directory
+        self.n_frames = n_frames
+        self.post_frames = post_frames
+        self.buf = None
+        self.times = np.zeros(n_frames)
+        self.ids = np.zeros(n_frames, np.int64)
+        self.head, self.count = 0, 0
+        self.pending = [] #events waiting for their post trigger frames
+        self.writers = []
+        self.saved = 0
+
+    def add(self, frame, t, frame_id):
+        '''Copies the frame into the ring, and into any events still collecting frames.'''
+        if self.buf is None or self.buf.shape[1:] != frame.shape or self.buf.dtype != frame.dtype:
+            self.buf = np.empty((self.n_frames,) + frame.shape, frame.dtype) #frames of another size start the ring again
+            self.head, self.count = 0, 0
+        self.buf[self.head] = frame
+        self.times[self.head], self.ids[self.head] = t, frame_id
+        self.head = (self.head + 1) % self.n_frames
+        self.count = min(self.count + 1, self.n_frames)
+        for event in self.pending:
+            if event['frames'].shape[1:] == frame.shape:
+                event['post'].append((frame.copy(), t, frame_id))
+            else: #the capture mode changed, so the event ends here
+                event['closed'] = True
+
+    def ordered(self):
+        '''Indices of the frames in the ring, oldest first.'''
+        return (self.head - self.count + np.arange(self.count)) % self.n_frames
+
+    def trigger(self, rule):
+        '''Starts an event for a failed test. rule is a dict describing the test that failed.'''
+        if self.count == 0:
+            return
+        order = self.ordered()
+        self.pending.append({'rule': rule, 'frames': self.buf[order], 'times': self.times[order],
+                             'ids': self.ids[order], 'post': []})
+
+    def ready(self):
+        '''Events that have all their post trigger frames, removed from those pending.'''
+        done = lambda e: len(e['post']) >= self.post_frames or e.get('closed', False)
+        ready = [e for e in self.pending if done(e)]
+        self.pending = [e for e in self.pending if not done(e)]
+        return ready
+
+    def save(self, event, metrics):
+        '''Writes an event on a background thread, along with the metric records from its time.'''
+        if event['post']:
+            frames, times, ids = zip(*event['post'])
+            event['frames'] = np.concatenate([event['frames'], np.array(frames)])
+            event['times'] = np.concatenate([event['times'], times])
+            event['ids'] = np.concatenate([event['ids'], ids])
+        metrics = metrics[(metrics['time'] >= event['times'][0]) & (metrics['time'] <= event['times'][-1])]
+        stamp = event['rule']['time']
+        name = os.path.join(self.directory, 'event_' + time.strftime('%Y%m%d_%H%M%S', time.localtime(stamp)) + '_%03i' % (1000*(stamp % 1)))
+        writer = threading.Thread(target=self.write, args=(name, event, metrics))
+        writer.daemon = True
+        writer.start()
+        self.writers = [w for w in self.writers if w.is_alive()] + [writer]
+        self.saved += 1
+        return name
+
+    def write(self, name, event, metrics):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        trigger = len(event['frames']) - len(event['post']) - 1 #the frame the test failed on
+        np.savez_compressed(name + '.npz', frames=event['frames'], frame_id=event['ids'], time=event['times'],
+                            trigger=trigger, metrics=metrics)
+        description = dict(event['rule'], frames=len(event['frames']), pre_frames=trigger + 1, post_frames=len(event['post']))
+        with open(name + '.json', 'w') as f:
+            json.dump(description, f, indent=1)
+
+def is_recording(directory):
+    '''Whether a directory holds frames from FrameRecorder rather than a MeasurementLog.'''
+    return any(n.startswith('frames_') for n in os.listdir(directory))
+
+class Playback():
+    '''Playback clock over a recorded time span, running at speed times real time.'''
+    def __init__(self, start, end):
+        self.start, self.end = start, end
+        self.time = start
+        self.speed = 1.
+        self.playing = True
+        self.last = time.time()
+
+    def tick(self):
+        '''Advances the clock by the time since the last tick. Stops at the end.'''
+        now = time.time()
+        if self.playing:
+            self.time = min(self.time + (now - self.last)*self.speed, self.end)
+            if self.time >= self.end:
+                self.playing = False
+        self.last = now
+
+    def play(self, playing=True):
+        self.playing = playing
+        self.last = time.time()
+        if playing and self.time >= self.end:
+            self.seek(self.start)
+
+    def seek(self, t):
+        self.time = min(max(t, self.start), self.end)
+
+    def fraction(self):
+        return (self.time - self.start)/max(self.end - self.start, 1e-9)
+
+class ReplayCapture(Playback):
+    '''Stands in for cv2.VideoCapture, giving the frames of a FrameReader recording at their
+    recorded pace. Seeking goes straight to a frame through the reader's index.'''
+    def __init__(self, reader):
+        Playback.__init__(self, reader.times[0], reader.times[-1])
+        self.reader = reader
+        self.index = 0
+        self.frame_time = self.start
+        self.out = None
+
+    def frame_index(self):
+        return int(np.clip(np.searchsorted(self.reader.times, self.time, 'right') - 1, 0, len(self.reader) - 1))
+
+    def read(self):
+        self.tick()
+        self.index = self.frame_index()
+        self.frame_time = self.reader.times[self.index]
+        frame = self.reader[self.index]
+        if frame.ndim == 2: #recordings are greyscale, the pipeline takes colour frames
+            if self.out is None or self.out.shape[:2] != frame.shape:
+                self.out = np.empty(frame.shape + (3,), np.uint8)
+            cv2.cvtColor(np.asarray(frame), cv2.COLOR_GRAY2BGR, self.out)
+            return True, self.out.copy()
+        return True, np.array(frame)
+
+    def step(self, n):
+        '''Pauses and moves n frames on (or back).'''
+        self.play(False)
+        self.seek_frame(self.frame_index() + n)
+
+    def seek_frame(self, i):
+        i = int(np.clip(i, 0, len(self.reader) - 1))
+        self.seek(self.reader.times[i])
+
+    def get(self, prop):
+        frame = self.reader[self.index]
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return frame.shape[1]
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return frame.shape[0]
+        if prop == cv2.CAP_PROP_FPS:
+            return (len(self.reader) - 1)/max(self.end - self.start, 1e-9)
+        return 0
+
+    def set(self, prop, value):
+        return False #nothing to change on a recording
+
+    def isOpened(self):
+        return True
+
+    def release(self):
+        pass
+
+    def position(self):
+        return 'frame ' + str(self.index + 1) + '/' + str(len(self.reader)) + ' (id ' + str(self.reader.frame_ids[self.index]) + ')'
+
+class ReplayLog(Playback):
+    '''Plays a measurement log back into a history, handing over the records as the clock
+    passes them. Seeking loads only the span before the new time through the chunk index.'''
+    def __init__(self, reader):
+        start, end = reader.time_range()
+        Playback.__init__(self, start, end)
+        self.reader = reader
+        self.sent = start - 1. #time of the last record handed over
+
+    def due(self):
+        '''The records the clock has passed since the last call, or None if there are none.'''
+        self.tick()
+        if self.time <= self.sent:
+            return None
+        records = self.reader.query(self.sent, self.time)
+        records = records[records['time'] > self.sent] #the last record handed over is not sent twice
+        self.sent = self.time
+        return records
+
+    def rewind(self, span):
+        '''The span seconds of records up to the clock, to refill the history after a seek.'''
+        self.sent = self.time
+        return self.reader.query(self.time - span, self.time)
+
+    def step(self, n):
+        self.play(False)
+        times = self.reader.query(self.time - 60, self.time + 60)['time'] #records within a minute either way
+        i = np.searchsorted(times, self.time, 'right') - 1 + n
+        if 0 <= i < len(times):
+            Playback.seek(self, times[i])
+
+    def position(self):
+        return '{0:.2f}'.format(self.time - self.start) + ' s / ' + '{0:.2f}'.format(self.end - self.start) + ' s'
+
+class ReplayStats():
+    '''Keeps the running statistics and allan deviation of a log replay up to the playback time
+    without reading the log from the start after each seek. Going forward, only the records
+    passed are added. On the way, copies of the state are kept every spacing records, at most
+    max_checkpoints of them (the spacing doubles when there would be more), so going back
+    starts from the nearest copy before the new time and reads at most spacing records.'''
+    def __init__(self, reader, stats, allan, spacing=2**16, max_checkpoints=64):
+        self.reader = reader
+        self.stats, self.allan = stats, allan
+        self.spacing = spacing
+        self.max_checkpoints = max_checkpoints
+        self.n, self.time = 0, -np.inf #records added so far, and the time of the last
+        self.checkpoints = [(0, -np.inf, copy.deepcopy(stats), copy.deepcopy(allan))]
+
+    def add(self, records):
+        '''Adds records that follow on from the last ones, e.g. those a replay hands over.'''
+        records = records[records['time'] > self.time]
+        if len(records) == 0:
+            return
+        self.stats.add(records)
+        self.allan.add(records)
+        self.n += len(records)
+        self.time = records['time'][-1]
+        if self.n - self.checkpoints[-1][0] >= self.spacing:
+            self.checkpoints.append((self.n, self.time, copy.deepcopy(self.stats), copy.deepcopy(self.allan)))
+            if len(self.checkpoints) > self.max_checkpoints:
+                self.checkpoints = self.checkpoints[::2] #keeps the start, so there is always one to go back to
+                self.spacing *= 2
+
+    def seek(self, t):
+        '''Brings the statistics to the records up to time t. Returns (stats, allan), which are new
+        objects after going back.'''
+        if t < self.time:
+            i = max(i for i, c in enumerate(self.checkpoints) if c[1] <= t)
+            self.n, self.time = self.checkpoints[i][:2]
+            self.stats, self.allan = copy.deepcopy(self.checkpoints[i][2]), copy.deepcopy(self.checkpoints[i][3])
+            self.checkpoints = self.checkpoints[:i+1] #later ones are taken again on the way forward
+        start = None if self.time == -np.inf else self.time
+        for block in self.reader.blocks(start, t):
+            self.add(block)
+        return self.stats, self.allan
@@ -17,15 +17,11 @@ except ImportError:
     
 import numpy as np
 import math
-
-from scipy.optimize import curve_fit
-from scipy.ndimage.interpolation import zoom
+import time
 
 from . import interface, output
 
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2TkAgg
-import matplotlib.pyplot as plt
-from matplotlib.ticker import MultipleLocator, FormatStrFormatter
+# matplotlib and scipy are imported when the first plot window opens, keeping them out of startup
 
 figures = 0
 
@@ -73,9 +69,12 @@ class WorkspaceManager(tk.Frame):
         for window, instance in zip(self.windows, self.instances):
             w, h, x, y  = [float(i) for i in window.geometry().replace('x','+').split('+')]
             if instance.windowtype == 'plot':
-                geometry.append((w/self.ws, h/self.hs, x/self.ws, y/self.hs, instance.windowtype, instance.fig_type))
+                entry = (w/self.ws, h/self.hs, x/self.ws, y/self.hs, instance.windowtype, instance.fig_type)
             else:
-                geometry.append((w/self.ws, h/self.hs, x/self.ws, y/self.hs, instance.windowtype))
+                entry = (w/self.ws, h/self.hs, x/self.ws, y/self.hs, instance.windowtype)
+            if window.state() == 'iconic': #restored minimised, so a plot is not drawn until it is opened
+                entry += ('iconic',)
+            geometry.append(entry)
         return geometry
         
     def save_workspace(self):
@@ -106,9 +105,13 @@ class WorkspaceManager(tk.Frame):
             self.show_all()
         else:
             self.close_all()
+            iconic = []
             for window in workspace:
                 ws = self.parent.winfo_screenwidth()
                 hs = self.parent.winfo_screenheight()
+                minimised = window[-1] == 'iconic'
+                if minimised:
+                    window = window[:-1]
                 if len(window) == 6:
                     w, h, x, y, windowtype, graphtype = window
                 else:
@@ -132,7 +135,9 @@ class WorkspaceManager(tk.Frame):
                 else:
                     self.log('Error couldnt find window to be opened! '+ windowtype)
                 self.instances.append(t)
-            self.show_all()
+                if minimised:
+                    iconic.append(t.window)
+            self.show_all(skip=iconic)
             self.log('Loaded workspace!')
         
     def create_window(self, windowtype):
@@ -158,10 +163,14 @@ class WorkspaceManager(tk.Frame):
             
         return t
         
-    def show_all(self):
+    def show_all(self, skip=()):
+        '''Shows every window, except those in skip, which are minimised.'''
         for window in self.windows:
-            window.state(newstate='normal')
-            window.deiconify()
+            if window in skip:
+                window.iconify()
+            else:
+                window.state(newstate='normal')
+                window.deiconify()
                 
     def close_all(self):
         instances = list(self.instances)
@@ -229,7 +238,46 @@ class PlotView(NewWindow, tk.Frame):
         self.windowtype = 'plot'
         self.fig_type = graphtype
         self.window.wm_title(self.fig_type)
-        self.init_frame()
+        self.fig = None #the figure is built when the window is first seen
+        self.building = None #after_idle job that builds it
+        self.mapped, self.obscured = False, False
+        self.window.bind('<Map>', self.on_map)
+        self.window.bind('<Unmap>', self.on_unmap)
+        self.window.bind('<Visibility>', self.on_visibility)
+        
+    def on_map(self, event):
+        if event.widget is not self.window: #child widgets' events reach the toplevel's bindings too
+            return
+        self.mapped = True
+        if self.fig is None:
+            self.build_later()
+        else:
+            self.refresh_frame() #catch up on what was missed while hidden
+            
+    def on_unmap(self, event):
+        if event.widget is self.window:
+            self.mapped = False
+            
+    def on_visibility(self, event):
+        if event.widget is self.window:
+            self.obscured = str(event.state) == 'VisibilityFullyObscured'
+            if self.fig is None:
+                self.build_later()
+
+    def build_later(self):
+        '''Builds the figure once Tk is idle, if the window can still be seen then. Windows mapped
+        while a workspace loads, but minimised or covered by then, wait until they are seen.'''
+        if self.building is None:
+            self.building = self.window.after_idle(self.build)
+
+    def build(self):
+        self.building = None
+        if self.fig is None and self.mapped and not self.obscured and self.window.state() != 'iconic':
+            self.init_frame()
+            
+    def is_shown(self):
+        '''Whether the figure exists and can be seen, so is worth redrawing.'''
+        return self.fig is not None and self.mapped and not self.obscured
         
     def init_frame(self):
         global figures
@@ -263,6 +311,8 @@ class PlotView(NewWindow, tk.Frame):
             b.pack(fill=tk.BOTH)
             
         #now create matplotlib figure
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2TkAgg
+        import matplotlib.pyplot as plt
         plt.clf()
         plt.cla()
         
@@ -284,6 +334,8 @@ class PlotView(NewWindow, tk.Frame):
         
     def refresh_frame(self):
         '''Updates the matplotlib figure with new data.'''
+        import matplotlib.pyplot as plt
+        from scipy.optimize import curve_fit
         fig = plt.figure(self.fig_num)
         self.ax = fig.gca()
 
@@ -341,7 +393,7 @@ class PlotView(NewWindow, tk.Frame):
                 elif self.parent.colourmap == 1:
                     self.cmap=plt.cm.bone
                 elif self.parent.colourmap == 12:
-                    self.cmap=output.parula_cm
+                    self.cmap=output.parula_cm()
                         
                 if str(self.parent.MA) != 'nan':
                     size = 2*int(self.parent.MA)+10
@@ -402,39 +454,63 @@ class PlotView(NewWindow, tk.Frame):
                 self.convert_axes(self.ax, x=True, y=True)
                 
                 xlabels = np.array(self.ax.get_xticks().tolist())
-                self.ax.set_xticklabels([int(i)+((self.parent.peak_cross[0]-(size/2))*self.parent.pixel_scale) for i in xlabels])
+                self.ax.set_xticklabels([int(i)+((self.parent.peak_cross[0]-(size/2))*self.parent.frame_pixel_scale()) for i in xlabels])
                 ylabels = np.array(self.ax.get_yticks().tolist())
-                self.ax.set_yticklabels([int(i)+((self.parent.peak_cross[1]-(size/2))*self.parent.pixel_scale) for i in ylabels])
+                self.ax.set_yticklabels([int(i)+((self.parent.peak_cross[1]-(size/2))*self.parent.frame_pixel_scale()) for i in ylabels])
         elif self.fig_type == 'beam stability':
             self.ax.set_xlabel('$position$ $/\mu m$'); self.ax.set_ylabel('$position$ $/\mu m$')
-            if self.parent.graphs['centroid']: self.ax.plot(self.parent.centroid_hist_x, self.parent.centroid_hist_y, 'r-', label='centroid')
-            if self.parent.graphs['peak cross']: self.ax.plot(self.parent.peak_hist_x, self.parent.peak_hist_y, 'b-', label='peak cross')
-            self.ax.set_xlim(0, self.parent.width); self.ax.set_ylim(self.parent.height, 0)
-            self.convert_axes(self.ax, x=True, y=True)
+            hist = self.parent.history
+            parts = hist.parts() #views of each tier, so the whole session is not copied every tick
+            if self.parent.graphs['centroid']: self.plot_parts(parts, 'centroid_x', 'centroid_y', 'r-', 'centroid')
+            if self.parent.graphs['peak cross']: self.plot_parts(parts, 'peak_x', 'peak_y', 'b-', 'peak cross')
+            self.ax.set_xlim(0, self.parent.sensor_width); self.ax.set_ylim(self.parent.sensor_height, 0)
+            self.convert_axes(self.ax, x=True, y=True, scale=self.parent.pixel_scale) #history is in pixels of the configured resolution
             self.ax.plot([0,0],'w.',label=''); self.ax.legend(frameon=False)
+        elif self.fig_type == 'allan deviation':
+            self.ax.set_xlabel('$averaging$ $time$ $/s$'); self.ax.set_ylabel('$allan$ $deviation$ $/\mu m$')
+            tau, adev = self.parent.allan.deviation() #kept up to date as records arrive, so cheap to draw
+            if len(tau) > 0:
+                labels = ['centroid x', 'centroid y', 'peak x', 'peak y', 'width x', 'width y']
+                for i, style in enumerate(['bo-', 'ro-', 'yo-', 'go-', 'co-', 'mo-']):
+                    if not np.all(np.isnan(adev[:, i])):
+                        self.ax.loglog(tau, adev[:, i]*self.parent.pixel_scale, style, label=labels[i]) #history is in pixels of the configured resolution
+                self.ax.legend(frameon=False)
         elif self.fig_type == 'positions':
             self.ax.set_xlabel('$time$ $/s$'); self.ax.set_ylabel('$position$ $/\mu m$')
-            if len(self.parent.running_time) > 0:
-                if self.parent.graphs['centroid_x']: self.ax.plot(self.parent.running_time-self.parent.running_time[0], self.parent.centroid_hist_x, 'b-', label='centroid x coordinate')
-                if self.parent.graphs['centroid_y']: self.ax.plot(self.parent.running_time-self.parent.running_time[0], self.parent.centroid_hist_y, 'r-', label='centroid y coordinate')
-                if self.parent.graphs['peak_x']: self.ax.plot(self.parent.running_time-self.parent.running_time[0], self.parent.peak_hist_x, 'y-', label='peak x coordinate')
-                if self.parent.graphs['peak_y']: self.ax.plot(self.parent.running_time-self.parent.running_time[0], self.parent.peak_hist_y, 'g-', label='peak y coordinate')
-                if self.parent.running_time[-1] - self.parent.running_time[0] <= 60:
-                    self.ax.set_xlim(0, 60)
-                else:
-                    index = np.searchsorted(self.parent.running_time,[self.parent.running_time[-1]-60,],side='right')[0]
-                    self.ax.set_xlim(self.parent.running_time[index]-self.parent.running_time[0], self.parent.running_time[-1]-self.parent.running_time[0])
-                self.convert_axes(self.ax, y=True)
+            hist = self.parent.history
+            if len(hist) > 0:
+                t, recent = self.recent_window(hist) #only the samples on show are plotted
+                if self.parent.graphs['centroid_x']: self.ax.plot(t, recent['centroid_x'], 'b-', label='centroid x coordinate')
+                if self.parent.graphs['centroid_y']: self.ax.plot(t, recent['centroid_y'], 'r-', label='centroid y coordinate')
+                if self.parent.graphs['peak_x']: self.ax.plot(t, recent['peak_x'], 'y-', label='peak x coordinate')
+                if self.parent.graphs['peak_y']: self.ax.plot(t, recent['peak_y'], 'g-', label='peak y coordinate')
+                self.convert_axes(self.ax, y=True, scale=self.parent.pixel_scale)
                 self.ax.plot([0,0],'w.',label=''); self.ax.legend(frameon=False)
         elif self.fig_type == 'orientation':
             self.ax.set_xlabel('$time$ $/s$'); self.ax.set_ylabel('$angle$ $/deg$')
-            if len(self.parent.running_time) > 0:
-                if self.parent.graphs['ellipse_orientation']: self.ax.plot(self.parent.running_time-self.parent.running_time[0], self.parent.ellipse_hist_angle, 'c-', label='ellipse orientation')
-                if self.parent.running_time[-1] - self.parent.running_time[0] <= 60:
-                    self.ax.set_xlim(0, 60)
-                else:
-                    index = np.searchsorted(self.parent.running_time,[self.parent.running_time[-1]-60,],side='right')[0]
-                    self.ax.set_xlim(self.parent.running_time[index]-self.parent.running_time[0], self.parent.running_time[-1]-self.parent.running_time[0])
+            hist = self.parent.history
+            if len(hist) > 0:
+                t, recent = self.recent_window(hist) #only the samples on show are plotted
+                if self.parent.graphs['ellipse_orientation']: self.ax.plot(t, recent['angle'], 'c-', label='ellipse orientation')
+            self.ax.plot([0,0],'w.',label=''); self.ax.legend(frameon=False)
+        elif self.fig_type == 'histogram':
+            self.ax.set_xlabel('$pixel$ $value$'); self.ax.set_ylabel('$pixel$ $count$')
+            hist = self.parent.analyse.hist
+            self.ax.plot(np.arange(len(hist)), hist, 'k-', drawstyle='steps-mid', label='intensity')
+            self.ax.axvline(self.parent.analyse.otsu, color='g', ls='--', label='otsu threshold')
+            if self.parent.saturated_pixels > 0:
+                self.ax.axvline(255, color='r', lw=2, label='saturated ('+'{0:.2f}'.format(100*self.parent.saturated_fraction)+'%)')
+            self.ax.set_xlim(0, 255)
+            self.ax.set_yscale('symlog')
+            self.ax.legend(frameon=False)
+        elif self.fig_type == 'pointing':
+            self.ax.set_xlabel('$time$ $/s$'); self.ax.set_ylabel('$angle$ $/mrad$')
+            hist = self.parent.history
+            if len(hist) > 0:
+                t, recent = self.recent_window(hist) #only the samples on show are plotted
+                self.ax.plot(t, recent['pointing_x'], 'b-', label='pointing x')
+                self.ax.plot(t, recent['pointing_y'], 'r-', label='pointing y')
+                self.ax.plot(t, recent['divergence'], 'g-', label='divergence')
             self.ax.plot([0,0],'w.',label=''); self.ax.legend(frameon=False)
         else:
             self.parent.log('Fig type not found. ' + self.fig_type)
@@ -446,20 +522,42 @@ class PlotView(NewWindow, tk.Frame):
         for axis in self.fig.get_axes():
             axis.clear()
             
-    def convert_axes(self, ax, x=False, y=False):
+    def plot_parts(self, parts, x, y, style, label):
+        '''Plots y against x over the parts of the history as one line, joining each part to the
+        next.'''
+        for i, part in enumerate(parts):
+            self.ax.plot(part[x], part[y], style, label=label if i == 0 else None)
+            if i > 0:
+                self.ax.plot([parts[i-1][x][-1], part[x][0]], [parts[i-1][y][-1], part[y][0]], style)
+
+    def recent_window(self, hist, seconds=60):
+        '''The last seconds of the history with their times from the start of the run, setting
+        the x axis to show them.'''
+        first, last = hist.time_range()
+        recent = hist.window(last - seconds)
+        end = max(last - first, seconds)
+        self.ax.set_xlim(end - seconds, end)
+        return recent['time'] - first, recent
+
+    def convert_axes(self, ax, x=False, y=False, scale=None):
+        if scale is None:
+            scale = self.parent.frame_pixel_scale()
         if x:
-            xlabels = np.array(ax.get_xticks().tolist())*self.parent.pixel_scale
+            xlabels = np.array(ax.get_xticks().tolist())*scale
             ax.set_xticklabels([int(i) for i in xlabels])
         if y:
-            ylabels = np.array(ax.get_yticks().tolist())*self.parent.pixel_scale
+            ylabels = np.array(ax.get_yticks().tolist())*scale
             ax.set_yticklabels([int(i) for i in ylabels])
         
     def close(self):
-        fig = plt.figure(self.fig_num)
         for plot in self.parent.plot_frames:
             if plot.fig_type == self.fig_type:
                 self.parent.plot_frames.remove(plot)
-        fig.clf()
+        if self.building is not None:
+            self.window.after_cancel(self.building)
+        if self.fig is not None:
+            import matplotlib.pyplot as plt
+            plt.figure(self.fig_num).clf()
         self.close_newwindow(self)
         self.window.destroy()
         
@@ -549,7 +647,8 @@ class InfoView(NewWindow):
                 
         self.passfail_frame = None
         
-        self.tree = ttk.Treeview(self.window,columns=("Unit","Value","Pass/Fail Test","Min.","Max.","Min.","Max."))
+        self.stats_windowed = False #statistics of the whole session, or of the last stats_window records
+        self.tree = ttk.Treeview(self.window,columns=("Unit","Value","Pass/Fail Test","Min.","Max.","Min.","Max.","Mean ± σ","Range"))
         self.tree.heading("#0", text='Parameter', anchor=tk.W)
         self.tree.column("#0", stretch=0)
         self.tree.heading("#1", text='Unit', anchor=tk.W)
@@ -566,6 +665,10 @@ class InfoView(NewWindow):
         self.tree.column("#6",  minwidth=0, width=65, stretch=1)
         self.tree.heading("#7", text='Max.', anchor=tk.W)
         self.tree.column("#7",  minwidth=0, width=65, stretch=1)
+        self.tree.heading("#8", text='Mean ± σ', anchor=tk.W)
+        self.tree.column("#8",  minwidth=0, width=150, stretch=1)
+        self.tree.heading("#9", text='Range', anchor=tk.W)
+        self.tree.column("#9",  minwidth=0, width=150, stretch=1)
 
         if self.parent.beam_width is None:
             self.parent.beam_width = (np.nan, np.nan)
@@ -580,7 +683,7 @@ class InfoView(NewWindow):
         self.raw_rows = ["Beam Width (4σ)", "Beam Width (1/e²)", "Beam Diameter (4σ)", "Peak Pixel Value", "Peak Position", "Centroid Position", "Power Density"]
         self.raw_units = ["µm","µm","µm"," ","µm","µm","W/µm²"]
         square = lambda x: x**2 if x is not None else np.nan
-        self.raw_values = ['(' + self.info_format(self.parent.beam_width[0], convert=True) + ', ' + self.info_format(self.parent.beam_width[1], convert=True) + ')', '(' + self.info_format(self.parent.beam_width_e2[0], convert=True) + ', ' + self.info_format(self.parent.beam_width_e2[1], convert=True) + ')', self.info_format(self.parent.beam_diameter, convert=True), self.info_format(np.max(self.parent.analysis_frame)), '(' + self.info_format(self.parent.peak_cross[0], convert=True) + ', ' + self.info_format(self.parent.peak_cross[1], convert=True) + ')', '(' + self.info_format(self.parent.centroid[0], convert=True) + ', ' + self.info_format(self.parent.centroid[1], convert=True) + ')', "{:.2E}".format((255000/square(self.parent.beam_diameter))*self.parent.power)]
+        self.raw_values = ['(' + self.info_format(self.parent.beam_width[0], convert=True) + ', ' + self.info_format(self.parent.beam_width[1], convert=True) + ')', '(' + self.info_format(self.parent.beam_width_e2[0], convert=True) + ', ' + self.info_format(self.parent.beam_width_e2[1], convert=True) + ')', self.info_format(self.parent.beam_diameter, convert=True), self.info_format(self.parent.peak_value), '(' + self.info_format(self.parent.peak_cross[0], convert=True) + ', ' + self.info_format(self.parent.peak_cross[1], convert=True) + ')', '(' + self.info_format(self.parent.centroid[0], convert=True) + ', ' + self.info_format(self.parent.centroid[1], convert=True) + ')', "{:.2E}".format((255000/square(self.parent.beam_diameter))*self.parent.power)]
         self.ellipse_rows = ["Ellipse axes", "Ellipticity", "Eccentricity", "Orientation"]
         self.ellipse_units = ["µm", " ", " ", "deg"]
         self.ellipse_values = ['(' + self.info_format(self.parent.MA, convert=True) + ', ' + self.info_format(self.parent.ma, convert=True) + ')', self.info_format(self.parent.ellipticity), self.info_format(self.parent.eccentricity), self.info_format(self.parent.ellipse_angle)]
@@ -588,8 +691,8 @@ class InfoView(NewWindow):
                         ('x ≥ 0.00', 'x ≤ 0.00'),
                         ('0.00', '0.00'),
                         ('0.00', '255.00'),
-                        ('x ≥ 0.00', 'x ≤ ' + '{0:.2f}'.format(self.parent.width*self.parent.pixel_scale)),
-                        ('x ≥ 0.00', 'x ≤ ' + '{0:.2f}'.format(self.parent.width*self.parent.pixel_scale)),
+                        ('x ≥ 0.00', 'x ≤ ' + '{0:.2f}'.format(self.parent.width*self.parent.frame_pixel_scale())),
+                        ('x ≥ 0.00', 'x ≤ ' + '{0:.2f}'.format(self.parent.width*self.parent.frame_pixel_scale())),
                         ('0.00', '0.00')
                         ]
         self.ellipse_xbounds = [('M ≥ 0.00', 'M ≤ 0.00'),
@@ -601,8 +704,8 @@ class InfoView(NewWindow):
                         ('y ≥ 0.00', 'y ≤ 0.00'),
                         (' ', ' '),
                         (' ', ' '),
-                        ('y ≥ 0.00', 'y ≤ ' + '{0:.2f}'.format(self.parent.height*self.parent.pixel_scale)),
-                        ('y ≥ 0.00', 'y ≤ ' + '{0:.2f}'.format(self.parent.height*self.parent.pixel_scale)),
+                        ('y ≥ 0.00', 'y ≤ ' + '{0:.2f}'.format(self.parent.height*self.parent.frame_pixel_scale())),
+                        ('y ≥ 0.00', 'y ≤ ' + '{0:.2f}'.format(self.parent.height*self.parent.frame_pixel_scale())),
                         (' ', ' ')
                         ]
         self.ellipse_ybounds = [('m ≥ 0.00', 'm ≤ 0.00'),
@@ -610,14 +713,19 @@ class InfoView(NewWindow):
                         (' ', ' '),
                         (' ', ' ')
                         ]
+        self.raw_metrics = [[('width', 0), ('width', 1)], [('width_e2', 0), ('width_e2', 1)], [], [], #running statistics shown for each row
+                        [('peak_x', None), ('peak_y', None)], [('centroid_x', None), ('centroid_y', None)], []]
+        self.ellipse_metrics = [[('MA', None), ('ma', None)], [('ellipticity', None)], [('eccentricity', None)], [('angle', None)]]
+        raw_stats = self.stats_columns(self.raw_metrics, self.raw_units)
+        ellipse_stats = self.stats_columns(self.ellipse_metrics, self.ellipse_units)
                         
         self.tree.insert("",iid="1", index="end",text="Raw Data Measurement")
         for i in range(len(self.raw_rows)):
-            self.tree.insert("1",iid="1"+str(i), index="end", text=self.raw_rows[i], value=(self.raw_units[i], self.raw_values[i], self.parent.raw_passfail[i], self.raw_xbounds[i][0], self.raw_xbounds[i][1], self.raw_ybounds[i][0], self.raw_ybounds[i][1]))
+            self.tree.insert("1",iid="1"+str(i), index="end", text=self.raw_rows[i], value=(self.raw_units[i], self.raw_values[i], self.parent.raw_passfail[i], self.raw_xbounds[i][0], self.raw_xbounds[i][1], self.raw_ybounds[i][0], self.raw_ybounds[i][1]) + raw_stats[i])
         self.tree.see("14")
         self.tree.insert("",iid="2", index="end",text="Ellipse (fitted)")
         for i in range(len(self.ellipse_rows)):
-            self.tree.insert("2",iid="2"+str(i), index="end", text=self.ellipse_rows[i], value=(self.ellipse_units[i], self.ellipse_values[i], self.parent.ellipse_passfail[i], self.ellipse_xbounds[i][0], self.ellipse_xbounds[i][1], self.ellipse_ybounds[i][0], self.ellipse_ybounds[i][1]))
+            self.tree.insert("2",iid="2"+str(i), index="end", text=self.ellipse_rows[i], value=(self.ellipse_units[i], self.ellipse_values[i], self.parent.ellipse_passfail[i], self.ellipse_xbounds[i][0], self.ellipse_xbounds[i][1], self.ellipse_ybounds[i][0], self.ellipse_ybounds[i][1]) + ellipse_stats[i])
         self.tree.see("23")
         
         self.tree.pack(expand=True,fill=tk.BOTH)
@@ -628,6 +736,10 @@ class InfoView(NewWindow):
         button_pf.pack(padx=5, pady=20, side=tk.LEFT)
         button_edit = tk.Button(self.window, text="edit", command=lambda: self.edit())
         button_edit.pack(padx=5, pady=20, side=tk.LEFT)
+        button_stats = tk.Button(self.window, text="session/window statistics", command=lambda: self.toggle_stats())
+        button_stats.pack(padx=5, pady=20, side=tk.LEFT)
+        button_reset = tk.Button(self.window, text="reset statistics", command=lambda: self.reset_stats())
+        button_reset.pack(padx=5, pady=20, side=tk.LEFT)
         self.refresh_frame()
     
     def refresh_frame(self):
@@ -641,22 +753,59 @@ class InfoView(NewWindow):
             self.parent.centroid = (np.nan, np.nan)
             
         square = lambda x: x**2 if x is not None else np.nan #3e-15 power dens before sat
-        self.raw_values = ['(' + self.info_format(self.parent.beam_width[0], convert=True) + ', ' + self.info_format(self.parent.beam_width[1], convert=True) + ')', '(' + self.info_format(self.parent.beam_width_e2[0], convert=True) + ', ' + self.info_format(self.parent.beam_width_e2[1], convert=True) + ')', self.info_format(self.parent.beam_diameter, convert=True), self.info_format(np.max(self.parent.analysis_frame)), '(' + self.info_format(self.parent.peak_cross[0], convert=True) + ', ' + self.info_format(self.parent.peak_cross[1], convert=True) + ')', '(' + self.info_format(self.parent.centroid[0], convert=True) + ', ' + self.info_format(self.parent.centroid[1], convert=True) + ')', "{:.2E}".format((255000/square(self.parent.beam_diameter))*self.parent.power)]
+        self.raw_values = ['(' + self.info_format(self.parent.beam_width[0], convert=True) + ', ' + self.info_format(self.parent.beam_width[1], convert=True) + ')', '(' + self.info_format(self.parent.beam_width_e2[0], convert=True) + ', ' + self.info_format(self.parent.beam_width_e2[1], convert=True) + ')', self.info_format(self.parent.beam_diameter, convert=True), self.info_format(self.parent.peak_value), '(' + self.info_format(self.parent.peak_cross[0], convert=True) + ', ' + self.info_format(self.parent.peak_cross[1], convert=True) + ')', '(' + self.info_format(self.parent.centroid[0], convert=True) + ', ' + self.info_format(self.parent.centroid[1], convert=True) + ')', "{:.2E}".format((255000/square(self.parent.beam_diameter))*self.parent.power)]
         self.ellipse_values = ['(' + self.info_format(self.parent.MA, convert=True) + ', ' + self.info_format(self.parent.ma, convert=True) + ')', self.info_format(self.parent.ellipticity), self.info_format(self.parent.eccentricity), self.info_format(self.parent.ellipse_angle)]
+        raw_stats = self.stats_columns(self.raw_metrics, self.raw_units)
+        ellipse_stats = self.stats_columns(self.ellipse_metrics, self.ellipse_units)
+        span = 'last ' + str(self.parent.stats.window) if self.stats_windowed else 'session'
+        self.tree.heading("#8", text='Mean ± σ (' + span + ')')
+        self.tree.heading("#9", text='Range (' + span + ')')
 
         self.tree.delete(*self.tree.get_children())
         self.tree.insert("",iid="1", index="end",text="Raw Data Measurement")
         for i in range(len(self.raw_rows)):
-            self.tree.insert("1",iid="1"+str(i), index="end", text=self.raw_rows[i], value=(self.raw_units[i], self.raw_values[i], self.parent.raw_passfail[i], self.raw_xbounds[i][0], self.raw_xbounds[i][1], self.raw_ybounds[i][0], self.raw_ybounds[i][1]))
+            self.tree.insert("1",iid="1"+str(i), index="end", text=self.raw_rows[i], value=(self.raw_units[i], self.raw_values[i], self.parent.raw_passfail[i], self.raw_xbounds[i][0], self.raw_xbounds[i][1], self.raw_ybounds[i][0], self.raw_ybounds[i][1]) + raw_stats[i])
         self.tree.see("14")
         self.tree.insert("",iid="2", index="end",text="Ellipse (fitted)")
         for i in range(len(self.ellipse_rows)):
-            self.tree.insert("2",iid="2"+str(i), index="end", text=self.ellipse_rows[i], value=(self.ellipse_units[i], self.ellipse_values[i], self.parent.ellipse_passfail[i], self.ellipse_xbounds[i][0], self.ellipse_xbounds[i][1], self.ellipse_ybounds[i][0], self.ellipse_ybounds[i][1]))
+            self.tree.insert("2",iid="2"+str(i), index="end", text=self.ellipse_rows[i], value=(self.ellipse_units[i], self.ellipse_values[i], self.parent.ellipse_passfail[i], self.ellipse_xbounds[i][0], self.ellipse_xbounds[i][1], self.ellipse_ybounds[i][0], self.ellipse_ybounds[i][1]) + ellipse_stats[i])
         self.tree.see("23")
+        if self.parent.full_res_width is not None or self.parent.full_res_width_e2 is not None: #latest measurement of dual resolution mode, already in um
+            stamp = time.strftime('%H:%M:%S', time.localtime(self.parent.last_full_res))
+            self.tree.insert("",iid="3", index="end",text="Full Resolution (" + stamp + ")")
+            for i, widths in enumerate((self.parent.full_res_width, self.parent.full_res_width_e2)):
+                value = '-' if widths is None else '(' + self.info_format(widths[0]) + ', ' + self.info_format(widths[1]) + ')'
+                self.tree.insert("3",iid="3"+str(i), index="end", text=self.raw_rows[i], value=(self.raw_units[i], value))
 
         self.tree.selection_set(self.curr_item)
         self.tree.focus(self.curr_item)
         
+    def stats_columns(self, rows, units):
+        '''Mean ± σ and min to max of each row's metrics from the running statistics, with
+        lengths (logged in pixels of the configured resolution) in um.'''
+        n, mean, std, low, high = self.parent.stats.summary(self.stats_windowed)
+        columns = []
+        for metrics, unit in zip(rows, units):
+            scale = self.parent.pixel_scale if unit == "µm" else 1.
+            fmt = lambda v: '-' if np.isnan(v) else '{0:.2f}'.format(v*scale)
+            indices = [self.parent.stats.components.index(metric) for metric in metrics]
+            spread = ', '.join(fmt(mean[i]) + ' ± ' + fmt(std[i]) for i in indices)
+            extent = ', '.join(fmt(low[i]) + ' to ' + fmt(high[i]) for i in indices)
+            if len(indices) > 1:
+                spread, extent = '(' + spread + ')', '(' + extent + ')'
+            columns.append((spread or '-', extent or '-'))
+        return columns
+
+    def toggle_stats(self):
+        if self.parent.stats.window is not None:
+            self.stats_windowed = not self.stats_windowed
+        self.refresh_frame()
+
+    def reset_stats(self):
+        self.parent.log('resetting the running statistics')
+        self.parent.stats.reset()
+        self.refresh_frame()
+
     def pass_fail(self):
         selected_item = self.tree.selection()
         if len(selected_item) == 1:
@@ -718,7 +867,7 @@ class InfoView(NewWindow):
     def info_format(self, param, convert=False, dp=2):
         '''Format data to 2.d.p and converts from pixels to um if needed.'''
         if convert:
-            convert_factor = float(self.pixel_scale)
+            convert_factor = float(self.parent.frame_pixel_scale())
         else:
             convert_factor = 1
             